@@ -0,0 +1,42 @@
+#!/usr/bin/python
+# Compares the nodes visited and the time of TemplateParser.resolve() with evaluating a compiled plan,
+# which only walks the dynamic values recorded in its index.
+#
+#   python benchmarks/bench_index.py [resources ...]
+
+from os.path import dirname, realpath, join
+import copy
+import sys
+import time
+
+sys.path.insert(0, join(dirname(realpath(__file__)), '..'))
+sys.path.insert(0, dirname(realpath(__file__)))
+
+from resolve import TemplateParser, TemplateContext
+from getatt_dummy import get_attribute
+from generator import generate_template
+from plan import compile
+from stats import Stats
+
+def main():
+    context = TemplateContext("123456789012", "eu-west-1", "bench")
+    for resources in [int(arg) for arg in sys.argv[1:]] or [100, 1000]:
+        template = generate_template(resources, depth=2, sub_placeholders=4, statements=20, tags=50)
+        stats = Stats()
+        parser = TemplateParser(context, copy.deepcopy(template), get_attribute=get_attribute, use_parameter_defaults=True, stats=stats)
+        parser.resolve()
+        plan = compile(template)
+        plan_stats = Stats()
+        plan.evaluate(context, get_attribute, use_parameter_defaults=True, stats=plan_stats)
+        data = copy.deepcopy(template)
+        start = time.perf_counter()
+        TemplateParser(context, data, get_attribute=get_attribute, use_parameter_defaults=True).resolve()
+        full = time.perf_counter() - start
+        start = time.perf_counter()
+        plan.evaluate(context, get_attribute, use_parameter_defaults=True)
+        indexed = time.perf_counter() - start
+        print(f"{resources} resources: {stats.nodes} nodes visited by resolve(), {plan_stats.nodes} with the index "
+              f"({stats.nodes / plan_stats.nodes:.1f}x), {full * 1000:.1f}ms vs {indexed * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# Compares the iterative TemplateParser.json_extract with the recursive walker it replaced.
+#
+#   python benchmarks/bench_json_extract.py [resources ...]
+
+from os.path import dirname, realpath, join
+import copy
+import gc
+import sys
+import time
+
+sys.path.insert(0, join(dirname(realpath(__file__)), '..'))
+
+from resolve import TemplateParser, TemplateContext, is_ref, is_intrinsic
+from getatt_dummy import get_attribute
+
+def recursive_json_extract(self, obj, root=None, key=None):
+    # the recursive walker as it was before the explicit stack
+    def extract(obj, root, key):
+        if isinstance(obj, dict):
+            if is_ref(obj):
+                root[key] = self.resolve_ref(obj['Ref'])
+            elif is_intrinsic(obj):
+                root[key] = self.intrinsic(obj)
+            else:
+                for k in list(obj.keys()):
+                    v = obj[k]
+                    if is_ref(v):
+                        if v.get('Ref', None) == 'AWS::NoValue':
+                            del root[key][k]
+                        else:
+                            root[key][k] = self.resolve_ref(v['Ref'])
+                    elif isinstance(v, (dict, list)):
+                        extract(v, obj, k)
+                    elif isinstance(v, str):
+                        extract(v, obj, k)
+        elif isinstance(obj, list):
+            to_remove = []
+            for idx, item in enumerate(obj):
+                if is_ref(item):
+                    if item['Ref'] != "AWS::NoValue":
+                        obj[idx] = self.resolve_ref(item['Ref'])
+                    else:
+                        to_remove.append(idx)
+                        obj[idx] = ""
+                elif is_intrinsic(item):
+                    obj[idx] = self.intrinsic(item)
+                else:
+                    extract(item, obj, idx)
+            for idx in reversed(to_remove):
+                del obj[idx]
+        elif isinstance(obj, str) and obj.startswith("{{resolve:"):
+            root[key] = self.resolve_dynamic_reference(obj)
+
+    extract(obj, root or obj, key)
+
+def make_template(resources: int) -> dict:
+    template = {
+        "Parameters": { "Env": { "Type": "String", "Default": "dev" } },
+        "Conditions": { "IsDev": { "Fn::Equals": [ { "Ref": "Env" }, "dev" ] } },
+        "Resources": {}
+    }
+    for i in range(resources):
+        template["Resources"][f"Role{i}"] = {
+            "Type": "AWS::IAM::Role",
+            "Properties": {
+                "RoleName": { "Fn::Sub": "${Env}-role-" + str(i) },
+                "Path": { "Fn::If": [ "IsDev", "/dev/", { "Ref": "AWS::NoValue" } ] },
+                "AssumeRolePolicyDocument": {
+                    "Version": "2012-10-17",
+                    "Statement": [
+                        { "Effect": "Allow", "Principal": { "Service": [ "lambda.amazonaws.com" ] }, "Action": [ "sts:AssumeRole" ] }
+                    ]
+                },
+                "Policies": [
+                    {
+                        "PolicyName": f"policy-{j}",
+                        "PolicyDocument": {
+                            "Version": "2012-10-17",
+                            "Statement": [
+                                {
+                                    "Effect": "Allow",
+                                    "Action": [ f"s3:Action{k}" for k in range(5) ],
+                                    "Resource": [
+                                        { "Fn::Join": [ "", [ "arn:aws:s3:::bucket-", { "Ref": "AWS::AccountId" }, f"/{j}/*" ] ] },
+                                        f"arn:aws:s3:::static-{j}/*"
+                                    ],
+                                    "Condition": { "StringEquals": { "aws:RequestedRegion": [ "eu-west-1", "eu-central-1" ] } }
+                                }
+                            ]
+                        }
+                    }
+                    for j in range(5)
+                ],
+                "Tags": [ { "Key": f"tag{k}", "Value": f"value{k}" } for k in range(10) ]
+            }
+        }
+    return template
+
+def timed(walker, template, repeat=7) -> float:
+    best = None
+    for _ in range(repeat):
+        parser = TemplateParser(TemplateContext("123456789012", "eu-west-1", "Bench"), copy.deepcopy(template), get_attribute=get_attribute, use_parameter_defaults=True)
+        parser.mappings = parser.data.get("Mappings", {})
+        parser.get_parameters()
+        parser.get_conditions()
+        parser.get_resources()
+        gc.disable()
+        start = time.perf_counter()
+        walker(parser, parser.data)
+        elapsed = time.perf_counter() - start
+        gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def nesting_limit(walker) -> str:
+    value = "leaf"
+    for _ in range(2000):
+        value = [{ "Key": value }]
+    parser = TemplateParser(TemplateContext("123456789012", "eu-west-1", "Bench"), { "Resources": {} }, get_attribute=get_attribute)
+    try:
+        walker(parser, value)
+        return "ok"
+    except RecursionError:
+        return "RecursionError"
+
+def main(sizes):
+    print(f"{'resources':>10} {'recursive':>12} {'iterative':>12} {'speedup':>8}")
+    for size in sizes:
+        template = make_template(size)
+        old = timed(recursive_json_extract, template)
+        new = timed(TemplateParser.json_extract, template)
+        print(f"{size:>10} {old * 1000:>10.1f}ms {new * 1000:>10.1f}ms {old / new:>7.2f}x")
+    print(f"nesting depth 4000: recursive {nesting_limit(recursive_json_extract)}, iterative {nesting_limit(TemplateParser.json_extract)}")
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000])
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# Times resolving one large template with parallel.resolve_parallel for a number of worker processes
+# against TemplateParser.resolve().
+#
+#   python benchmarks/bench_parallel.py [resources] [cluster]
+
+from concurrent.futures import ProcessPoolExecutor
+from os.path import dirname, realpath, join
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, join(dirname(realpath(__file__)), '..'))
+sys.path.insert(0, dirname(realpath(__file__)))
+
+from resolve import TemplateParser, TemplateContext, derived_stack_id
+from getatt_dummy import get_attribute
+from generator import generate_template
+from parallel import resolve_parallel
+
+def main():
+    resources = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    cluster = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    template = generate_template(resources, cluster=cluster)
+    context = TemplateContext("123456789012", "eu-west-1", "bench")
+    context.stack_id = derived_stack_id(context)
+    start = time.perf_counter()
+    parser = TemplateParser(context, template, get_attribute=get_attribute, use_parameter_defaults=True, in_place=False)
+    parser.resolve()
+    serial = time.perf_counter() - start
+    expected = json.dumps(parser.data)
+    print(f"{resources} resources in groups of {cluster}, serial: {serial * 1000:.0f}ms")
+    for workers in sorted({1, 2, 4, os.cpu_count()}):
+        # the pool is started up front, like it would be when many templates are flattened
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(abs, range(workers)))
+            start = time.perf_counter()
+            data = resolve_parallel(context, template, get_attribute, True, workers=workers, executor=executor)
+            elapsed = time.perf_counter() - start
+        assert json.dumps(data) == expected
+        print(f"{workers} workers: {elapsed * 1000:.0f}ms ({serial / elapsed:.2f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# Compares the peak memory and time of flattening one large template with TemplateParser.resolve()
+# and json.dumps against stream.flatten_stream.
+#
+#   python benchmarks/bench_stream.py [resources]
+
+from os.path import dirname, realpath, join
+from pathlib import Path
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, join(dirname(realpath(__file__)), '..'))
+sys.path.insert(0, dirname(realpath(__file__)))
+
+from resolve import TemplateParser, TemplateContext, derived_stack_id
+from getatt_dummy import get_attribute
+from generator import generate_template
+from stream import flatten_stream, orjson
+
+def whole(context, path: Path, output: Path):
+    parser = TemplateParser(context, json.loads(path.read_bytes()), get_attribute=get_attribute, use_parameter_defaults=True)
+    parser.resolve()
+    output.write_bytes(json.dumps(parser.data, indent=2).encode())
+
+def streamed(context, path: Path, output: Path):
+    with open(path, "rb") as template, open(output, "wb") as f:
+        flatten_stream(context, template, f, get_attribute, True)
+
+def measure(function, *args) -> tuple[float, int]:
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    resources = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    context = TemplateContext("123456789012", "eu-west-1", "bench")
+    context.stack_id = derived_stack_id(context)
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory, "template.json")
+        path.write_text(json.dumps(generate_template(resources), indent=2))
+        size = path.stat().st_size
+        print(f"{resources} resources, {size / 1e6:.1f}MB, orjson: {orjson is not None}")
+        for name, function in [("whole", whole), ("stream", streamed)]:
+            output = Path(directory, f"{name}.json")
+            elapsed, peak = measure(function, context, path, output)
+            print(f"{name}: {elapsed * 1000:.0f}ms, peak {peak / 1e6:.1f}MB ({peak / size:.1f}x the file)")
+        assert Path(directory, "whole.json").read_bytes() == Path(directory, "stream.json").read_bytes() or orjson
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# Seeded generator for large, realistic CloudFormation templates.
+#
+#   python benchmarks/generator.py 1000 --seed 42 > template.json
+
+import argparse
+import json
+import random
+import sys
+
+RESOURCE_TYPES = [
+    "AWS::IAM::Role",
+    "AWS::Lambda::Function",
+    "AWS::S3::Bucket",
+    "AWS::SNS::Topic",
+    "AWS::SQS::Queue",
+    "AWS::EC2::SecurityGroup",
+    "AWS::Logs::LogGroup",
+    "AWS::DynamoDB::Table",
+]
+
+REGIONS = ["eu-west-1", "eu-central-1", "us-east-1", "us-west-2"]
+
+def make_parameters(count: int) -> dict:
+    params = {
+        "Env": { "Type": "String", "Default": "dev", "AllowedValues": ["dev", "tst", "prd"] },
+        "Subnets": { "Type": "CommaDelimitedList", "Default": "subnet-a,subnet-b,subnet-c" },
+        "VpcCidr": { "Type": "String", "Default": "10.0.0.0/16" },
+    }
+    for i in range(count):
+        params[f"Param{i}"] = { "Type": "String", "Default": f"value-{i}" }
+    return params
+
+def make_mappings(count: int) -> dict:
+    return {
+        f"Map{i}": { region: { "Size": str(2 ** (j + i % 4)), "Name": f"{region}-{i}" } for j, region in enumerate(REGIONS) }
+        for i in range(count)
+    }
+
+def make_conditions(count: int, rnd: random.Random) -> dict:
+    conditions = {
+        "Cond0": { "Fn::Equals": [ { "Ref": "Env" }, "prd" ] },
+        "Cond1": { "Fn::Equals": [ { "Ref": "AWS::Region" }, "eu-west-1" ] },
+    }
+    for i in range(2, count):
+        a, b = f"Cond{rnd.randrange(i)}", f"Cond{rnd.randrange(i)}"
+        match rnd.randrange(3):
+            case 0: conditions[f"Cond{i}"] = { "Fn::And": [ { "Condition": a }, { "Condition": b } ] }
+            case 1: conditions[f"Cond{i}"] = { "Fn::Or": [ { "Condition": a }, { "Condition": b } ] }
+            case 2: conditions[f"Cond{i}"] = { "Fn::Not": [ { "Condition": a } ] }
+    return conditions
+
+def nested(depth: int, conditions: int, rnd: random.Random, leaf) -> dict:
+    value = leaf
+    for _ in range(depth):
+        if rnd.random() < 0.5:
+            value = { "Fn::If": [ f"Cond{rnd.randrange(conditions)}", value, { "Fn::Join": [ "-", [ "else", { "Ref": "Env" } ] ] } ] }
+        else:
+            value = { "Fn::Join": [ "", [ value, "/", { "Ref": "AWS::StackName" } ] ] }
+    return value
+
+def sub(placeholders: int, params: int, earlier: list[str], rnd: random.Random) -> dict:
+    parts = []
+    for i in range(placeholders):
+        match rnd.randrange(4):
+            case 0: parts.append("${AWS::Region}")
+            case 1: parts.append(f"${{Param{rnd.randrange(params)}}}" if params else "${Env}")
+            case 2: parts.append(f"${{{rnd.choice(earlier)}.Arn}}" if earlier else "${AWS::AccountId}")
+            case 3: parts.append("${!Literal}")
+        parts.append(f"/part{i}")
+    return { "Fn::Sub": "".join(parts) }
+
+def policy(statements: int, rnd: random.Random) -> dict:
+    return {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Sid": f"Statement{i}",
+                "Effect": rnd.choice(["Allow", "Deny"]),
+                "Action": [ f"service{i}:Action{j}" for j in range(rnd.randrange(1, 8)) ],
+                "Resource": [ f"arn:aws:service{i}:::resource-{j}/*" for j in range(rnd.randrange(1, 4)) ],
+                "Condition": { "StringEquals": { "aws:RequestedRegion": REGIONS[: rnd.randrange(1, 4)] } }
+            }
+            for i in range(statements)
+        ]
+    }
+
+def make_resource(earlier: list[str], options: dict, rnd: random.Random) -> dict:
+    properties = {
+        "Name": sub(options["sub_placeholders"], options["parameters"], earlier, rnd),
+        "Nested": nested(options["depth"], options["conditions"], rnd, { "Ref": "Env" }),
+        "Size": { "Fn::FindInMap": [ f"Map{rnd.randrange(options['mappings'])}", { "Ref": "AWS::Region" }, "Size" ] },
+        "Subnet": { "Fn::Select": [ str(rnd.randrange(3)), { "Ref": "Subnets" } ] },
+        "Optional": { "Fn::If": [ f"Cond{rnd.randrange(options['conditions'])}", "enabled", { "Ref": "AWS::NoValue" } ] },
+        "PolicyDocument": policy(options["statements"], rnd),
+        "Tags": [ { "Key": f"tag{k}", "Value": f"value{k}" } for k in range(options["tags"]) ] + [ { "Key": "env", "Value": { "Ref": "Env" } } ],
+    }
+    for j in range(min(options["getatts"], len(earlier))):
+        properties[f"Target{j}"] = { "Fn::GetAtt": [ rnd.choice(earlier), "Arn" ] }
+    if earlier and rnd.random() < 0.5:
+        properties["Dependency"] = { "Ref": rnd.choice(earlier) }
+    value = { "Type": rnd.choice(RESOURCE_TYPES), "Properties": properties }
+    if rnd.random() < options["conditional"]:
+        value["Condition"] = f"Cond{rnd.randrange(options['conditions'])}"
+    return value
+
+def generate_template(resources: int, seed: int = 0, depth: int = 8, sub_placeholders: int = 12, parameters: int = 20,
+                      conditions: int = 50, mappings: int = 10, getatts: int = 3, statements: int = 4, tags: int = 10,
+                      conditional: float = 0.2, cluster: int = 0) -> dict:
+    # resources only refer to resources generated before them and conditions only to earlier
+    # conditions, so the template has no cycles. With cluster the resources form independent groups of
+    # that size, otherwise a resource refers to any of the 50 resources before it.
+    options = locals().copy()
+    rnd = random.Random(seed)
+    options["conditions"] = max(conditions, 2)
+    options["mappings"] = max(mappings, 1)
+    template = {
+        "AWSTemplateFormatVersion": "2010-09-09",
+        "Description": f"generated template with {resources} resources (seed {seed})",
+        "Parameters": make_parameters(parameters),
+        "Mappings": make_mappings(options["mappings"]),
+        "Conditions": make_conditions(options["conditions"], rnd),
+        "Resources": {},
+        "Outputs": {},
+    }
+    earlier = []
+    for i in range(resources):
+        name = f"Resource{i}"
+        candidates = earlier[i - i % cluster:] if cluster else earlier[-50:]
+        template["Resources"][name] = make_resource([e for e in candidates if "Condition" not in template["Resources"][e]], options, rnd)
+        earlier.append(name)
+    for name in earlier[:: max(1, resources // 20)]:
+        if "Condition" not in template["Resources"][name]:
+            template["Outputs"][name] = { "Value": { "Fn::GetAtt": [ name, "Arn" ] }, "Export": { "Name": { "Fn::Sub": f"${{AWS::StackName}}-{name}" } } }
+    return template
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic CloudFormation template")
+    parser.add_argument("resources", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--depth", type=int, default=8, help="nesting depth of Fn::If/Fn::Join")
+    parser.add_argument("--sub-placeholders", type=int, default=12)
+    parser.add_argument("--conditions", type=int, default=50)
+    args = parser.parse_args()
+    json.dump(generate_template(args.resources, args.seed, args.depth, args.sub_placeholders, conditions=args.conditions), fp=sys.stdout, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# Times and measures the memory of each phase of TemplateParser.resolve() on generated templates.
+#
+#   python benchmarks/suite.py --sizes 10 100 1000 10000 --output results.json
+#   python benchmarks/suite.py --compare before.json after.json
+#
+# Time is the best of --repeat runs without tracing, memory is the peak allocated by the phase
+# in a separate run under tracemalloc.
+
+from os.path import dirname, realpath, join
+import argparse
+import copy
+import gc
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, join(dirname(realpath(__file__)), '..'))
+sys.path.insert(0, dirname(realpath(__file__)))
+
+from resolve import TemplateParser, TemplateContext, RESOLVE_ONLY_SECTIONS
+from getatt_dummy import get_attribute
+from generator import generate_template
+
+SIZES = [10, 100, 1000, 10000]
+# phases faster than this are too noisy to say anything about how they scale
+MIN_SECONDS = 0.001
+
+def json_extract(parser: TemplateParser):
+    for section in [k for k in parser.data if k not in RESOLVE_ONLY_SECTIONS]:
+        parser.json_extract(parser.data[section], parser.data, section)
+
+def get_parameters(parser: TemplateParser):
+    parser.mappings = parser.data.get("Mappings", {})
+    parser.get_parameters()
+
+# the phases of TemplateParser.resolve(), in order
+PHASES = [
+    ("get_parameters", get_parameters),
+    ("get_conditions", TemplateParser.get_conditions),
+    ("get_resources", TemplateParser.get_resources),
+    ("json_extract", json_extract),
+    ("clean_template", TemplateParser.clean_template),
+]
+
+def run_phases(template: dict, context: TemplateContext, trace: bool) -> dict[str, float]:
+    parser = TemplateParser(context, copy.deepcopy(template), get_attribute=get_attribute, use_parameter_defaults=True)
+    measured = {}
+    for name, phase in PHASES:
+        if trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            phase(parser)
+            measured[name] = tracemalloc.get_traced_memory()[1] - before
+        else:
+            start = time.perf_counter()
+            phase(parser)
+            measured[name] = time.perf_counter() - start
+    return measured
+
+def benchmark(resources: int, seed: int, repeat: int) -> dict:
+    template = generate_template(resources, seed)
+    context = TemplateContext(stack_name="bench", account="123456789012", region="eu-west-1")
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        runs = [run_phases(template, context, trace=False) for _ in range(repeat)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+    tracemalloc.start()
+    try:
+        memory = run_phases(template, context, trace=True)
+    finally:
+        tracemalloc.stop()
+    return {
+        "resources": resources,
+        "phases": { name: { "seconds": min(run[name] for run in runs), "peak_bytes": memory[name] } for name, _ in PHASES },
+        "seconds": min(sum(run.values()) for run in runs),
+    }
+
+def exponents(results: list[dict]) -> dict[str, list[float]]:
+    # the slope of log(time) against log(resources) between consecutive sizes, 1.0 is linear
+    slopes = {}
+    for name in [name for name, _ in PHASES] + ["total"]:
+        slopes[name] = []
+        for a, b in zip(results, results[1:]):
+            ta = a["seconds"] if name == "total" else a["phases"][name]["seconds"]
+            tb = b["seconds"] if name == "total" else b["phases"][name]["seconds"]
+            if min(ta, tb) <= 0 or max(ta, tb) < MIN_SECONDS:
+                slopes[name].append(None)
+            else:
+                slopes[name].append(round(math.log(tb / ta) / math.log(b["resources"] / a["resources"]), 3))
+    return slopes
+
+def version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=join(dirname(realpath(__file__)), '..'), capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def compare(before: dict, after: dict, threshold: float, max_exponent: float) -> list[str]:
+    problems = []
+    previous = { r["resources"]: r for r in before["results"] }
+    for result in after["results"]:
+        old = previous.get(result["resources"])
+        if old is None:
+            continue
+        for name, phase in result["phases"].items():
+            if name in old["phases"] and old["phases"][name]["seconds"] > 0:
+                ratio = phase["seconds"] / old["phases"][name]["seconds"]
+                if ratio > threshold:
+                    problems.append(f"{name} at {result['resources']} resources is {ratio:.2f}x slower")
+    for name, slopes in after.get("exponents", {}).items():
+        for (a, b), slope in zip(zip(after["sizes"], after["sizes"][1:]), slopes):
+            if slope is not None and slope > max_exponent:
+                problems.append(f"{name} scales with exponent {slope} between {a} and {b} resources")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the phases of TemplateParser.resolve()")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of resources to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="take the best time of this many runs")
+    parser.add_argument("--output", help="write the results to this file instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files and exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    parser.add_argument("--max-exponent", type=float, default=1.25, help="scaling exponent reported as superlinear")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            problems = compare(json.load(f), json.load(g), args.threshold, args.max_exponent)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        sys.exit(1 if problems else 0)
+
+    results = []
+    for size in sorted(args.sizes):
+        results.append(benchmark(size, args.seed, args.repeat))
+        print(f"{size} resources: {results[-1]['seconds']:.4f}s", file=sys.stderr)
+    report = {
+        "version": version(),
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "sizes": sorted(args.sizes),
+        "results": results,
+        "exponents": exponents(results),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+from functools import cache
+from pathlib import Path
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+
+from resolve import TemplateParser
+import resolve
+
+# the number of different sets of reads remembered per template
+MANIFEST_SIZE = 8
+
+@cache
+def code_version(get_attribute) -> str:
+    # the resolver and the attribute getter with the specs it reads (getatt.SPECS), a change to any
+    # of them invalidates the cache
+    digest = hashlib.sha256()
+    module = inspect.getmodule(get_attribute)
+    for path in [inspect.getsourcefile(resolve), inspect.getsourcefile(module), getattr(module, "SPECS", None)]:
+        if path is not None:
+            digest.update(Path(path).read_bytes())
+    digest.update(f"{get_attribute.__module__}:{get_attribute.__qualname__}".encode())
+    return digest.hexdigest()
+
+def track_reads(parser: TemplateParser) -> set[tuple]:
+    # the parameters, pseudo parameters, ssm parameters and exports a parser reads while resolving, as
+    # ("ref", name), ("ssm", name, version) and ("export", name)
+    reads = set()
+    resolve_ref = parser.resolve_ref
+    def tracked_resolve_ref(ref):
+        if ref in parser.refs or (ref not in parser.resources and ref in parser.parameters):
+            reads.add(("ref", ref))
+        return resolve_ref(ref)
+    get_ssm_parameter = parser.get_ssm_parameter
+    def tracked_get_ssm_parameter(name, version):
+        reads.add(("ssm", name, version))
+        return get_ssm_parameter(name, version)
+    fn_import_value = parser.intrinsics["Fn::ImportValue"]
+    def tracked_import_value(parser, value, contents):
+        reads.add(("export", value))
+        return fn_import_value.handler(parser, value, contents)
+    parser.resolve_ref = tracked_resolve_ref
+    parser.get_ssm_parameter = tracked_get_ssm_parameter
+    parser.intrinsics = { **parser.intrinsics, "Fn::ImportValue": fn_import_value._replace(handler=tracked_import_value) }
+    return reads
+
+def read_values(parser: TemplateParser, reads: list) -> list:
+    # the values of reads for the context of parser, the parameters have to be resolved already.
+    # The pseudo parameters are always included, attribute getters read them directly.
+    values = [["refs", parser.refs]]
+    for read in reads:
+        match read:
+            case ["ref", name]: values.append([read, parser.refs[name] if name in parser.refs else parser.parameters[name]])
+            case ["ssm", name, version]: values.append([read, parser.context.ssm_parameters[name][version]])
+            case ["export", name]: values.append([read, parser.context.exports[name]])
+    return values
+
+def digest(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+def write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(temp, path)
+
+class Cache:
+    # A disk cache of flattened templates. An entry is found in two steps: the template, the options
+    # and the code version give a manifest with the sets of context values that were read when the
+    # template was flattened before. When the values of one of those sets are the same for the current
+    # context, resolving would read the same values and give the same result, so that result is used.
+    def __init__(self, directory: str, max_size: int = 512 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    def template_key(self, template: bytes, get_attribute, options: dict) -> str:
+        return digest(hashlib.sha256(template).hexdigest(), code_version(get_attribute), options)
+
+    def manifest_path(self, key: str) -> Path:
+        return self.directory / "manifests" / key[:2] / f"{key}.json"
+
+    def entry_path(self, key: str) -> Path:
+        return self.directory / "entries" / key[:2] / f"{key}.json"
+
+    def manifest(self, key: str) -> list:
+        try:
+            return json.loads(self.manifest_path(key).read_bytes())
+        except (OSError, ValueError):
+            return []
+
+    def lookup(self, key: str, parser: TemplateParser) -> bytes:
+        # the cached output for the context of parser, after parser.get_parameters()
+        for reads in self.manifest(key):
+            try:
+                path = self.entry_path(digest(key, read_values(parser, reads)))
+                data = path.read_bytes()
+            except (KeyError, TypeError, OSError):
+                continue
+            # the modification time orders the entries for eviction
+            os.utime(path)
+            return data
+        return None
+
+    def store(self, key: str, parser: TemplateParser, reads: set[tuple], data: bytes):
+        reads = sorted(reads)
+        write_atomic(self.entry_path(digest(key, read_values(parser, reads))), data)
+        manifest = [m for m in self.manifest(key) if m != json.loads(json.dumps(reads))]
+        write_atomic(self.manifest_path(key), json.dumps([reads] + manifest[:MANIFEST_SIZE - 1]).encode())
+
+    def evict(self):
+        # removes the least recently used entries until the cache fits in max_size
+        entries = []
+        for path in (self.directory / "entries").glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries, key=lambda entry: entry[0]):
+            if size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            size -= entry_size
@@ -0,0 +1,340 @@
+#!/usr/bin/python
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+import argparse
+import asyncio
+import cProfile
+import glob
+import importlib
+import json
+import os
+import sys
+
+from resolve import TemplateParser, TemplateContext, derived_stack_id
+from cache import Cache, track_reads
+from stats import Stats
+from providers import Prefetcher, FileProvider
+from fleet import scan, fleet_levels
+from stream import flatten_stream
+from multi import MultiContext
+
+OUTPUT_SUFFIX = ".flat.json"
+
+@dataclass
+class Job:
+    template: str
+    output: str
+    context_name: str
+    context: dict
+    get_attribute: str = "getatt_dummy"
+    use_parameter_defaults: bool = True
+    stats: bool = False
+    cache_dir: str = None
+    stream: bool = False
+
+@dataclass
+class Result:
+    job: Job
+    error: str = None
+    stats: dict = None
+    # export name -> value of the outputs of the flattened template
+    exports: dict = None
+    cached: bool = False
+
+@cache
+def load_get_attribute(name: str):
+    module, _, function = name.partition(":")
+    return getattr(importlib.import_module(module), function or "get_attribute")
+
+def load_provider(name: str):
+    module, _, factory = name.partition(":")
+    return getattr(importlib.import_module(module), factory or "Provider")()
+
+def make_context(job: Job) -> TemplateContext:
+    context = TemplateContext(**{"stack_name": Path(job.template).stem, **job.context})
+    # the same output for the same input
+    if context.stack_id is None:
+        context.stack_id = derived_stack_id(context)
+    return context
+
+def collect_exports(data: dict) -> dict:
+    return {
+        v["Export"]["Name"]: v.get("Value") for v in data.get("Outputs", {}).values()
+        if isinstance(v, dict) and isinstance(v.get("Export"), dict) and isinstance(v["Export"].get("Name"), str)
+    }
+
+def flatten_job(job: Job) -> Result:
+    try:
+        if job.stream:
+            output = Path(job.output)
+            output.parent.mkdir(parents=True, exist_ok=True)
+            with open(job.template, "rb") as template, open(output, "wb") as f:
+                data = flatten_stream(make_context(job), template, f, load_get_attribute(job.get_attribute), job.use_parameter_defaults)
+            return Result(job, exports=collect_exports(data))
+        with open(job.template, "rb") as f:
+            raw = f.read()
+        template = json.loads(raw)
+        stats = Stats() if job.stats else None
+        get_attribute = load_get_attribute(job.get_attribute)
+        parser = TemplateParser(
+            make_context(job),
+            template,
+            get_attribute=get_attribute,
+            use_parameter_defaults=job.use_parameter_defaults,
+            stats=stats
+        )
+        output = Path(job.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        if job.cache_dir:
+            cache = Cache(job.cache_dir)
+            key = cache.template_key(raw, get_attribute, { "use_parameter_defaults": job.use_parameter_defaults })
+            parser.get_parameters()
+            data = cache.lookup(key, parser)
+            if data is not None:
+                output.write_bytes(data)
+                return Result(job, exports=collect_exports(json.loads(data)), cached=True)
+            reads = track_reads(parser)
+        parser.resolve()
+        data = json.dumps(parser.data, indent=2).encode()
+        output.write_bytes(data)
+        if job.cache_dir:
+            cache.store(key, parser, reads, data)
+        return Result(job, stats=stats.to_dict() if stats else None, exports=collect_exports(parser.data))
+    except Exception as e:
+        return Result(job, f"{type(e).__name__}: {e}")
+
+def flatten_multi(jobs: list[Job]) -> list[Result]:
+    # flattens one template for the contexts of jobs into a single MultiContext file, the contexts that
+    # fail are left out of it
+    results = []
+    documents = {}
+    try:
+        with open(jobs[0].template, "r") as f:
+            template = json.load(f)
+        get_attribute = load_get_attribute(jobs[0].get_attribute)
+    except Exception as e:
+        return [Result(job, f"{type(e).__name__}: {e}") for job in jobs]
+    for job in jobs:
+        try:
+            parser = TemplateParser(make_context(job), template, get_attribute=get_attribute, use_parameter_defaults=job.use_parameter_defaults, in_place=False)
+            parser.resolve()
+            documents[job.context_name] = parser.data
+            results.append(Result(job, exports=collect_exports(parser.data)))
+        except Exception as e:
+            results.append(Result(job, f"{type(e).__name__}: {e}"))
+    output = Path(jobs[0].output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_bytes(json.dumps(MultiContext.create(documents).to_dict(), indent=2).encode())
+    return results
+
+def run_multi(jobs: list[Job], workers: int = None, chunksize: int = 1):
+    templates = {}
+    for job in jobs:
+        templates.setdefault(job.template, []).append(job)
+    if workers == 1:
+        for results in map(flatten_multi, templates.values()):
+            yield from results
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # a template with all its contexts is already a large unit of work
+        for results in executor.map(flatten_multi, templates.values()):
+            yield from results
+
+def find_templates(patterns: list[str], exclude: list[str] = (), output_dir: str = None) -> list[tuple[Path, Path]]:
+    excluded = {Path(p).resolve() for p in exclude}
+    # the results of an earlier run keep the name of their template
+    output = Path(output_dir).resolve() if output_dir is not None else None
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            base = Path(pattern)
+            paths = base.rglob("*.json")
+        elif glob.has_magic(pattern):
+            parts = Path(pattern).parts
+            base = Path(*parts[:next(i for i, part in enumerate(parts) if glob.has_magic(part))] or ".")
+            paths = map(Path, glob.glob(pattern, recursive=True))
+        else:
+            base = Path(pattern).parent
+            paths = [Path(pattern)]
+        for path in paths:
+            if path.is_file() and not path.name.endswith(OUTPUT_SUFFIX) and path.resolve() not in excluded and not (output and path.resolve().is_relative_to(output)):
+                found.setdefault(path, base)
+    return sorted(found.items())
+
+def output_path(template: Path, base: Path, context_name: str, output_dir: str = None) -> Path:
+    if output_dir is None:
+        return template.with_name(f"{template.stem}.{context_name}{OUTPUT_SUFFIX}")
+    return Path(output_dir, context_name, template.relative_to(base))
+
+def load_contexts(path: str) -> dict[str, dict]:
+    with open(path, "r") as f:
+        contexts = json.load(f)
+    if not isinstance(contexts, dict) or not contexts:
+        raise Exception(f"Contexts file {path} should contain an object mapping context names to contexts")
+    for name, context in contexts.items():
+        # fail fast on unknown or missing fields instead of once per template
+        TemplateContext(**{"stack_name": name, **context})
+    return contexts
+
+def make_jobs(templates, contexts: dict[str, dict], args) -> list[Job]:
+    return [
+        Job(
+            str(template),
+            str(output_path(template, base, "multi" if args.multi else name, args.output_dir)),
+            name,
+            context,
+            args.get_attribute,
+            not args.no_parameter_defaults,
+            args.stats is not None and not args.stream,
+            None if args.no_cache or args.stream else args.cache_dir,
+            args.stream
+        )
+        for template, base in templates
+        for name, context in contexts.items()
+    ]
+
+def prefetch_jobs(jobs: list[Job], provider, concurrency: int):
+    # looks up the ssm parameters and exports of all templates in one go, before the jobs are
+    # handed to the workers. Templates that cannot be read are left to fail in flatten_job.
+    items = []
+    for job in jobs:
+        try:
+            with open(job.template, "r") as f:
+                items.append((job, json.load(f)))
+        except Exception:
+            continue
+    contexts = asyncio.run(Prefetcher(provider, concurrency=concurrency).prepare(
+        [(template, make_context(job)) for job, template in items],
+        use_parameter_defaults=bool(jobs) and jobs[0].use_parameter_defaults
+    ))
+    for (job, _), context in zip(items, contexts):
+        job.context = { **job.context, "ssm_parameters": context.ssm_parameters, "exports": context.exports }
+
+def run_jobs(jobs: list[Job], workers: int = None, chunksize: int = 1):
+    if workers == 1:
+        yield from map(flatten_job, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(flatten_job, jobs, chunksize=chunksize)
+
+def fleet_jobs(jobs: list[Job]) -> tuple[list[list[Job]], dict[str, set[str]], dict[str, set[str]], list[Result]]:
+    # the jobs of one context grouped in levels by the export/import graph of their templates, the
+    # templates each template imports from, the names each template imports and the jobs that could
+    # not be scanned
+    stacks = {}
+    failed = []
+    for job in jobs:
+        try:
+            with open(job.template, "r") as f:
+                stacks[job.template] = scan(json.load(f), make_context(job), job.use_parameter_defaults)
+        except Exception as e:
+            failed.append(Result(job, f"{type(e).__name__}: {e}"))
+    levels, dependencies = fleet_levels(stacks)
+    by_template = { job.template: job for job in jobs }
+    imports = { k: v[1] for k, v in stacks.items() }
+    return [[by_template[k] for k in level] for level in levels], dependencies, imports, failed
+
+def run_fleet(jobs: list[Job], workers: int = None, chunksize: int = 1):
+    # flattens the templates of each context level by level, the exports of a level are added to the
+    # contexts of the templates that import them in the next levels
+    contexts = {}
+    for job in jobs:
+        contexts.setdefault(job.context_name, []).append(job)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        for context_jobs in contexts.values():
+            try:
+                levels, dependencies, imports, failed = fleet_jobs(context_jobs)
+            except Exception as e:
+                yield from (Result(job, f"{type(e).__name__}: {e}") for job in context_jobs)
+                continue
+            yield from failed
+            broken = { result.job.template for result in failed }
+            exports = {}
+            for level in levels:
+                ready = []
+                for job in level:
+                    sources = sorted(dependencies[job.template] & broken)
+                    if sources:
+                        broken.add(job.template)
+                        yield Result(job, f"Skipped: imports from {', '.join(sources)}, which failed")
+                        continue
+                    needed = { name: exports[name] for name in imports[job.template] if name in exports }
+                    job.context = { **job.context, "exports": { **job.context.get("exports", {}), **needed } }
+                    ready.append(job)
+                results = executor.map(flatten_job, ready, chunksize=chunksize) if executor else map(flatten_job, ready)
+                for result in results:
+                    if result.error:
+                        broken.add(result.job.template)
+                    else:
+                        exports.update(result.exports)
+                    yield result
+    finally:
+        if executor:
+            executor.shutdown()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="cfn-flatten", description="Flatten CloudFormation templates for one or more contexts")
+    parser.add_argument("templates", nargs="+", help="template files, directories or glob patterns")
+    parser.add_argument("-c", "--contexts", required=True, help="json file mapping context names to TemplateContext fields")
+    parser.add_argument("-o", "--output-dir", help="write results into this directory instead of next to the templates")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="number of worker processes (default: cpu count)")
+    parser.add_argument("--chunksize", type=int, default=16, help="number of templates handed to a worker at once")
+    parser.add_argument("--get-attribute", default="getatt_dummy", help="attribute getter as module or module:function (default: getatt_dummy)")
+    parser.add_argument("--no-parameter-defaults", action="store_true", help="do not fall back to parameter defaults")
+    parser.add_argument("--lookups", metavar="FILE", help="json file with the ssm_parameters and exports the templates can look up")
+    parser.add_argument("--provider", help="look up ssm parameters and exports with module:factory, see providers.py")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of provider requests at once (default: 8)")
+    parser.add_argument("--fleet", action="store_true", help="flatten in the order of the export/import graph, feeding exports to the templates that import them")
+    parser.add_argument("--cache-dir", default=os.environ.get("CFN_FLATTEN_CACHE_DIR"), help="reuse flattened templates from this directory (default: $CFN_FLATTEN_CACHE_DIR)")
+    parser.add_argument("--cache-size", type=int, default=512, help="maximum size of the cache in MB (default: 512)")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the cache")
+    parser.add_argument("--multi", action="store_true", help="write one file per template with a base document and a json patch per context")
+    parser.add_argument("--stream", action="store_true", help="resolve and write one resource at a time to bound the memory used by large templates, without the cache and stats")
+    parser.add_argument("--stats", metavar="FILE", help="write call counts and timings per template to this json file")
+    parser.add_argument("--profile", metavar="FILE", help="run in a single process under cProfile and write pstats output to this file")
+    args = parser.parse_args(argv)
+    if args.multi and (args.fleet or args.stream):
+        parser.error("--multi can not be combined with --fleet or --stream")
+    return args
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["serve"]:
+        import serve
+        return serve.main(argv[1:])
+    args = parse_args(argv)
+    contexts = load_contexts(args.contexts)
+    jobs = make_jobs(find_templates(args.templates, [args.contexts, args.lookups or args.contexts], args.output_dir), contexts, args)
+    if args.lookups or args.provider:
+        prefetch_jobs(jobs, FileProvider(args.lookups) if args.lookups else load_provider(args.provider), args.concurrency)
+    failed = 0
+    cached = 0
+    stats = []
+    profile = cProfile.Profile() if args.profile else None
+    if profile:
+        profile.enable()
+    run = run_fleet if args.fleet else run_multi if args.multi else run_jobs
+    for result in run(jobs, 1 if profile else args.workers, args.chunksize):
+        if result.error:
+            failed += 1
+            print(f"FAILED {result.job.template} [{result.job.context_name}]: {result.error}", file=sys.stderr)
+        cached += result.cached
+        if result.stats is not None:
+            stats.append({ "template": result.job.template, "context": result.job.context_name, **result.stats })
+    if profile:
+        profile.disable()
+        profile.dump_stats(args.profile)
+    if args.stats:
+        with open(args.stats, "w") as f:
+            json.dump(stats, f, indent=2)
+    if jobs and jobs[0].cache_dir:
+        Cache(jobs[0].cache_dir, args.cache_size * 1024 * 1024).evict()
+    print(f"flattened {len(jobs) - failed} of {len(jobs)} templates, {failed} failed" + (f", {cached} from cache" if cached else ""), file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
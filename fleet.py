@@ -0,0 +1,63 @@
+from resolve import TemplateParser, TemplateContext
+from providers import find_lookups, no_attributes
+
+def scan(template: dict, context: TemplateContext, use_parameter_defaults: bool = False) -> tuple[set[str], set[str]]:
+    # the names a template exports and the names it imports. Names built from parameters and pseudo
+    # parameters are evaluated, an export name that needs anything else can not be known up front.
+    lookups, dynamic = find_lookups(template, context, use_parameter_defaults)
+    outputs = template.get("Outputs", {})
+    exported = [(k, v["Export"]["Name"]) for k, v in outputs.items() if isinstance(v, dict) and isinstance(v.get("Export"), dict) and "Name" in v["Export"]]
+    # the conditions of outputs are only known once the template is prepared
+    if not dynamic and all(isinstance(name, str) and "Condition" not in outputs[k] for k, name in exported):
+        return { name for _, name in exported }, lookups.exports
+    parser = TemplateParser(context, template, get_attribute=no_attributes, use_parameter_defaults=use_parameter_defaults, lazy_conditions=True, in_place=False)
+    parser.prepare()
+    exports = set()
+    for k, name in exported:
+        if "Condition" in outputs[k] and not parser.get_condition_by_name(outputs[k]["Condition"]):
+            continue
+        try:
+            exports.add(parser.evaluate(name))
+        except Exception as e:
+            raise Exception(f"Export name of output {k} can not be known before flattening: {e}")
+    imports = set(lookups.exports)
+    for name in dynamic:
+        try:
+            imports.add(parser.evaluate(name))
+        except Exception as e:
+            raise Exception(f"Fn::ImportValue name can not be known before flattening: {e}")
+    return exports, imports
+
+def find_cycle(dependencies: dict[str, set[str]], remaining: set[str]) -> list[str]:
+    # every remaining stack depends on another remaining stack, follow them until one repeats
+    path = [min(remaining)]
+    while True:
+        k = min(dep for dep in dependencies[path[-1]] if dep in remaining)
+        if k in path:
+            return path[path.index(k):] + [k]
+        path.append(k)
+
+def fleet_levels(stacks: dict[str, tuple[set[str], set[str]]]) -> tuple[list[list[str]], dict[str, set[str]]]:
+    # stacks maps a name to the (exports, imports) of its template. Returns the stacks grouped in
+    # levels, a stack only imports from stacks in earlier levels, and the stacks each stack imports
+    # from. Imports that no stack exports are left to the exports of the context.
+    exporters = {}
+    for k in sorted(stacks):
+        for name in stacks[k][0]:
+            if name in exporters:
+                raise Exception(f"Export {name} is exported by both {exporters[name]} and {k}")
+            exporters[name] = k
+    dependencies = {}
+    for k, (_, imports) in stacks.items():
+        dependencies[k] = { exporters[name] for name in imports if name in exporters } - {k}
+    levels = []
+    done = set()
+    remaining = set(stacks)
+    while remaining:
+        level = sorted(k for k in remaining if dependencies[k] <= done)
+        if not level:
+            raise Exception(f"Circular imports between stacks {' -> '.join(find_cycle(dependencies, remaining))}")
+        levels.append(level)
+        done.update(level)
+        remaining.difference_update(level)
+    return levels, dependencies
@@ -0,0 +1,133 @@
+from dataclasses import asdict
+import asyncio
+import inspect
+import json
+import urllib.request
+
+from resolve import TemplateParser, TemplateContext, parse_sub, SUB_LITERAL, SUB_GETATT
+
+class MissingAttribute(Exception):
+    # raised by the getter of AsyncResolver for an attribute that was not fetched yet
+    def __init__(self, logical_id: str, attribute_name: str):
+        super().__init__(f"attribute not fetched {logical_id} {attribute_name}")
+        self.key = (logical_id, attribute_name)
+
+def find_attribute_targets(value, resources: dict) -> set[tuple[str, str]]:
+    # the (logical_id, attribute) of every Ref, Fn::GetAtt and Fn::Sub placeholder of a resource in
+    # value, a Ref is the 'Ref' attribute. Targets with a name that is not a literal are left out.
+    found = set()
+    stack = [value]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, list):
+            stack.extend(v)
+        elif isinstance(v, dict):
+            if len(v) == 1:
+                name, = v
+                match name, v[name]:
+                    case 'Ref', str(ref):
+                        found.add((ref, 'Ref'))
+                    case 'Fn::GetAtt', str(ref):
+                        found.add(tuple(ref.split(".", 1)))
+                    case 'Fn::GetAtt', [str(ref), str(attribute)]:
+                        found.add((ref, attribute))
+                    case 'Fn::Sub', str(s) | [str(s), dict()]:
+                        variables = v[name][1] if isinstance(v[name], list) else {}
+                        for kind, ref, attribute in parse_sub(s):
+                            if kind != SUB_LITERAL and ref not in variables:
+                                found.add((ref, attribute if kind == SUB_GETATT else 'Ref'))
+            stack.extend(v.values())
+    return { (ref, attribute) for ref, attribute in found if ref in resources }
+
+def stack_key(context: TemplateContext) -> tuple[str, str, str, str]:
+    # the deployed stack a context flattens for
+    return (context.partition, context.region, context.account, context.stack_name)
+
+class AsyncResolver:
+    # Flattens a template with attributes from an async provider. The Ref and Fn::GetAtt targets of
+    # the resources and outputs are collected first and fetched in batches, with at most `concurrency`
+    # requests at once, before the template is resolved with the fetched values. Targets that can only
+    # be known while resolving, like a Fn::GetAtt whose attribute is a Ref, are fetched when they are
+    # missed and the template is resolved again. The template is not modified, so a retry starts from
+    # the original. Fetched attributes are kept by the stack they belong to (see stack_key), so one
+    # resolver can flatten templates for many accounts, regions and stacks.
+    #
+    # A provider has a get_attributes(context, targets) method that gets a list of (logical_id,
+    # resource_type, attribute) and returns { (logical_id, attribute): value } for the ones it knows.
+    def __init__(self, provider, concurrency: int = 8, batch_size: int = 50):
+        self.provider = provider
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.attributes = {}
+        self.fetched = set()
+
+    def get_attribute(self, logical_id, attribute_name, ctx: TemplateParser):
+        key = (*stack_key(ctx.context), logical_id, attribute_name)
+        if key in self.attributes:
+            return self.attributes[key]
+        if key in self.fetched or logical_id not in ctx.resources:
+            raise Exception(f"attribute not found {logical_id} {attribute_name}")
+        raise MissingAttribute(logical_id, attribute_name)
+
+    async def call(self, semaphore, context, batch):
+        async with semaphore:
+            result = self.provider.get_attributes(context, batch)
+            return await result if inspect.isawaitable(result) else result
+
+    async def fetch(self, context: TemplateContext, targets: list[tuple[str, str, str]]):
+        stack = stack_key(context)
+        targets = [target for target in targets if (*stack, target[0], target[2]) not in self.fetched]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(
+            self.call(semaphore, context, targets[i:i + self.batch_size]) for i in range(0, len(targets), self.batch_size)
+        ))
+        for result in results:
+            self.attributes.update(((*stack, *key), value) for key, value in result.items())
+        # a target is only marked as fetched once its value is stored, so a resolve in another thread
+        # that runs meanwhile misses it and fetches it too instead of taking it as unknown
+        self.fetched.update((*stack, logical_id, attribute) for logical_id, _, attribute in targets)
+
+    def parser(self, context: TemplateContext, template: dict, use_parameter_defaults: bool) -> TemplateParser:
+        return TemplateParser(context, template, get_attribute=self.get_attribute, use_parameter_defaults=use_parameter_defaults, in_place=False)
+
+    async def resolve(self, context: TemplateContext, template: dict, use_parameter_defaults: bool = False) -> dict:
+        parser = self.parser(context, template, use_parameter_defaults)
+        parser.prepare()
+        resources = parser.resources
+        targets = set()
+        for section in ["Resources", "Outputs"]:
+            targets |= find_attribute_targets(parser.data.get(section, {}), resources)
+        await self.fetch(context, sorted((k, resources[k]["type"], attribute) for k, attribute in targets))
+        stack_id = parser.refs['AWS::StackId']
+        while True:
+            try:
+                parser.resolve()
+                return parser.data
+            except MissingAttribute as e:
+                logical_id, attribute = e.key
+                await self.fetch(context, [(logical_id, resources[logical_id]["type"], attribute)])
+            parser = self.parser(context, template, use_parameter_defaults)
+            parser.refs['AWS::StackId'] = stack_id
+
+def resolve(provider, context: TemplateContext, template: dict, use_parameter_defaults: bool = False, **kwargs) -> dict:
+    return asyncio.run(AsyncResolver(provider, **kwargs).resolve(context, template, use_parameter_defaults))
+
+class HttpProvider:
+    # Posts { "context": {...}, "targets": [{ "logical_id", "type", "attribute" }] } as json to url and
+    # expects { "attributes": [{ "logical_id", "attribute", "value" }] } back. Requests run in threads.
+    def __init__(self, url: str, timeout: float = 30):
+        self.url = url
+        self.timeout = timeout
+
+    def post(self, body: dict) -> dict:
+        request = urllib.request.Request(self.url, data=json.dumps(body).encode(), headers={ "Content-Type": "application/json" })
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)
+
+    async def get_attributes(self, context: TemplateContext, targets: list[tuple[str, str, str]]) -> dict:
+        body = {
+            "context": { k: v for k, v in asdict(context).items() if k not in ["ssm_parameters", "exports"] },
+            "targets": [{ "logical_id": logical_id, "type": type, "attribute": attribute } for logical_id, type, attribute in targets],
+        }
+        response = await asyncio.to_thread(self.post, body)
+        return { (item["logical_id"], item["attribute"]): item["value"] for item in response["attributes"] }
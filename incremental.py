@@ -0,0 +1,168 @@
+from dataclasses import replace
+
+from resolve import TemplateParser, TemplateContext, find_references, topological_order, uses_language_extensions
+
+PARAMETER, CONDITION, MAPPING, RESOURCE = "Parameters", "Conditions", "Mappings", "Resources"
+
+# the units that are flattened and tracked separately
+UNIT_SECTIONS = ["Resources", "Outputs"]
+
+def find_conditions(value) -> set[str]:
+    # the conditions used by a Condition key, { "Condition": name } or Fn::If anywhere in value
+    found = set()
+    stack = [value]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, list):
+            stack.extend(v)
+        elif isinstance(v, dict):
+            if isinstance(v.get("Condition"), str):
+                found.add(v["Condition"])
+            if len(v) == 1 and isinstance(v.get("Fn::If"), list) and v["Fn::If"] and isinstance(v["Fn::If"][0], str):
+                found.add(v["Fn::If"][0])
+            stack.extend(v.values())
+    return found
+
+def find_mappings(value, mappings: dict) -> set[str]:
+    # the mappings read by Fn::FindInMap, a map name that is not a literal could read any of them
+    found = set()
+    stack = [value]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, list):
+            stack.extend(v)
+        elif isinstance(v, dict):
+            if len(v) == 1 and isinstance(v.get("Fn::FindInMap"), list) and v["Fn::FindInMap"]:
+                name = v["Fn::FindInMap"][0]
+                found.update([name] if isinstance(name, str) else mappings)
+            stack.extend(v.values())
+    return found
+
+def changed_paths(old, new, path="") -> list[str]:
+    # json pointers to the places where new differs from old
+    if old is new:
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        paths = []
+        for k in list(old) + [k for k in new if k not in old]:
+            pointer = f"{path}/{str(k).replace('~', '~0').replace('/', '~1')}"
+            if k not in new or k not in old:
+                paths.append(pointer)
+            else:
+                paths.extend(changed_paths(old[k], new[k], pointer))
+        return paths
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        return [p for idx, (o, n) in enumerate(zip(old, new)) for p in changed_paths(o, n, f"{path}/{idx}")]
+    return [] if old == new else [path]
+
+class IncrementalParser:
+    # Flattens a template once and then re-flattens only the resources and outputs that are affected
+    # by a change of parameters or resources. The template passed in is not modified.
+
+    def __init__(self, context: TemplateContext, json_template, get_attribute, use_parameter_defaults: bool=False):
+        # the units of a template with Fn::ForEach loops are only known once it is expanded
+        if uses_language_extensions(json_template):
+            raise Exception("AWS::LanguageExtensions templates can not be flattened incrementally")
+        self.context = context
+        self.template = { **json_template, "Resources": dict(json_template.get("Resources", {})) }
+        self.get_attribute = get_attribute
+        self.use_parameter_defaults = use_parameter_defaults
+        self.stack_id = None
+        self.data = {}
+        # (section, name) of a unit -> the (section, name) of everything its value depends on
+        self.dependencies = {}
+        self.direct_dependencies = {}
+        # the units that were flattened by the last call to resolve or update
+        self.recomputed = []
+
+    def units(self) -> list[tuple[str, str]]:
+        return [(section, k) for section in UNIT_SECTIONS for k in self.template.get(section, {})]
+
+    def direct(self, section: str, name: str) -> set[tuple[str, str]]:
+        # what a unit, condition or resource refers to without following other resources or conditions
+        value = self.template.get(section, {}).get(name)
+        parameters = set(self.template.get("Parameters", {})) | set(self.context.parameters)
+        resources = self.template.get("Resources", {})
+        found = set()
+        for ref in find_references(value):
+            if ref in resources:
+                found.add((RESOURCE, ref))
+            elif ref in parameters:
+                found.add((PARAMETER, ref))
+        found.update((CONDITION, k) for k in find_conditions(value))
+        found.update((MAPPING, k) for k in find_mappings(value, self.template.get("Mappings", {})))
+        return found
+
+    def record_dependencies(self, changed: set[tuple[str, str]] = None):
+        keys = [(CONDITION, k) for k in self.template.get("Conditions", {})] + self.units()
+        for key in keys:
+            if changed is None or key in changed or key not in self.direct_dependencies:
+                self.direct_dependencies[key] = self.direct(*key)
+        for key in [key for key in self.direct_dependencies if key not in keys]:
+            del self.direct_dependencies[key]
+        graph = { key: sorted(deps) for key, deps in self.direct_dependencies.items() }
+        self.dependencies = {}
+        # conditions and resources first, so everything a unit depends on is expanded before the unit
+        for key in topological_order(graph, sorted(graph)):
+            if key in self.direct_dependencies:
+                deps = set(self.direct_dependencies[key])
+                for dep in self.direct_dependencies[key]:
+                    deps |= self.dependencies.get(dep, set())
+                self.dependencies[key] = deps
+
+    def flatten(self, units: list[tuple[str, str]]) -> dict:
+        # flattens the units together with the resources they depend on
+        resources = self.template.get("Resources", {})
+        needed = { name for key in units for section, name in self.dependencies[key] | {key} if section == RESOURCE }
+        template = { k: v for k, v in self.template.items() if k not in UNIT_SECTIONS }
+        template["Resources"] = { k: v for k, v in resources.items() if k in needed }
+        outputs = { name for section, name in units if section == "Outputs" }
+        if outputs:
+            template["Outputs"] = { k: v for k, v in self.template["Outputs"].items() if k in outputs }
+        parser = TemplateParser(self.context, template, get_attribute=self.get_attribute, use_parameter_defaults=self.use_parameter_defaults, in_place=False)
+        if self.stack_id is None:
+            self.stack_id = parser.refs['AWS::StackId']
+        parser.refs['AWS::StackId'] = self.stack_id
+        parser.resolve()
+        return parser.data
+
+    def merge(self, flattened: dict, units: list[tuple[str, str]]) -> dict:
+        data = { k: v for k, v in (flattened if units else self.data).items() if k not in UNIT_SECTIONS }
+        for section in UNIT_SECTIONS:
+            if section not in self.template:
+                continue
+            old = self.data.get(section, {})
+            new = flattened.get(section, {})
+            data[section] = {}
+            for k in self.template[section]:
+                value = new.get(k) if (section, k) in units else old.get(k)
+                if value is not None:
+                    data[section][k] = value
+        return data
+
+    def resolve(self) -> dict:
+        self.record_dependencies()
+        units = self.units()
+        self.data = self.merge(self.flatten(units), units)
+        self.recomputed = units
+        return self.data
+
+    def update(self, parameters: dict = None, resources: dict = None) -> tuple[dict, list[str]]:
+        # parameters maps names to their new values, resources maps logical ids to their new
+        # definition or to None when the resource is removed
+        changed = set()
+        if parameters:
+            changed |= { (PARAMETER, k) for k, v in parameters.items() if k not in self.context.parameters or self.context.parameters[k] != v }
+            self.context = replace(self.context, parameters={ **self.context.parameters, **parameters })
+        for k, v in (resources or {}).items():
+            changed.add((RESOURCE, k))
+            if v is None:
+                self.template.get("Resources", {}).pop(k, None)
+            else:
+                self.template["Resources"][k] = v
+        self.record_dependencies(changed)
+        units = [key for key in self.units() if key in changed or self.dependencies[key] & changed]
+        previous = self.data
+        self.data = self.merge(self.flatten(units) if units else {}, units)
+        self.recomputed = units
+        return self.data, changed_paths(previous, self.data)
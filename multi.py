@@ -0,0 +1,117 @@
+from collections import Counter
+from dataclasses import dataclass, field
+import json
+
+from resolve import TemplateParser, TemplateContext
+
+def pointer(path: tuple) -> str:
+    # a JSON Pointer (RFC 6901) for a path of keys and indexes
+    return "".join("/" + str(k).replace("~", "~0").replace("/", "~1") for k in path)
+
+def parse_pointer(value: str) -> list[str]:
+    if value == "":
+        return []
+    if not value.startswith("/"):
+        raise Exception(f"Invalid JSON Pointer {value}")
+    return [k.replace("~1", "/").replace("~0", "~") for k in value[1:].split("/")]
+
+def diff(base, target, path: tuple = ()) -> list[dict]:
+    # the JSON Patch (RFC 6902) operations that turn base into target. Dicts are compared key by key and
+    # lists of the same length item by item, anything else that differs is replaced as a whole.
+    if isinstance(base, dict) and isinstance(target, dict):
+        operations = [{ "op": "remove", "path": pointer(path + (k,)) } for k in base if k not in target]
+        for k, v in target.items():
+            if k in base:
+                operations.extend(diff(base[k], v, path + (k,)))
+            else:
+                operations.append({ "op": "add", "path": pointer(path + (k,)), "value": v })
+        return operations
+    if isinstance(base, list) and isinstance(target, list) and len(base) == len(target):
+        return [operation for i, (a, b) in enumerate(zip(base, target)) for operation in diff(a, b, path + (i,))]
+    if type(base) is type(target) and base == target:
+        return []
+    return [{ "op": "replace", "path": pointer(path), "value": target }]
+
+def apply_patch(document, patch: list[dict]):
+    # Returns document with the add, remove and replace operations of patch applied. Only the containers
+    # on the paths of the operations are copied, the rest is shared with document, so neither should be
+    # modified in place afterwards.
+    root = [document]
+    copied = set()
+    for operation in patch:
+        parent, key = root, 0
+        for token in parse_pointer(operation["path"]):
+            container = parent[key]
+            if id(container) not in copied:
+                match container:
+                    case dict(): container = dict(container)
+                    case list(): container = list(container)
+                    case _: raise Exception(f"Path {operation['path']} not found")
+                copied.add(id(container))
+                parent[key] = container
+            match container:
+                case dict(): key = token
+                case list(): key = len(container) if token == "-" else int(token)
+            parent = container
+        match operation["op"]:
+            case "add" if isinstance(parent, list): parent.insert(key, operation["value"])
+            case "add" | "replace":
+                if operation["op"] == "replace" and (key not in parent if isinstance(parent, dict) else key >= len(parent)):
+                    raise Exception(f"Path {operation['path']} not found")
+                parent[key] = operation["value"]
+            case "remove": del parent[key]
+            case op: raise Exception(f"Unsupported patch operation {op}")
+    return root[0]
+
+def consensus(values: list):
+    # the value most of values agree on, key by key for dicts and item by item for lists of the same
+    # length, so the patches from it to each of the values are small
+    if all(isinstance(v, dict) for v in values):
+        keys = Counter(k for v in values for k in v)
+        return { k: consensus([v[k] for v in values if k in v]) for k, count in keys.items() if count * 2 > len(values) }
+    if all(isinstance(v, list) for v in values) and len({len(v) for v in values}) == 1:
+        return [consensus([v[i] for v in values]) for i in range(len(values[0]))]
+    keys = [json.dumps(v, sort_keys=True) for v in values]
+    return values[keys.index(Counter(keys).most_common(1)[0][0])]
+
+@dataclass
+class MultiContext:
+    # A template flattened for many contexts, stored as the base document that most contexts agree on
+    # and a JSON Patch per context name.
+    base: dict = field(default_factory=dict)
+    patches: dict[str, list] = field(default_factory=dict)
+
+    @staticmethod
+    def create(documents: dict[str, dict]) -> "MultiContext":
+        base = consensus(list(documents.values())) if documents else {}
+        return MultiContext(base, { name: diff(base, document) for name, document in documents.items() })
+
+    @staticmethod
+    def from_dict(data: dict) -> "MultiContext":
+        return MultiContext(data["base"], data["patches"])
+
+    @staticmethod
+    def load(path: str) -> "MultiContext":
+        with open(path, "r") as f:
+            return MultiContext.from_dict(json.load(f))
+
+    def to_dict(self) -> dict:
+        return { "base": self.base, "patches": self.patches }
+
+    def contexts(self) -> list[str]:
+        return list(self.patches)
+
+    def materialize(self, name: str) -> dict:
+        # the flattened template of one context, it shares the unchanged parts with base
+        if name not in self.patches:
+            raise Exception(f"Context {name} not found")
+        return apply_patch(self.base, self.patches[name])
+
+def flatten_contexts(template: dict, contexts: dict[str, TemplateContext], get_attribute, use_parameter_defaults: bool = False) -> MultiContext:
+    # flattens template once for every context and stores the results as a MultiContext
+    documents = {}
+    for name, context in contexts.items():
+        parser = TemplateParser(context, template, get_attribute=get_attribute, use_parameter_defaults=use_parameter_defaults, in_place=False)
+        parser.resolve()
+        documents[name] = parser.data
+    return MultiContext.create(documents)
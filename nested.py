@@ -0,0 +1,158 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from pathlib import Path
+import json
+import os
+
+from resolve import TemplateParser, TemplateContext, NOVALUE, dependency_graph, topological_order, derived_stack_id
+
+STACK_TYPE = "AWS::CloudFormation::Stack"
+
+@lru_cache(maxsize=256)
+def read_template(path: str, mtime_ns: int, size: int) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+def load_template(path: str) -> dict:
+    # templates are never modified by the parser (in_place=False), so one that is used by many
+    # nested stacks is read and parsed once per process. The cache is keyed on the modification time
+    # and size, like the plans of serve.Flattener, so a template that is edited is read again.
+    stat = os.stat(path)
+    return read_template(path, stat.st_mtime_ns, stat.st_size)
+
+@dataclass
+class FlattenedStack:
+    data: dict
+    stack_id: str
+    # output name -> value
+    outputs: dict = field(default_factory=dict)
+    # logical id of a nested stack -> its flattened stack
+    children: dict[str, "FlattenedStack"] = field(default_factory=dict)
+
+@dataclass
+class ChildJob:
+    logical_id: str
+    path: str
+    context: TemplateContext
+    ancestors: tuple[str, ...]
+    template_urls: dict[str, str]
+    get_attribute: any
+    use_parameter_defaults: bool
+
+def parameter_value(value) -> str:
+    # CloudFormation passes the parameters of a nested stack as strings, a list is comma delimited
+    match value:
+        case bool(): return "true" if value else "false"
+        case int() | float(): return str(value)
+        case list(): return ",".join(parameter_value(v) for v in value)
+    return value
+
+def flatten_child(job: ChildJob) -> FlattenedStack:
+    nested = NestedStacks(job.template_urls, job.get_attribute, job.use_parameter_defaults, workers=1)
+    return nested.flatten_file(job.context, job.path, job.ancestors)
+
+def stack_levels(graph: dict[str, list[str]], stacks: list[str]) -> list[list[str]]:
+    # groups the nested stacks so a stack only depends on stacks in earlier groups, directly or
+    # through other resources
+    reach = {}
+    level = {}
+    names = set(stacks)
+    for k in topological_order(graph, stacks):
+        reach[k] = set()
+        for dep in graph.get(k, []):
+            reach[k] |= reach[dep] | ({dep} if dep in names else set())
+        if k in names:
+            level[k] = max((level[dep] + 1 for dep in reach[k]), default=0)
+    levels = [[] for _ in range(max(level.values(), default=-1) + 1)]
+    for k in stacks:
+        levels[level[k]].append(k)
+    return levels
+
+class NestedStacks:
+    # Flattens a template together with its AWS::CloudFormation::Stack resources. The TemplateURL of a
+    # nested stack is mapped to a local file by template_urls, a dict of url prefixes to directories,
+    # or taken as a path relative to the parent template. Nested stacks that do not depend on each other
+    # are flattened in parallel, with the resolved Parameters of the stack resource as the parameters
+    # of their context. Their outputs are returned for Fn::GetAtt [stack, Outputs.Name] in the parent.
+    def __init__(self, template_urls: dict[str, str] = None, get_attribute=None, use_parameter_defaults: bool = False, workers: int = None):
+        self.template_urls = template_urls or {}
+        self.get_attribute = get_attribute
+        self.use_parameter_defaults = use_parameter_defaults
+        self.workers = workers
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def local_path(self, url: str, ancestors: tuple[str, ...]) -> str:
+        for prefix in sorted(self.template_urls, key=len, reverse=True):
+            if url.startswith(prefix):
+                return str(Path(self.template_urls[prefix], url[len(prefix):]))
+        if "://" in url:
+            raise Exception(f"No local path for TemplateURL {url}")
+        return str(Path(ancestors[-1]).parent / url if ancestors else Path(url))
+
+    def stack_getter(self, children: dict[str, FlattenedStack]):
+        get_attribute = self.get_attribute
+        def get_stack_attribute(logical_id, attribute_name, ctx: TemplateParser):
+            if logical_id not in ctx.resources or ctx.resources[logical_id]["type"] != STACK_TYPE:
+                return get_attribute(logical_id, attribute_name, ctx)
+            if logical_id not in children:
+                raise Exception(f"Nested stack {logical_id} is not flattened yet")
+            child = children[logical_id]
+            if attribute_name == "Ref":
+                return child.stack_id
+            name = attribute_name.removeprefix("Outputs.")
+            if name == attribute_name or name not in child.outputs:
+                raise Exception(f"attribute not found {STACK_TYPE} {logical_id} {attribute_name}")
+            return child.outputs[name]
+        return get_stack_attribute
+
+    def child_job(self, parser: TemplateParser, logical_id: str, ancestors: tuple[str, ...]) -> ChildJob:
+        properties = parser.resources[logical_id]["json"].get("Properties", {})
+        if "TemplateURL" not in properties:
+            raise Exception(f"Nested stack {logical_id} has no TemplateURL")
+        parameters = parser.evaluate(properties.get("Parameters", {}))
+        parameters = {} if parameters is NOVALUE else { k: parameter_value(v) for k, v in parameters.items() }
+        context = replace(parser.context, stack_name=f"{parser.context.stack_name}-{logical_id}", parameters=parameters, stack_id=None)
+        if parser.context.stack_id is not None:
+            context.stack_id = derived_stack_id(context)
+        path = self.local_path(parser.evaluate(properties["TemplateURL"]), ancestors)
+        return ChildJob(logical_id, path, context, ancestors, self.template_urls, self.get_attribute, self.use_parameter_defaults)
+
+    def run(self, jobs: list[ChildJob]) -> list[FlattenedStack]:
+        if self.workers == 1 or len(jobs) == 1:
+            return [flatten_child(job) for job in jobs]
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return list(self.executor.map(flatten_child, jobs))
+
+    def flatten(self, context: TemplateContext, template: dict, ancestors: tuple[str, ...] = ()) -> FlattenedStack:
+        children = {}
+        parser = TemplateParser(context, template, get_attribute=self.stack_getter(children), use_parameter_defaults=self.use_parameter_defaults, in_place=False)
+        parser.prepare()
+        stacks = [k for k, v in parser.resources.items() if v["type"] == STACK_TYPE]
+        if stacks:
+            graph = dependency_graph(parser.data["Resources"])
+            for level in stack_levels(graph, stacks):
+                jobs = [self.child_job(parser, k, ancestors) for k in level]
+                for job, child in zip(jobs, self.run(jobs)):
+                    children[job.logical_id] = child
+        parser.resolve()
+        outputs = { k: v.get("Value") for k, v in parser.data.get("Outputs", {}).items() if isinstance(v, dict) }
+        return FlattenedStack(parser.data, parser.refs['AWS::StackId'], outputs, children)
+
+    def flatten_file(self, context: TemplateContext, path: str, ancestors: tuple[str, ...] = ()) -> FlattenedStack:
+        path = str(Path(path).resolve())
+        if path in ancestors:
+            raise Exception(f"Nested stacks include themselves {' -> '.join(ancestors + (path,))}")
+        return self.flatten(context, load_template(path), ancestors + (path,))
@@ -0,0 +1,84 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+import os
+
+from resolve import TemplateParser, TemplateContext, RESOLVE_ONLY_SECTIONS, dependency_graph
+
+def components(graph: dict[str, list[str]], names: list[str]) -> list[list[str]]:
+    # the groups of resources that refer to each other directly or indirectly, in document order
+    parent = { k: k for k in names }
+    position = { k: i for i, k in enumerate(names) }
+    def find(k):
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+    for k in names:
+        for dep in graph.get(k, []):
+            if dep in parent:
+                a, b = find(k), find(dep)
+                if a != b:
+                    parent[max(a, b, key=position.get)] = min(a, b, key=position.get)
+    groups = {}
+    for k in names:
+        groups.setdefault(find(k), []).append(k)
+    return list(groups.values())
+
+def pack(groups: list[list[str]], parts: int, names: list[str]) -> list[list[str]]:
+    # distributes the groups over at most parts lists of about the same number of resources, the
+    # largest groups first. The resources of a part keep their document order.
+    bins = [[] for _ in range(max(1, min(parts, len(groups))))]
+    for group in sorted(groups, key=len, reverse=True):
+        min(bins, key=len).extend(group)
+    position = { k: i for i, k in enumerate(names) }
+    return [sorted(b, key=position.get) for b in bins if b]
+
+@dataclass
+class ResourceJob:
+    template: dict
+    context: TemplateContext
+    get_attribute: any
+    use_parameter_defaults: bool
+
+def resolve_resources(job: ResourceJob) -> dict:
+    # resolves the resources of a part, in a worker process that has its own copy of the template
+    parser = TemplateParser(job.context, job.template, get_attribute=job.get_attribute, use_parameter_defaults=job.use_parameter_defaults)
+    parser.prepare()
+    resources = parser.data["Resources"]
+    for k in list(resources):
+        parser.json_extract(resources[k], resources, k)
+    return resources
+
+def resolve_parallel(context: TemplateContext, template: dict, get_attribute, use_parameter_defaults: bool = False, workers: int = None, executor=None) -> dict:
+    # Resolves the resources of one template in worker processes. Resources only affect each other
+    # through Ref, Fn::GetAtt and Fn::Sub, so the groups of resources that refer to each other are
+    # resolved in different processes, in document order within a process, and merged in the order of
+    # the template. The result is the same as TemplateParser(...).resolve() with the same StackId.
+    # The template is not modified and the get_attribute function has to be picklable.
+    parser = TemplateParser(context, template, get_attribute=get_attribute, use_parameter_defaults=use_parameter_defaults, in_place=False)
+    parser.prepare()
+    names = list(parser.data.get("Resources", {}))
+    graph = parser.dependencies if parser.dependencies is not None else dependency_graph(parser.data.get("Resources", {}))
+    parts = pack(components(graph, names), workers or os.cpu_count(), names)
+    if len(parts) <= 1:
+        parser.resolve()
+        return parser.data
+    # every process uses the same stack id
+    context = replace(context, stack_id=parser.refs['AWS::StackId'])
+    # the sections as prepared, with the loops of AWS::LanguageExtensions expanded
+    shared = { k: v for k, v in parser.data.items() if k in RESOLVE_ONLY_SECTIONS }
+    jobs = [ResourceJob({ **shared, "Resources": { k: parser.data["Resources"][k] for k in part } }, context, get_attribute, use_parameter_defaults) for part in parts]
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(resolve_resources, jobs))
+    else:
+        results = list(executor.map(resolve_resources, jobs))
+    resolved = {}
+    for result in results:
+        resolved.update(result)
+    parser.data["Resources"] = { k: resolved[k] for k in names }
+    parser.get_resources()
+    for section in [k for k in parser.data if k not in RESOLVE_ONLY_SECTIONS and k != "Resources"]:
+        parser.json_extract(parser.data[section], parser.data, section)
+    parser.clean_template()
+    return parser.data
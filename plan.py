@@ -0,0 +1,89 @@
+from dataclasses import dataclass, field
+
+from resolve import TemplateParser, TemplateContext, RESOLVE_ONLY_SECTIONS, intrinsics, is_dynamic_reference, parse_sub, dependency_graph, uses_language_extensions
+
+def is_dynamic(v: any) -> bool:
+    # a Ref, an intrinsic or a dynamic reference, the walker replaces these by their value
+    if isinstance(v, dict):
+        if len(v) != 1:
+            return False
+        name, = v
+        return name == 'Ref' or name in intrinsics or name.startswith('Fn::')
+    return is_dynamic_reference(v)
+
+def dynamic_index(template: dict) -> tuple[dict, int]:
+    # A trie of the dynamic values in the sections that are flattened, and the number of scalars in
+    # the constant subtrees next to them. A key maps to the index of a dict or list that contains
+    # dynamic values, or to None when the value itself is dynamic. Constant subtrees are left out.
+    index = {}
+    constant = 0
+    containers = []
+    stack = [(index, k, template[k]) for k in reversed(template) if k not in RESOLVE_ONLY_SECTIONS]
+    while stack:
+        parent, key, value = stack.pop()
+        if is_dynamic(value):
+            parent[key] = None
+        elif isinstance(value, (dict, list)):
+            child = parent[key] = {}
+            containers.append((parent, key, child))
+            keys = reversed(value) if isinstance(value, dict) else range(len(value) - 1, -1, -1)
+            stack.extend((child, k, value[k]) for k in keys)
+        else:
+            constant += 1
+    # children come after their parents, so empty containers are pruned bottom up
+    for parent, key, child in reversed(containers):
+        if not child:
+            del parent[key]
+    return index, constant
+
+def find_subs(template: dict) -> dict[str, tuple]:
+    subs = {}
+    stack = [template]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, list):
+            stack.extend(v)
+        elif isinstance(v, dict):
+            if len(v) == 1 and 'Fn::Sub' in v:
+                match v['Fn::Sub']:
+                    case str(s) | [str(s), _]: subs[s] = parse_sub(s)
+            stack.extend(v.values())
+    return subs
+
+@dataclass
+class Plan:
+    # A template together with everything about it that does not depend on the context it is flattened
+    # for. The template is shared by all evaluations and is never modified. A plan can be pickled.
+    template: dict
+    # the values that have to be resolved, everything else is copied by reference, see dynamic_index.
+    # None when the template is expanded by AWS::LanguageExtensions first, it is resolved as a whole.
+    index: dict | None = field(default_factory=dict)
+    # number of scalar values that are never looked at again
+    constant: int = 0
+    # resource dependency graph, see resolve.dependency_graph, None when it is computed per evaluation
+    dependencies: dict[str, list[str]] | None = field(default_factory=dict)
+    # Fn::Sub strings that are literals in the template, parsed into segments
+    subs: dict[str, tuple] = field(default_factory=dict)
+
+    def parser(self, context: TemplateContext, get_attribute, use_parameter_defaults: bool=False, lazy_conditions: bool=False, stats=None) -> TemplateParser:
+        parser = TemplateParser(context, self.template, get_attribute=get_attribute, use_parameter_defaults=use_parameter_defaults, lazy_conditions=lazy_conditions, in_place=False, stats=stats)
+        parser.sub_segments = self.subs
+        parser.dependencies = self.dependencies
+        return parser
+
+    def evaluate(self, context: TemplateContext, get_attribute, use_parameter_defaults: bool=False, lazy_conditions: bool=False, stats=None) -> dict:
+        parser = self.parser(context, get_attribute, use_parameter_defaults, lazy_conditions, stats)
+        if self.index is None:
+            parser.resolve()
+            return parser.data
+        parser.prepare()
+        parser.resolve_index(self.index)
+        parser.clean_template()
+        return parser.data
+
+def compile(template: dict) -> Plan:
+    if uses_language_extensions(template):
+        # the loops generate resources that depend on the parameters of the context
+        return Plan(template, None, 0, None, find_subs(template))
+    index, constant = dynamic_index(template)
+    return Plan(template, index, constant, dependency_graph(template.get("Resources", {})), find_subs(template))
@@ -0,0 +1,186 @@
+from dataclasses import dataclass, field, replace
+import asyncio
+import inspect
+import json
+
+from resolve import TemplateParser, TemplateContext, is_dynamic_reference
+
+# the version asked for by SSM typed parameter defaults, which use the latest version
+LATEST = None
+
+@dataclass
+class Lookups:
+    # (name, version) of SSM parameters, version is LATEST for parameter defaults
+    ssm_parameters: set[tuple[str, str]] = field(default_factory=set)
+    exports: set[str] = field(default_factory=set)
+
+    def update(self, other: "Lookups"):
+        self.ssm_parameters |= other.ssm_parameters
+        self.exports |= other.exports
+
+def ssm_reference(value: str) -> tuple[str, str]:
+    # the (name, version) of a {{resolve:ssm:name:version}} reference, see TemplateParser.resolve_dynamic_reference
+    parts = value.strip('{}').split(':')
+    return (parts[2], parts[3]) if len(parts) > 3 and parts[1] == 'ssm' else None
+
+def find_lookups(template: dict, context: TemplateContext, use_parameter_defaults: bool = False) -> tuple[Lookups, list]:
+    # the SSM parameters and exports a template reads, and the Fn::ImportValue arguments that are
+    # not literals and can only be known once the parameters are
+    lookups = Lookups()
+    dynamic = []
+    if use_parameter_defaults:
+        for k, v in template.get('Parameters', {}).items():
+            if k not in context.parameters and 'Default' in v and v.get('Type', '').startswith('AWS::SSM::Parameter::Value'):
+                lookups.ssm_parameters.add((v['Default'], LATEST))
+    stack = [template]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, list):
+            stack.extend(v)
+        elif isinstance(v, dict):
+            if len(v) == 1 and 'Fn::ImportValue' in v:
+                name = v['Fn::ImportValue']
+                if isinstance(name, str):
+                    lookups.exports.add(name)
+                else:
+                    dynamic.append(name)
+            stack.extend(v.values())
+        elif is_dynamic_reference(v) and (reference := ssm_reference(v)):
+            lookups.ssm_parameters.add(reference)
+    return lookups, dynamic
+
+def no_attributes(logical_id, attribute_name, ctx):
+    raise Exception(f"attribute {logical_id}.{attribute_name} is not known before flattening")
+
+def evaluate_export_names(template: dict, context: TemplateContext, names: list, use_parameter_defaults: bool = False) -> set[str]:
+    # export names built with Fn::Sub, Fn::Join or Ref from parameters, the ones that need anything
+    # else are left to fail when the template is flattened
+    parser = TemplateParser(context, template, get_attribute=no_attributes, use_parameter_defaults=use_parameter_defaults, lazy_conditions=True, in_place=False)
+    try:
+        parser.prepare()
+    except Exception:
+        return set()
+    found = set()
+    for name in names:
+        try:
+            value = parser.evaluate(name)
+        except Exception:
+            continue
+        if isinstance(value, str):
+            found.add(value)
+    return found
+
+class DictProvider:
+    # Serves SSM parameters ({ name: { version: value } }, the last version is the latest) and
+    # exports ({ name: value }) from dicts. Names that are not known are left out of the result,
+    # when the latest version of a parameter is asked for it is the last version in the result.
+    def __init__(self, ssm_parameters: dict = None, exports: dict = None):
+        self.ssm_parameters = ssm_parameters or {}
+        self.exports = exports or {}
+        # the batches that were asked for
+        self.calls = []
+
+    async def get_ssm_parameters(self, names: list[tuple[str, str]]) -> dict[str, dict]:
+        self.calls.append(("ssm_parameters", names))
+        found = {}
+        for name, version in names:
+            versions = self.ssm_parameters.get(name, {})
+            if version is LATEST and versions:
+                version = list(versions)[-1]
+            if version in versions:
+                found.setdefault(name, {}).pop(version, None)
+                found[name][version] = versions[version]
+        return found
+
+    async def get_exports(self, names: list[str]) -> dict[str, str]:
+        self.calls.append(("exports", names))
+        return { name: self.exports[name] for name in names if name in self.exports }
+
+class FileProvider(DictProvider):
+    # a json file with "ssm_parameters" and "exports" objects
+    def __init__(self, path: str):
+        with open(path, "r") as f:
+            data = json.load(f)
+        super().__init__(data.get("ssm_parameters"), data.get("exports"))
+
+class Prefetcher:
+    # Fetches what templates look up through a provider, in batches and with a limited number of
+    # requests at once, and caches the results for the run. A provider implements
+    # get_ssm_parameters(names) and get_exports(names), as coroutines or plain functions.
+    def __init__(self, provider, concurrency: int = 8, batch_size: int = 10):
+        self.provider = provider
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.ssm_parameters = {}
+        self.latest = {}
+        self.exports = {}
+        # everything that was asked for, including what the provider did not know
+        self.fetched = Lookups()
+
+    async def call(self, semaphore, method, batch):
+        async with semaphore:
+            result = method(batch)
+            return await result if inspect.isawaitable(result) else result
+
+    async def fetch(self, lookups: Lookups):
+        ssm_parameters = sorted(lookups.ssm_parameters - self.fetched.ssm_parameters, key=lambda item: (item[0], item[1] is LATEST, item[1] or ""))
+        exports = sorted(lookups.exports - self.fetched.exports)
+        self.fetched.update(Lookups(set(ssm_parameters), set(exports)))
+        semaphore = asyncio.Semaphore(self.concurrency)
+        requests = [
+            (kind, items[i:i + self.batch_size], self.call(semaphore, method, items[i:i + self.batch_size]))
+            for kind, method, items in [
+                ("ssm_parameters", self.provider.get_ssm_parameters, ssm_parameters),
+                ("exports", self.provider.get_exports, exports),
+            ]
+            for i in range(0, len(items), self.batch_size)
+        ]
+        results = await asyncio.gather(*(request for _, _, request in requests))
+        for (kind, batch, _), result in zip(requests, results):
+            if kind == "exports":
+                self.exports.update(result)
+                continue
+            for name, versions in result.items():
+                self.ssm_parameters.setdefault(name, {}).update(versions)
+            for name, version in batch:
+                if version is LATEST and result.get(name):
+                    self.latest[name] = list(result[name])[-1]
+
+    def values(self, lookups: Lookups) -> tuple[dict, dict]:
+        # the fetched ssm parameters and exports for lookups, the latest version of a parameter last
+        ssm_parameters = {}
+        for name, version in sorted(lookups.ssm_parameters, key=lambda item: item[1] is LATEST):
+            versions = self.ssm_parameters.get(name, {})
+            version = self.latest.get(name) if version is LATEST else version
+            if version in versions:
+                ssm_parameters.setdefault(name, {}).pop(version, None)
+                ssm_parameters[name][version] = versions[version]
+        return ssm_parameters, { name: self.exports[name] for name in lookups.exports if name in self.exports }
+
+    def context(self, context: TemplateContext, lookups: Lookups) -> TemplateContext:
+        # values in the context take precedence over fetched ones
+        ssm_parameters, exports = self.values(lookups)
+        for name, versions in context.ssm_parameters.items():
+            ssm_parameters[name] = { **ssm_parameters.get(name, {}), **versions }
+        return replace(context, ssm_parameters=ssm_parameters, exports={ **exports, **context.exports })
+
+    async def prepare(self, items: list[tuple[dict, TemplateContext]], use_parameter_defaults: bool = False) -> list[TemplateContext]:
+        # contexts with everything the templates look up, fetched together for all templates
+        found = [find_lookups(template, context, use_parameter_defaults) for template, context in items]
+        await self.fetch(Lookups(set().union(*(l.ssm_parameters for l, _ in found)), set().union(*(l.exports for l, _ in found))))
+        contexts = [self.context(context, lookups) for (_, context), (lookups, _) in zip(items, found)]
+        # export names that are built from parameters, which may be SSM parameters themselves
+        pending = []
+        for i, ((template, _), (lookups, dynamic)) in enumerate(zip(items, found)):
+            if dynamic:
+                names = evaluate_export_names(template, contexts[i], dynamic, use_parameter_defaults)
+                pending.append((i, names))
+                lookups.exports |= names
+        if pending:
+            await self.fetch(Lookups(set(), set().union(*(names for _, names in pending))))
+            for i, _ in pending:
+                contexts[i] = self.context(items[i][1], found[i][0])
+        return contexts
+
+def prefetch(provider, template: dict, context: TemplateContext, use_parameter_defaults: bool = False, **kwargs) -> TemplateContext:
+    return asyncio.run(Prefetcher(provider, **kwargs).prepare([(template, context)], use_parameter_defaults))[0]
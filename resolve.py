@@ -2,29 +2,220 @@
 
 from collections.abc import Callable
 from dataclasses import field, dataclass
-from netaddr import IPNetwork
-import itertools
-import sys
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from typing import NamedTuple
 import re
 import logging
-import base64
-import uuid
 
 log = logging.getLogger('resolve')
-log.setLevel(logging.DEBUG)
-ch = logging.StreamHandler(stream=sys.stderr)
-ch.setLevel(logging.DEBUG)
-ch.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-log.addHandler(ch)
+
+class NoValue:
+    def __repr__(self):
+        return 'AWS::NoValue'
+
+# returned by evaluate when a value resolves to AWS::NoValue
+NOVALUE = NoValue()
+
+class Intrinsic(NamedTuple):
+    # handler(parser, value, contents) returns the resolved value of the intrinsic
+    handler: Callable
+    # the walker resolves the value before the handler is called
+    resolve_arguments: bool = False
+    # the walker resolves whatever the handler returns, used for lazy intrinsics like Fn::If
+    resolve_result: bool = False
+
+intrinsics: dict[str, Intrinsic] = {}
+
+def register_intrinsic(name: str, handler: Callable = None, resolve_arguments: bool = False, resolve_result: bool = False):
+    if handler is None:
+        return lambda handler: register_intrinsic(name, handler, resolve_arguments, resolve_result)
+    intrinsics[name] = Intrinsic(handler, resolve_arguments, resolve_result)
+    return handler
 
 def is_condition(v: any) -> bool: 
-    return isinstance(v, dict) and list(v.keys()) == ['Condition']
+    return isinstance(v, dict) and len(v) == 1 and 'Condition' in v
 
 def is_ref(v: any) -> bool:
-    return isinstance(v, dict) and list(v.keys()) == ['Ref']
+    return isinstance(v, dict) and len(v) == 1 and 'Ref' in v
 
 def is_intrinsic(v: any) -> bool:
-    return isinstance(v, dict) and len(v) == 1 and next(iter(v)).startswith('Fn::')
+    if not isinstance(v, dict) or len(v) != 1:
+        return False
+    for name in v:
+        return name in intrinsics or name.startswith('Fn::')
+
+def is_list_type(type: str) -> bool:
+    # parameter types with a comma delimited list of values
+    return type == "CommaDelimitedList" or type.startswith("List<")
+
+def is_dynamic_reference(v: any) -> bool:
+    return isinstance(v, str) and v.startswith("{{resolve:")
+
+def children(node: list) -> list:
+    # the (node, key, None) slots of the dict or list in node that can resolve to something else,
+    # reversed so they pop off a stack in document order
+    obj = node[0]
+    if isinstance(obj, dict):
+        return [(node, k, None) for k, v in reversed(obj.items()) if isinstance(v, (dict, list)) or (isinstance(v, str) and v.startswith("{{resolve:"))]
+    if isinstance(obj, list):
+        return [(node, idx, None) for idx in range(len(obj) - 1, -1, -1) if isinstance(v := obj[idx], (dict, list)) or (isinstance(v, str) and v.startswith("{{resolve:"))]
+    return []
+
+SUB_LITERAL, SUB_REF, SUB_GETATT = range(3)
+SUB_PATTERN = re.compile(r'\$\{(?P<ref>[^\}]+)\}')
+
+@lru_cache(maxsize=8192)
+def parse_sub(s: str) -> tuple:
+    # split a Fn::Sub string into (kind, name, attribute) segments, literal segments carry their text as name
+    segments = []
+    literal = []
+    pos = 0
+    for m in SUB_PATTERN.finditer(s):
+        literal.append(s[pos:m.start()])
+        pos = m.end()
+        ref = m.group('ref')
+        if ref.startswith('!'):
+            literal.append('${' + ref[1:] + '}')
+            continue
+        if literal:
+            segments.append((SUB_LITERAL, "".join(literal), None))
+            literal = []
+        if "." in ref:
+            segments.append((SUB_GETATT, *ref.split(".", 1)))
+        else:
+            segments.append((SUB_REF, ref, None))
+    literal.append(s[pos:])
+    segments.append((SUB_LITERAL, "".join(literal), None))
+    return tuple(segment for segment in segments if segment[0] != SUB_LITERAL or segment[1])
+
+@lru_cache(maxsize=1024)
+def cidr(block: str, count: int, bits: int) -> tuple[str, ...]:
+    # the first count subnets with bits host bits of an ipv4 or ipv6 block, the nth subnet starts at
+    # the network address plus n << bits. ipaddress is imported on first use to keep imports fast.
+    import ipaddress
+    network = ipaddress.ip_network(block, strict=False)
+    prefix = network.max_prefixlen - bits
+    if bits < 0 or prefix < network.prefixlen:
+        raise Exception(f"Fn::Cidr can not split {block} into subnets with {bits} host bits")
+    address = type(network.network_address)
+    start = int(network.network_address)
+    return tuple(f"{address(start + (i << bits))}/{prefix}" for i in range(min(count, 1 << (prefix - network.prefixlen))))
+
+def find_references(value) -> set[str]:
+    # the names referenced by Ref, Fn::GetAtt and Fn::Sub placeholders anywhere in value
+    found = set()
+    stack = [value]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, list):
+            stack.extend(v)
+        elif isinstance(v, dict):
+            if len(v) == 1:
+                name, = v
+                arg = v[name]
+                match name, arg:
+                    case 'Ref', str(ref):
+                        found.add(ref)
+                        continue
+                    case 'Fn::GetAtt', str(ref):
+                        found.add(ref.split(".", 1)[0])
+                        continue
+                    case 'Fn::GetAtt', [str(ref), *rest]:
+                        found.add(ref)
+                        stack.extend(rest)
+                        continue
+                    case 'Fn::Sub', str(template):
+                        found.update(segment[1] for segment in parse_sub(template) if segment[0] != SUB_LITERAL)
+                        continue
+                    case 'Fn::Sub', [str(template), dict(variables)]:
+                        found.update(segment[1] for segment in parse_sub(template) if segment[0] != SUB_LITERAL and segment[1] not in variables)
+                        stack.append(variables)
+                        continue
+            stack.extend(v.values())
+    return found
+
+def dependency_graph(resources: dict) -> dict[str, list[str]]:
+    # the resources each resource depends on through Ref, Fn::GetAtt, Fn::Sub and DependsOn
+    graph = {}
+    for k, v in resources.items():
+        depends_on = v.get("DependsOn", []) if isinstance(v, dict) else []
+        names = find_references(v) | set([depends_on] if isinstance(depends_on, str) else depends_on)
+        graph[k] = sorted(name for name in names if name in resources and name != k)
+    return graph
+
+def topological_order(graph: dict[str, list[str]], names: list[str]) -> list[str]:
+    # names and everything they depend on, dependencies first
+    order = []
+    done = set()
+    for name in names:
+        if name in done:
+            continue
+        path = [name]
+        stack = [iter(graph.get(name, []))]
+        while stack:
+            for dep in stack[-1]:
+                if dep in done:
+                    continue
+                if dep in path:
+                    cycle = path[path.index(dep):] + [dep]
+                    raise Exception(f"Circular dependency between resources {' -> '.join(map(str, cycle))}")
+                path.append(dep)
+                stack.append(iter(graph.get(dep, [])))
+                break
+            else:
+                stack.pop()
+                done.add(path[-1])
+                order.append(path.pop())
+    return order
+
+# sections that are only needed while resolving, they are removed from the flattened template
+RESOLVE_ONLY_SECTIONS = ["Conditions", "Mappings", "Parameters", "Rules"]
+
+LANGUAGE_EXTENSIONS = "AWS::LanguageExtensions"
+FOR_EACH = "Fn::ForEach::"
+
+def uses_language_extensions(template: dict) -> bool:
+    transform = template.get("Transform")
+    return LANGUAGE_EXTENSIONS in (transform if isinstance(transform, list) else [transform])
+
+def uses_identifier(value, identifier: str, found: set) -> bool:
+    # adds the ids of the dicts and lists in value that contain a use of identifier to found, a
+    # string that contains the identifier counts as a use
+    match value:
+        case dict(): used = [identifier in k for k in value] + [uses_identifier(v, identifier, found) for v in value.values()]
+        case list(): used = [uses_identifier(v, identifier, found) for v in value]
+        case str(): return identifier in value
+        case _: return False
+    if any(used):
+        found.add(id(value))
+        return True
+    return False
+
+def replace_identifier(value, identifier: str, item, found: set):
+    # value with { "Ref": identifier } replaced by item, and ${identifier} in Fn::Sub strings and keys
+    # and &{identifier} in keys by item. Only the dicts and lists in found are copied, the rest of value
+    # is shared with the result.
+    if id(value) not in found:
+        return value
+    text = str(item)
+    match value:
+        case { "Ref": ref } if ref == identifier and len(value) == 1:
+            return item
+        case { "Fn::Sub": str(s) } if len(value) == 1:
+            return { "Fn::Sub": s.replace("${" + identifier + "}", text) }
+        case { "Fn::Sub": [str(s), dict(variables)] } if len(value) == 1:
+            # a variable of the Fn::Sub shadows the identifier
+            s = s if identifier in variables else s.replace("${" + identifier + "}", text)
+            return { "Fn::Sub": [s, replace_identifier(variables, identifier, item, found)] }
+        case dict():
+            alphanumeric = re.sub(r"[^A-Za-z0-9]", "", text)
+            return {
+                k.replace("${" + identifier + "}", text).replace("&{" + identifier + "}", alphanumeric): replace_identifier(v, identifier, item, found)
+                for k, v in value.items()
+            }
+        case list():
+            return [replace_identifier(v, identifier, item, found) for v in value]
 
 @dataclass
 class TemplateContext:
@@ -36,20 +227,50 @@ class TemplateContext:
     exports: dict = field(default_factory=dict)
     partition: str = 'aws'
     url_suffix: str = "amazonaws.com"
+    # the AWS::StackId, a random one is generated when it is not set, see derived_stack_id
+    stack_id: str = None
+
+def derived_stack_id(context: TemplateContext) -> str:
+    # a stack id that is the same every time a stack is flattened for the same account, region and name
+    import uuid
+    id = uuid.uuid5(uuid.NAMESPACE_URL, f"{context.partition}:{context.region}:{context.account}:{context.stack_name}")
+    return f"arn:{context.partition}:cloudformation:{context.region}:{context.account}:stack/{context.stack_name}/{id}"
+
+def random_stack_id(context: TemplateContext) -> str:
+    import uuid
+    return f"arn:{context.partition}:cloudformation:{context.region}:{context.account}:stack/{context.stack_name}/{uuid.uuid4()}"
 
 class TemplateParser:
-    def __init__(self, context: TemplateContext, json_template, get_attribute=Callable[[str, str], any], use_parameter_defaults: bool=False):
-        self.data = json_template
+    def __init__(self, context: TemplateContext, json_template, get_attribute=Callable[[str, str], any], use_parameter_defaults: bool=False, lazy_conditions: bool=False, in_place: bool=True, stats=None):
+        # With in_place=False the template that is passed in is left untouched. The flattened template
+        # is a new tree that shares the subtrees that did not change with the input, self.owned holds
+        # the containers that were created by the parser and can be written to.
+        self.owned = None if in_place else {}
+        self.data = json_template if in_place else self.copy(json_template)
         self.get_attribute=get_attribute
         self.use_parameter_defaults=use_parameter_defaults
+        # only evaluate the conditions that are referenced by a resource, Fn::If or another condition
+        self.lazy_conditions = lazy_conditions
         self.context = context
         self.mappings = {}
         self.parameters = {}
         self.conditions = {}
-        self.conditions = {}
+        self.condition_definitions = {}
+        self.evaluating_conditions = []
+        # Fn::Sub strings that were parsed up front, see plan.py
+        self.sub_segments = {}
+        # the resource dependency graph, computed when it is needed unless it is set up front
+        self.dependencies = None
         self.resources = {}
+        # get_att results by (logical_id, attribute_name), see invalidate_attributes
+        self.attributes = {}
         self.refs = {}
-        self.refs['AWS::StackId'] = f"arn:aws:cloudformation:{context.region}:{context.account}:stack/{context.stack_name}/{uuid.uuid4()}"
+        self.intrinsics = intrinsics
+        # a stats.Stats instruments the parser to count and time what it does
+        self.stats = stats
+        if stats is not None:
+            stats.instrument(self)
+        self.refs['AWS::StackId'] = context.stack_id or random_stack_id(context)
         self.refs['AWS::StackName'] = context.stack_name
         self.refs["AWS::Region"] = context.region
         self.refs["AWS::Partition"] = context.partition
@@ -58,12 +279,21 @@ class TemplateParser:
         # TODO AWS::NotificationARNs
 
     def get_conditions(self):
-        for k in list(self.data.get("Conditions", {}).keys()):
-            self.json_extract(self.data["Conditions"][k], self.data["Conditions"], k)
-            self.conditions[k] = self.data["Conditions"][k]
+        # conditions form a graph through { "Condition": name } references, they are evaluated on
+        # first use and memoized in self.conditions
+        self.conditions = {}
+        self.condition_definitions = self.data.get("Conditions", {})
+        self.evaluating_conditions = []
+        if not self.lazy_conditions:
+            for name in self.condition_definitions:
+                self.get_condition_by_name(name)
 
     def get_parameters(self):
         self.parameters = self.context.parameters.copy()
+        for k, v in self.data.get('Parameters', {}).items():
+            # CloudFormation passes parameter values as strings, like the parameters of a nested stack
+            if isinstance(self.parameters.get(k), str) and is_list_type(v['Type']):
+                self.parameters[k] = self.parameters[k].split(",")
         if self.use_parameter_defaults:
             for k, v in self.data.get('Parameters', {}).items():
                 if k not in self.parameters and 'Default' in v:
@@ -71,165 +301,223 @@ class TemplateParser:
                         values = self.context.ssm_parameters[v['Default']]
                         self.parameters[k] = values[list(values.keys())[-1]]
                     else:
-                        if v['Type'] == "CommaDelimitedList":
+                        if is_list_type(v['Type']):
                             self.parameters[k] = v['Default'].split(",")
                         else:
                             self.parameters[k] = v['Default']
 
+    def copy(self, obj):
+        copy = dict(obj) if isinstance(obj, dict) else list(obj)
+        if self.owned is not None:
+            self.owned[id(copy)] = copy
+        return copy
+
     def get_resources(self):
         self.data["Resources"] = { 
-            k: v for k, v in self.data.get("Resources", {}).items() 
+            k: v if self.owned is None else self.copy_resource(v) for k, v in self.data.get("Resources", {}).items() 
             if not "Condition" in v or self.get_condition_by_name(v["Condition"]) 
         }
-        self.resources = { k: { "json": v, "type": v["Type"] } for k, v in self.data.get("Resources", {}).items() }
+        if self.owned is not None:
+            self.owned[id(self.data["Resources"])] = self.data["Resources"]
+        self.resources = { k: { "json": v, "type": v["Type"], "resolved": set() } for k, v in self.data.get("Resources", {}).items() }
+        self.attributes = {}
+
+    def copy_resource(self, resource):
+        # attribute getters resolve and add properties and metadata of the resources they look at
+        resource = self.copy(resource)
+        for section in ["Properties", "Metadata"]:
+            if isinstance(resource.get(section), (dict, list)):
+                resource[section] = self.copy(resource[section])
+        return resource
+
+    def expand_for_each(self, value):
+        # value with the Fn::ForEach loops in it expanded, the dicts and lists that do not contain a loop
+        # are shared with value
+        match value:
+            case dict():
+                expanded = {}
+                for k, v in value.items():
+                    for key, item in self.for_each(k, v) if k.startswith(FOR_EACH) else [(k, self.expand_for_each(v))]:
+                        if key in expanded:
+                            raise Exception(f"Fn::ForEach generates duplicate key {key}")
+                        expanded[key] = item
+                changed = len(expanded) != len(value) or any(k not in value or value[k] is not v for k, v in expanded.items())
+                return expanded if changed else value
+            case list():
+                expanded = [self.expand_for_each(v) for v in value]
+                return expanded if any(a is not b for a, b in zip(expanded, value)) else value
+        return value
+
+    def for_each(self, name: str, loop):
+        # generates the keys and values of the loop one item of the collection at a time, an instance
+        # only copies the parts of the template that use the identifier
+        match loop:
+            case [str(identifier), collection, dict(template)]: pass
+            case _: raise Exception(f"{name} expects [identifier, collection, template]")
+        items = self.evaluate(collection)
+        if not isinstance(items, list):
+            raise Exception(f"{name} collection {items} is not a list")
+        found = set()
+        uses_identifier(template, identifier, found)
+        for item in items:
+            yield from self.expand_for_each(replace_identifier(template, identifier, item, found)).items()
+
+    def apply_language_extensions(self, sections: list[str]):
+        for section in [k for k in sections if k in self.data]:
+            expanded = self.expand_for_each(self.data[section])
+            if section == "Resources" and expanded is not self.data[section]:
+                # generated resources share the parts that do not use the identifier, attribute
+                # getters add properties and metadata to a resource
+                expanded = { k: v if k in self.data[section] else self.copy_resource(v) for k, v in expanded.items() }
+            self.data[section] = expanded
 
     def get_condition_by_name(self, name):
         match name:
             case name if name in self.conditions: return self.conditions[name]
+            case name if name in self.evaluating_conditions:
+                cycle = self.evaluating_conditions[self.evaluating_conditions.index(name):] + [name]
+                raise Exception(f"Circular condition reference {' -> '.join(cycle)}")
+            case name if name in self.condition_definitions:
+                self.evaluating_conditions.append(name)
+                try:
+                    self.conditions[name] = self.condition_value(self.condition_definitions[name])
+                finally:
+                    self.evaluating_conditions.pop()
+                return self.conditions[name]
         raise Exception(f'Condition "{name}" not found')
 
     def get_condition(self, obj):
         return self.get_condition_by_name(obj['Condition'] if is_condition(obj) else "")
 
+    def condition_value(self, value):
+        return self.get_condition(value) if is_condition(value) else self.evaluate(value)
+
     def get_ssm_parameter(self, name: str, version: str) -> any:
         return self.context.ssm_parameters[name][version]
 
     def clean_template(self):
-        [self.data.pop(k, None) for k in ["Conditions", "Mappings", "Parameters", "Rules"]]
+        [self.data.pop(k, None) for k in RESOLVE_ONLY_SECTIONS]
         for k in self.data.get("Resources", {}).keys():
             self.data["Resources"][k].pop("Condition", None)
             self.data["Resources"][k].pop("DependsOn", None)
 
     def get_att(self, logical_id, attribute_name):
-        return self.get_attribute(logical_id, attribute_name, self)
-
-    def patterns(self, obj):
-        for x in re.finditer(r'\$\{(?P<ref>[^\}]+)\}', obj):
-            yield x.groupdict().get('ref'), x.group()
+        key = (logical_id, attribute_name)
+        if key not in self.attributes:
+            self.attributes[key] = self.get_attribute(logical_id, attribute_name, self)
+        return self.attributes[key]
+
+    def invalidate_attributes(self, logical_id=None):
+        # forget cached attributes (and which properties were resolved) of one or all resources
+        for key in [key for key in self.attributes if logical_id is None or key[0] == logical_id]:
+            del self.attributes[key]
+        for k, resource in self.resources.items():
+            if logical_id is None or k == logical_id:
+                resource["resolved"].clear()
+
+    def sub_value(self, kind, name, attribute, variables):
+        match name:
+            case _ if kind == SUB_GETATT: return self.get_att(name, attribute)
+            case n if n in variables: return variables[n]
+            case 'AWS::NoValue': return ""
+            case _: return self.resolve_ref(name)
+
+    def substitute(self, segments, variables={}):
+        values = {}
+        parts = []
+        for segment in segments:
+            if segment[0] == SUB_LITERAL:
+                parts.append(segment[1])
+                continue
+            if segment not in values:
+                values[segment] = self.sub_value(*segment, variables)
+            parts.append(values[segment])
+        return "".join(parts)
 
     def fn_sub(self, obj, root):
-        self.json_extract(obj, root, 'Fn::Sub')
-        match root['Fn::Sub']:
-            case str(s):
-                for ref, repl in self.patterns(s):
-                    match ref:
-                        case 'AWS::NoValue': s = s.replace(repl, "")
-                        case ref if "." in ref: s = s.replace(repl, self.get_att(*ref.split(".")))
-                        case _ as ref: s = s.replace(repl, self.resolve_ref(ref)) 
-                return s
-            case list(l):
-                self.json_extract(l[1], l, 1)
-                for ref, repl in self.patterns(l[0]):
-                    l[0] = l[0].replace(repl, l[1][ref] if ref in l[1] else self.resolve_ref(ref))
-                return l[0]
+        match obj:
+            case str(s): return self.substitute(self.sub_segments.get(s) or parse_sub(s))
+            case [str(s), dict(variables)]: return self.substitute(self.sub_segments.get(s) or parse_sub(s), variables)
         raise Exception("Wrong list parameters")
 
     def fn_get_att(self, obj, root):
-        return self.get_att(*(obj.split(".") if isinstance(obj, str) else obj))
+        # the attribute name can contain dots, like Outputs.Name of a nested stack
+        return self.get_att(*(obj.split(".", 1) if isinstance(obj, str) else obj))
 
     def fn_or(self, obj, root):
-        self.json_extract(obj)
-        return any(obj)
+        return any(self.condition_value(val) for val in obj)
 
     def fn_equals(self, obj, root):
-        self.json_extract(obj)
         if not isinstance(obj, list) or len(obj) != 2:
             raise Exception("Fn::Equals needs a list with two items as input")
         left, right = obj
-        if isinstance(left, object): self.json_extract(left)
-        if isinstance(right, object): self.json_extract(right)
         return left == right
 
     def fn_not(self, obj, root):
-        obj[0] = self.get_condition(obj[0]) if is_condition(obj[0]) else obj[0]
-        self.json_extract(obj)
-        return not obj[0]
+        return not self.condition_value(obj[0])
 
     def fn_contains(self, obj, root):
         # can only be used in rules
-        self.json_extract(obj)
         return obj[1] in obj[0]
 
     def fn_if(self, obj, root):
-        if self.get_condition_by_name(obj[0]):
-            obj[2] = ""
-            self.json_extract(obj[1], obj, 1)
-            return obj[1]
-        else:
-            obj[1] = ""
-            self.json_extract(obj[2], obj, 2)
-            return obj[2]
+        # only the chosen branch is resolved, by the walker
+        return obj[1] if self.get_condition_by_name(obj[0]) else obj[2]
 
     def fn_join(self, obj, root):
-        self.json_extract(obj)
         return obj[0].join(obj[1])
 
     def fn_select(self, obj, root):
-        self.json_extract(obj)
         return obj[1][int(obj[0])]
 
     def fn_split(self, obj, root):
-        self.json_extract(obj, root, 'Fn::Split')
         return obj[1].split(obj[0])
 
     def fn_and(self, obj, root):
-        self.json_extract(obj)
-        for idx, val in enumerate(obj):
-            if is_condition(val):
-                obj[idx] = self.get_condition(val)
-        self.json_extract(obj)
-        return all(obj)
+        return all(self.condition_value(val) for val in obj)
 
     def fn_get_azs(self, obj, root):
-        self.json_extract(obj, root, 'Fn::GetAZs')
-        region = root['Fn::GetAZs'] or self.refs['AWS::Region']
+        region = obj or self.refs['AWS::Region']
         return [f"{region}a", f"{region}b", f"{region}c"]
 
     def fn_find_in_map(self, obj, root):
-        self.json_extract(obj)
-        if obj[0] in self.mappings:
-            return self.mappings[obj[0]][obj[1]][obj[2]]
-        else:
-            raise Exception(f"Mapping {obj[0]} not found")
+        match obj:
+            case [name, top, second, { "DefaultValue": default }]:
+                values = self.mappings.get(name, {}).get(top, {})
+                return values[second] if second in values else default
+            case [name, top, second] if name in self.mappings:
+                return self.mappings[name][top][second]
+        raise Exception(f"Mapping {obj[0]} not found")
 
     def fn_cidr(self, obj, root):
-        self.json_extract(obj)
-        net = IPNetwork(obj[0])
-        subnets = net.subnet((64 if ':' in net.ip.bits() else 32)-int(obj[2]))
-        return [f'{subnet}' for subnet in itertools.islice(subnets, int(obj[1]))]
+        return list(cidr(obj[0], int(obj[1]), int(obj[2])))
 
     def fn_length(self, obj, root):
-        self.json_extract(obj, root, 'Fn::Length')
-        return len(root['Fn::Length'])
+        return len(obj)
+
+    def fn_to_json_string(self, obj, root):
+        import json
+        return json.dumps(obj, separators=(",", ":"))
 
     def fn_base64(self, obj, root):
-        self.json_extract(obj, root, 'Fn::Base64')
-        return base64.b64encode(root['Fn::Base64'].encode()).decode()
+        import base64
+        return base64.b64encode(obj.encode()).decode()
 
     def fn_import_value(self, obj, root):
-        self.json_extract(obj, root, 'Fn::ImportValue')
-        return self.context.exports[root['Fn::ImportValue']]
+        return self.context.exports[obj]
+
+    def get_intrinsic(self, name) -> Intrinsic:
+        if name not in self.intrinsics:
+            raise Exception(f"Unknown intrinsic {name}")
+        return self.intrinsics[name]
 
     def intrinsic(self, contents):
-        match contents:
-            case { "Fn::Sub":         value }: return self.fn_sub(value, contents)
-            case { "Fn::GetAtt":      value  }: return self.fn_get_att(value, contents)
-            case { "Fn::ImportValue": value  }: return self.fn_import_value(value, contents)
-            case { "Fn::Or":          value  }: return self.fn_or(value, contents)
-            case { "Fn::Equals":      value  }: return self.fn_equals(value, contents)
-            case { "Fn::Not":         value  }: return self.fn_not(value, contents)
-            case { "Fn::Contains":    value  }: return self.fn_contains(value, contents)
-            case { "Fn::Base64":      value  }: return self.fn_base64(value, contents)
-            case { "Fn::If":          value  }: return self.fn_if(value, contents)
-            case { "Fn::Join":        value  }: return self.fn_join(value, contents)
-            case { "Fn::Select":      value  }: return self.fn_select(value, contents)
-            case { "Fn::Split":       value  }: return self.fn_split(value, contents)
-            case { "Fn::And":         value  }: return self.fn_and(value, contents)
-            case { "Fn::GetAZs":      value  }: return self.fn_get_azs(value, contents)
-            case { "Fn::FindInMap":   value  }: return self.fn_find_in_map(value, contents)
-            case { "Fn::Cidr":        value  }: return self.fn_cidr(value, contents)
-            case { "Fn::Length":      value  }: return self.fn_length(value, contents)
-            case _: raise Exception(f"Unknown intrinsic {list(contents.keys())[0]}")
+        for name in contents:
+            entry = self.get_intrinsic(name)
+            if entry.resolve_arguments:
+                self.json_extract(contents[name], contents, name)
+            result = entry.handler(self, contents[name], contents)
+            return self.evaluate(result) if entry.resolve_result else result
 
     def resolve_ref(self, ref):
         match ref:
@@ -238,58 +526,206 @@ class TemplateParser:
             case r if r in self.parameters: return self.parameters[r]
             case _: raise Exception(f"Reference '{ref}' not found. A reference should be either a parameter, a pseudo parameter or the logical name of a resource")
 
+    def resolve_dynamic_reference(self, value: str):
+        parts = value.strip('{}').split(':')
+        if len(parts) > 3 and parts[1] == 'ssm':
+            return self.get_ssm_parameter(parts[2], parts[3])
+        raise Exception(f"Dynamic parameter error {value}")
+
+    def own(self, node: list):
+        # copies the containers from node up to the first one the parser owns, so they can be written
+        # to without touching the template that was passed in
+        path = []
+        while node[1] is not None and id(node[0]) not in self.owned:
+            path.append(node)
+            node = node[1]
+        for node in reversed(path):
+            copy = dict(node[0]) if isinstance(node[0], dict) else list(node[0])
+            self.owned[id(copy)] = copy
+            node[0] = copy
+            node[1][0][node[2]] = copy
+        return path[0][0]
+
     def json_extract(self, obj, root=None, key=None):
-    
-        def extract(obj, root, key):
-            if isinstance(obj, dict):
-                if is_ref(obj):
-                    root[key] = self.resolve_ref(obj['Ref'])
-                elif is_intrinsic(obj):
-                    root[key] = self.intrinsic(obj)
+        # Resolves root[key] in place, or the contents of obj when no root is given. The tree is walked
+        # with an explicit stack of (node, key, intrinsic) slots so every node is visited once and deeply
+        # nested templates do not hit the recursion limit. A node is a [container, parent node, key in
+        # parent] list, so a container can be replaced by a copy when the parser does not resolve in place.
+        # A slot with an intrinsic name applies that intrinsic once its arguments have been resolved.
+        # AWS::NoValue removes the key from a dict, in lists the item is marked and the list is compacted
+        # once all its items are resolved, before an intrinsic it is an argument of sees it.
+        self.walk([([root, None, None], key, None)] if root is not None else children([obj, None, None]))
+
+    def walk(self, stack: list):
+        owned = self.owned
+        table = self.intrinsics
+        # id -> node of a list with NOVALUE items
+        compact = {}
+        while stack:
+            node, k, name = stack.pop()
+            value = node[0][k]
+            again = False
+            if name is not None:
+                if compact:
+                    # the lists in the arguments are resolved, compact them before the intrinsic sees them
+                    for i, parent in list(compact.items()):
+                        while parent is not None and parent[0] is not value:
+                            parent = parent[1]
+                        if parent is not None:
+                            values = compact.pop(i)[0]
+                            values[:] = [v for v in values if v is not NOVALUE]
+                entry = table[name]
+                value = entry.handler(self, value[name], value)
+                again = entry.resolve_result
+            elif isinstance(value, dict):
+                if len(value) != 1:
+                    stack.extend(children([value, node, k]))
+                    continue
+                name, = value
+                if name == 'Ref':
+                    value = NOVALUE if value[name] == 'AWS::NoValue' else self.resolve_ref(value[name])
+                elif name in table or name.startswith('Fn::'):
+                    entry = self.get_intrinsic(name)
+                    if entry.resolve_arguments:
+                        stack.append((node, k, name))
+                        stack.append(([value, node, k], name, None))
+                        continue
+                    value = entry.handler(self, value[name], value)
+                    again = entry.resolve_result
                 else:
-                    for k in list(obj.keys()):
-                        v = obj[k]
-                        if is_ref(v):
-                            if v.get('Ref', None) == 'AWS::NoValue':
-                                del root[key][k]
-                            else:
-                                root[key][k] = self.resolve_ref(v['Ref'])
-                        elif isinstance(v, (dict, list)):
-                            extract(v, obj, k)
-                        elif isinstance(v, str):
-                            extract(v, obj, k)
-                        else:
-                            pass
-            elif isinstance(obj, list):
-                to_remove = []
-                for idx, item in enumerate(obj):
-                    if is_ref(item):
-                        if item['Ref'] != "AWS::NoValue":
-                            obj[idx] = self.resolve_ref(item['Ref'])
-                        else:
-                            to_remove.append(idx)
-                            obj[idx] = ""
-                    elif is_intrinsic(item):
-                        obj[idx] = self.intrinsic(item)
-                    else:
-                        extract(item, obj, idx)
-                for idx in to_remove:
-                    del obj[idx]
+                    stack.extend(children([value, node, k]))
+                    continue
+            elif isinstance(value, list):
+                stack.extend(children([value, node, k]))
+                continue
+            elif is_dynamic_reference(value):
+                value = self.resolve_dynamic_reference(value)
             else:
-                if isinstance(obj, str) and obj.startswith("{{resolve:"):
-                    parts = obj.strip('{}').split(':')
-                    if len(parts) > 3 and parts[1] == 'ssm':
-                        root[key] = self.get_ssm_parameter(parts[2], parts[3])
-                    else:
-                        raise Exception(f"Dynamic parameter error {obj}")
-    
-        extract(obj, root or obj, key)
-
-    def resolve(self):
+                continue
+            container = node[0]
+            # the container that was passed in is always written to, the ones below it are copied
+            if owned is not None and node[1] is not None and id(container) not in owned:
+                container = self.own(node)
+            if value is not NOVALUE:
+                container[k] = value
+            elif isinstance(container, dict):
+                del container[k]
+                continue
+            else:
+                container[k] = value
+                compact[id(container)] = node
+            if again:
+                stack.append((node, k, None))
+        for node in compact.values():
+            node[0][:] = [v for v in node[0] if v is not NOVALUE]
+
+    def evaluate(self, value):
+        holder = [value]
+        self.json_extract(value, holder, 0)
+        return holder[0] if holder else NOVALUE
+
+    def select_resources(self, only: list[str]) -> list[str]:
+        # keeps the resources matching a logical id or type pattern in only, and the resources
+        # they depend on, returns them in the order they should be resolved
+        resources = self.data.get("Resources", {})
+        selected = [
+            k for k, v in resources.items()
+            if any(fnmatchcase(k, pattern) or fnmatchcase(v.get("Type", ""), pattern) for pattern in only)
+        ]
+        if self.dependencies is None:
+            self.dependencies = dependency_graph(resources)
+        order = topological_order(self.dependencies, selected)
+        keep = set(order)
+        self.data["Resources"] = { k: v for k, v in resources.items() if k in keep }
+        return order
+
+    def resolve_index(self, index: dict):
+        # resolves the values marked in an index of dynamic values (see plan.dynamic_index) in a single
+        # walk without looking at the constant subtrees. Keys that no longer exist, like a resource whose
+        # condition is false, are skipped.
+        slots = []
+        visited = 0
+        stack = [([self.data, None, None], index)]
+        while stack:
+            node, children = stack.pop()
+            visited += 1
+            if children is None:
+                slots.append((node[1], node[2], None))
+                continue
+            container = node[0]
+            for k in reversed(children):
+                if k in container if isinstance(container, dict) else isinstance(container, list) and isinstance(k, int) and k < len(container):
+                    stack.append(([container[k], node, k], children[k]))
+        if self.stats is not None:
+            self.stats.nodes += visited
+        slots.reverse()
+        self.walk(slots)
+
+    def prepare(self, only: list[str] = None) -> list[str]:
+        # everything that has to be known before the resources can be resolved, returns the order to
+        # resolve the resources in when only some of them are selected
         self.mappings = self.data.get("Mappings", {})
         self.get_parameters()
+        # the AWS::LanguageExtensions transform is applied to the template as it is resolved, the
+        # conditions are known before the loops in resources and outputs are expanded
+        language_extensions = uses_language_extensions(self.data)
+        if language_extensions:
+            self.apply_language_extensions(["Conditions"])
         self.get_conditions()
+        if language_extensions:
+            self.apply_language_extensions(["Resources", "Outputs"])
+            transforms = [t for t in self.data["Transform"] if t != LANGUAGE_EXTENSIONS] if isinstance(self.data["Transform"], list) else []
+            if transforms:
+                self.data["Transform"] = transforms
+            else:
+                del self.data["Transform"]
+        order = self.select_resources(only) if only is not None else None
         self.get_resources()
-        self.json_extract(self.data)
+        return order
+
+    def resolve_resource(self, resources: dict, k: str):
+        if self.stats is None:
+            self.json_extract(resources[k], resources, k)
+        else:
+            self.stats.timed(self.stats.resources, k, self.json_extract, resources[k], resources, k)
+
+    def resolve(self, only: list[str] = None):
+        order = self.prepare(only)
+        if order is not None:
+            # outputs can refer to anything that was dropped
+            self.data.pop("Outputs", None)
+            resources = self.data["Resources"]
+            for k in order:
+                if k in resources:
+                    self.resolve_resource(resources, k)
+        for section in [k for k in self.data if k not in RESOLVE_ONLY_SECTIONS and (order is None or k != "Resources")]:
+            if section == "Resources" and self.stats is not None:
+                # one walk per resource so the time can be attributed to it
+                for k in list(self.data["Resources"]):
+                    self.resolve_resource(self.data["Resources"], k)
+            else:
+                self.json_extract(self.data[section], self.data, section)
         self.clean_template()
 
+for name, handler in {
+    "Fn::Sub": TemplateParser.fn_sub,
+    "Fn::GetAtt": TemplateParser.fn_get_att,
+    "Fn::ImportValue": TemplateParser.fn_import_value,
+    "Fn::Equals": TemplateParser.fn_equals,
+    "Fn::Contains": TemplateParser.fn_contains,
+    "Fn::Base64": TemplateParser.fn_base64,
+    "Fn::Join": TemplateParser.fn_join,
+    "Fn::Select": TemplateParser.fn_select,
+    "Fn::Split": TemplateParser.fn_split,
+    "Fn::GetAZs": TemplateParser.fn_get_azs,
+    "Fn::FindInMap": TemplateParser.fn_find_in_map,
+    "Fn::Cidr": TemplateParser.fn_cidr,
+    "Fn::Length": TemplateParser.fn_length,
+    "Fn::ToJsonString": TemplateParser.fn_to_json_string,
+}.items():
+    register_intrinsic(name, handler, resolve_arguments=True)
+# the condition functions evaluate their operands one by one so they can short-circuit
+register_intrinsic("Fn::And", TemplateParser.fn_and)
+register_intrinsic("Fn::Or", TemplateParser.fn_or)
+register_intrinsic("Fn::Not", TemplateParser.fn_not)
+register_intrinsic("Fn::If", TemplateParser.fn_if, resolve_result=True)
@@ -0,0 +1,244 @@
+from collections import OrderedDict, deque
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn, UnixStreamServer
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from resolve import TemplateContext, derived_stack_id
+from plan import compile
+from providers import Prefetcher, FileProvider
+from getatt_async import AsyncResolver, stack_key
+from cfn_flatten import load_get_attribute, load_provider
+
+log = logging.getLogger('serve')
+
+class LRU:
+    # a thread safe least recently used cache that counts its hits and misses
+    def __init__(self, size: int):
+        self.size = size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.items:
+                self.hits += 1
+                self.items.move_to_end(key)
+                return self.items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return { "size": len(self.items), "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else None }
+
+def percentiles(values: list[float], points=(50, 90, 99)) -> dict:
+    values = sorted(values)
+    if not values:
+        return {}
+    result = { f"p{p}": values[min(len(values) - 1, max(0, -(-len(values) * p // 100) - 1))] for p in points }
+    result["max"] = values[-1]
+    return result
+
+def digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+class Flattener:
+    # The state of a server: compiled templates, flattened results, ssm parameters and exports that
+    # were looked up and attributes that were fetched are kept between requests. A request can only pick
+    # one of the attribute getters the server was started with, the first is the default.
+    def __init__(self, get_attributes: list[str] = ("getatt_dummy",), lookups=None, attribute_provider=None, max_plans: int = 256, max_results: int = 1024, latencies: int = 10000):
+        self.get_attribute = get_attributes[0]
+        self.getters = { name: load_get_attribute(name) for name in get_attributes }
+        self.plans = LRU(max_plans)
+        self.results = LRU(max_results)
+        # a Prefetcher caches what it looked up for the life of the server
+        self.prefetcher = Prefetcher(lookups) if lookups is not None else None
+        self.prefetch_lock = threading.Lock()
+        # one AsyncResolver per deployed stack, it keeps the attributes it fetched
+        self.attribute_provider = attribute_provider
+        self.resolvers = LRU(max_plans)
+        self.latencies = deque(maxlen=latencies)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def plan(self, request: dict):
+        if "template" in request:
+            template = request["template"]
+            key = digest(template)
+        else:
+            path = Path(request["template_path"]).resolve()
+            stat = path.stat()
+            key = digest([str(path), stat.st_mtime_ns, stat.st_size])
+            template = None
+        plan = self.plans.get(key)
+        if plan is None:
+            if template is None:
+                with open(path, "r") as f:
+                    template = json.load(f)
+            plan = compile(template)
+            self.plans.put(key, plan)
+        return key, plan
+
+    def context(self, request: dict, plan) -> TemplateContext:
+        context = TemplateContext(**request["context"])
+        if context.stack_id is None:
+            context.stack_id = derived_stack_id(context)
+        if self.prefetcher is not None:
+            with self.prefetch_lock:
+                context = asyncio.run(self.prefetcher.prepare([(plan.template, context)], request.get("use_parameter_defaults", True)))[0]
+        return context
+
+    def resolver(self, context: TemplateContext) -> AsyncResolver:
+        key = stack_key(context)
+        resolver = self.resolvers.get(key)
+        if resolver is None:
+            resolver = AsyncResolver(self.attribute_provider)
+            self.resolvers.put(key, resolver)
+        return resolver
+
+    def flatten(self, request: dict) -> dict:
+        start = time.perf_counter()
+        try:
+            key, plan = self.plan(request)
+            context = self.context(request, plan)
+            get_attribute = request.get("get_attribute", self.get_attribute)
+            if get_attribute not in self.getters:
+                raise Exception(f"Attribute getter {get_attribute} is not allowed, start the server with --get-attribute {get_attribute}")
+            use_parameter_defaults = request.get("use_parameter_defaults", True)
+            result_key = digest([key, asdict(context), get_attribute, use_parameter_defaults, self.attribute_provider is not None])
+            data = self.results.get(result_key)
+            if data is None:
+                if self.attribute_provider is not None:
+                    data = asyncio.run(self.resolver(context).resolve(context, plan.template, use_parameter_defaults))
+                else:
+                    data = plan.evaluate(context, self.getters[get_attribute], use_parameter_defaults)
+                self.results.put(result_key, data)
+            return data
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            raise
+        finally:
+            with self.lock:
+                self.requests += 1
+                self.latencies.append((time.perf_counter() - start) * 1000)
+
+    def stats(self) -> dict:
+        with self.lock:
+            latencies = list(self.latencies)
+            requests, errors = self.requests, self.errors
+        stats = {
+            "requests": requests,
+            "errors": errors,
+            "plans": self.plans.stats(),
+            "results": self.results.stats(),
+            "latency_ms": percentiles(latencies),
+        }
+        if self.prefetcher is not None:
+            stats["lookups"] = { "ssm_parameters": len(self.prefetcher.ssm_parameters), "exports": len(self.prefetcher.exports) }
+        if self.attribute_provider is not None:
+            stats["attributes"] = { **self.resolvers.stats(), "fetched": sum(len(r.fetched) for r in list(self.resolvers.items.values())) }
+        return stats
+
+class Handler(BaseHTTPRequestHandler):
+    # POST /flatten with { "template": {...} or "template_path": "...", "context": {...},
+    # "get_attribute": one of the getters of the server, "use_parameter_defaults": true } returns the flattened
+    # template, GET /stats the cache hit rates and latencies and GET /health "ok".
+    flattener: Flattener = None
+
+    def reply(self, status: int, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        match self.path:
+            case "/stats": self.reply(200, self.server.flattener.stats())
+            case "/health": self.reply(200, "ok")
+            case _: self.reply(404, { "error": f"Not found {self.path}" })
+
+    def do_POST(self):
+        if self.path != "/flatten":
+            return self.reply(404, { "error": f"Not found {self.path}" })
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if not isinstance(request, dict) or "context" not in request or not ("template" in request or "template_path" in request):
+                raise ValueError("A request needs a context and a template or template_path")
+            if request.get("get_attribute", self.server.flattener.get_attribute) not in self.server.flattener.getters:
+                raise ValueError(f"Attribute getter {request['get_attribute']} is not allowed")
+        except ValueError as e:
+            return self.reply(400, { "error": str(e) })
+        try:
+            self.reply(200, self.server.flattener.flatten(request))
+        except Exception as e:
+            self.reply(422, { "error": f"{type(e).__name__}: {e}" })
+
+    def address_string(self) -> str:
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        log.debug("%s %s", self.address_string(), format % args)
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+def make_server(flattener: Flattener, port: int = None, socket: str = None, host: str = "127.0.0.1"):
+    if socket is not None:
+        if os.path.exists(socket):
+            os.unlink(socket)
+        server = UnixHTTPServer(socket, Handler)
+    else:
+        server = ThreadingHTTPServer((host, port or 0), Handler)
+    server.flattener = flattener
+    return server
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="cfn-flatten serve", description="Flatten templates for requests on localhost or a unix socket, with warm caches")
+    listen = parser.add_mutually_exclusive_group()
+    listen.add_argument("--port", type=int, default=8080, help="listen on this port of localhost (default: 8080)")
+    listen.add_argument("--socket", help="listen on this unix socket")
+    parser.add_argument("--get-attribute", action="append", help="attribute getter as module or module:function that requests can select, the first is the default (default: getatt_dummy)")
+    parser.add_argument("--lookups", metavar="FILE", help="json file with the ssm_parameters and exports the templates can look up")
+    parser.add_argument("--provider", help="look up ssm parameters and exports with module:factory, see providers.py")
+    parser.add_argument("--attribute-provider", help="get attributes with module:factory, see getatt_async.py")
+    parser.add_argument("--max-plans", type=int, default=256, help="number of compiled templates to keep")
+    parser.add_argument("--max-results", type=int, default=1024, help="number of flattened templates to keep")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    lookups = FileProvider(args.lookups) if args.lookups else load_provider(args.provider) if args.provider else None
+    attribute_provider = load_provider(args.attribute_provider) if args.attribute_provider else None
+    flattener = Flattener(args.get_attribute or ["getatt_dummy"], lookups, attribute_provider, args.max_plans, args.max_results)
+    server = make_server(flattener, None if args.socket else args.port, args.socket)
+    print(f"listening on {args.socket or f'http://127.0.0.1:{server.server_address[1]}'}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
@@ -0,0 +1,60 @@
+from dataclasses import dataclass, field, asdict
+from time import perf_counter
+
+@dataclass
+class Timing:
+    calls: int = 0
+    seconds: float = 0.0
+
+class CountingStack(list):
+    # the stack of the walker, counts the slots that are popped off it
+    def __init__(self, stack, stats):
+        super().__init__(stack)
+        self.stats = stats
+
+    def pop(self, *args):
+        self.stats.nodes += 1
+        return super().pop(*args)
+
+@dataclass
+class Stats:
+    # Collects where the time of a flatten goes, pass an instance as TemplateParser(stats=...). The
+    # parser is only instrumented when a Stats is given, otherwise nothing is counted or timed.
+    # cumulative time of the intrinsic handlers by intrinsic name, nested calls are included
+    intrinsics: dict[str, Timing] = field(default_factory=dict)
+    # time spent resolving each resource by logical id
+    resources: dict[str, Timing] = field(default_factory=dict)
+    # calls to get_attribute by the type of the resource the attribute is taken from
+    get_attribute: dict[str, Timing] = field(default_factory=dict)
+    # slots visited by the walker
+    nodes: int = 0
+
+    def timed(self, table: dict[str, Timing], key: str, function, *args):
+        start = perf_counter()
+        try:
+            return function(*args)
+        finally:
+            timing = table.get(key)
+            if timing is None:
+                timing = table[key] = Timing()
+            timing.calls += 1
+            timing.seconds += perf_counter() - start
+
+    def instrument(self, parser):
+        # replaces the intrinsic table, attribute getter and walker of one parser by timed versions
+        parser.intrinsics = {
+            name: entry._replace(handler=lambda parser, value, contents, name=name, handler=entry.handler: self.timed(self.intrinsics, name, handler, parser, value, contents))
+            for name, entry in parser.intrinsics.items()
+        }
+        get_attribute = parser.get_attribute
+        parser.get_attribute = lambda logical_id, attribute, parser: self.timed(
+            self.get_attribute, parser.resources.get(logical_id, {}).get("type", "unknown"), get_attribute, logical_id, attribute, parser
+        )
+        walk = parser.walk
+        parser.walk = lambda stack: walk(CountingStack(stack, self))
+
+    def top_resources(self, count: int = 10) -> list[tuple[str, float]]:
+        return sorted(((k, v.seconds) for k, v in self.resources.items()), key=lambda item: -item[1])[:count]
+
+    def to_dict(self) -> dict:
+        return { **asdict(self), "top_resources": [{ "resource": k, "seconds": v } for k, v in self.top_resources()] }
@@ -0,0 +1,243 @@
+from collections.abc import Mapping
+from json.decoder import scanstring
+import codecs
+import json
+import re
+import tempfile
+
+from resolve import TemplateParser, TemplateContext, RESOLVE_ONLY_SECTIONS, FOR_EACH, uses_language_extensions
+
+# orjson is used to decode and encode resources when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# orjson reads integers beyond 64 bits as floats, a number of 19 digits or more may be one
+LONG_NUMBER = re.compile(rb'\d{19}')
+# orjson writes floats with an exponent differently from json, like 1.5e-7 for 1.5e-07
+EXPONENT = re.compile(rb'\d[eE]')
+decoder = json.JSONDecoder()
+
+def loads(data):
+    # the same values as json.loads, orjson is only used for data it reads the same
+    if orjson and not LONG_NUMBER.search(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+def dumps(value) -> bytes:
+    # the same bytes as json.dumps(value, indent=2). orjson does not escape non-ascii characters, writes
+    # exponents differently and can not write integers beyond 64 bits, json writes those values.
+    if orjson:
+        try:
+            data = orjson.dumps(value, option=orjson.OPT_INDENT_2)
+            if data.isascii() and not EXPONENT.search(data):
+                return data
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(value, indent=2).encode()
+
+class Reader:
+    # Reads a json document from a binary file member by member. Only the text from the value that is
+    # read on is kept, more is read from the file when a value is not complete, and self.offset is the
+    # byte offset of self.position in the file.
+    def __init__(self, file, chunk_size: int = 1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.position = 0
+        self.offset = 0
+        self.eof = False
+
+    def more(self) -> bool:
+        if self.eof:
+            return False
+        # doubles the text for a value that spans many chunks
+        chunk = self.file.read(max(self.chunk_size, len(self.text) - self.position))
+        self.eof = not chunk
+        self.text = self.text[self.position:] + self.decoder.decode(chunk, final=self.eof)
+        self.position = 0
+        return True
+
+    def advance(self, position: int):
+        self.offset += len(self.text[self.position:position].encode())
+        self.position = position
+
+    def skip(self) -> str:
+        while True:
+            self.advance(WHITESPACE.match(self.text, self.position).end())
+            if self.position < len(self.text) or not self.more():
+                return self.text[self.position:self.position + 1]
+
+    def error(self, message: str):
+        return json.JSONDecodeError(message, self.text, self.position)
+
+    def expect(self, chars: str) -> str:
+        c = self.skip()
+        if not c or c not in chars:
+            raise self.error(f"Expecting one of {chars!r}")
+        self.advance(self.position + 1)
+        return c
+
+    def decode(self, function):
+        # a value that ends at the end of the text may continue in the file, like a number
+        while True:
+            try:
+                value, end = function(self.text, self.position)
+                if end < len(self.text) or self.eof:
+                    self.advance(end)
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.more()
+
+    def members(self):
+        # yields the keys of the object at the position, the caller reads the value of each key
+        self.expect("{")
+        if self.skip() == "}":
+            self.advance(self.position + 1)
+            return
+        while True:
+            if self.skip() != '"':
+                raise self.error("Expecting property name enclosed in double quotes")
+            key = self.decode(lambda text, position: scanstring(text, position + 1))
+            self.expect(":")
+            self.skip()
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+    def value(self):
+        return self.decode(decoder.raw_decode)
+
+def index_template(file) -> tuple[dict, dict]:
+    # the sections of the template in a binary file with their values, except for Resources, and the
+    # (start, end, type, condition) of every resource as byte offsets. One resource is decoded at a time.
+    reader = Reader(file)
+    sections = {}
+    index = {}
+    for key in reader.members():
+        if key == "Resources":
+            sections[key] = None
+            for k in reader.members():
+                if k.startswith(FOR_EACH):
+                    raise Exception("AWS::LanguageExtensions templates can not be streamed")
+                start = reader.offset
+                value = reader.value()
+                if not isinstance(value, dict) or "Type" not in value:
+                    raise Exception(f"Resource {k} has no Type")
+                index[k] = (start, reader.offset, value["Type"], value.get("Condition"))
+        else:
+            sections[key] = reader.value()
+    if reader.skip():
+        raise reader.error("Extra data")
+    return sections, index
+
+class StreamResources(Mapping):
+    # The resources of a template that is flattened one resource at a time, in place of
+    # TemplateParser.resources. A resource is decoded from the template file when it is looked at and written
+    # to a spool file by flush(), a resource that is looked at again is decoded from the spool. So only
+    # the resource that is resolved and the resources it takes attributes from are in memory, attribute
+    # getters can still resolve and add properties and metadata of the resources they look at.
+    def __init__(self, file, index: dict, spool):
+        self.file = file
+        self.index = index
+        self.spool = spool
+        # logical id -> (offset, length) of the latest version in the spool
+        self.spooled = {}
+        self.resolved = { k: set() for k in index }
+        self.loaded = {}
+
+    def __getitem__(self, k):
+        start, end, type = self.index[k]
+        if k not in self.loaded:
+            if k in self.spooled:
+                offset, length = self.spooled[k]
+                self.spool.seek(offset)
+                value = loads(self.spool.read(length))
+            else:
+                self.file.seek(start)
+                value = loads(self.file.read(end - start))
+            self.loaded[k] = { "json": value, "type": type, "resolved": self.resolved[k] }
+        return self.loaded[k]
+
+    def __contains__(self, k):
+        return k in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def flush(self):
+        self.spool.seek(0, 2)
+        for k, resource in self.loaded.items():
+            resource["json"].pop("Condition", None)
+            resource["json"].pop("DependsOn", None)
+            data = dumps(resource["json"])
+            self.spooled[k] = (self.spool.tell(), len(data))
+            self.spool.write(data)
+        self.loaded.clear()
+
+    def read(self, k) -> bytes:
+        offset, length = self.spooled[k]
+        self.spool.seek(offset)
+        return self.spool.read(length)
+
+def write_template(output, sections: list[str], template: dict, resources: StreamResources):
+    # writes the template as json.dumps(..., indent=2) would, copying the resources from the spool
+    output.write(b"{")
+    # like TemplateParser.get_resources, a template without resources gets an empty Resources section
+    sections = [k for k in sections if k in template or k == "Resources"] + ([] if "Resources" in sections else ["Resources"])
+    for i, section in enumerate(sections):
+        output.write(b"%s\n  %s: " % (b"," if i else b"", dumps(section)))
+        if section != "Resources":
+            output.write(dumps(template[section]).replace(b"\n", b"\n  "))
+            continue
+        if not resources:
+            output.write(b"{}")
+            continue
+        output.write(b"{")
+        for j, k in enumerate(resources):
+            output.write(b"%s\n    %s: " % (b"," if j else b"", dumps(k)))
+            output.write(resources.read(k).replace(b"\n", b"\n    "))
+        output.write(b"\n  }")
+    output.write(b"\n}")
+
+def flatten_stream(context: TemplateContext, file, output, get_attribute, use_parameter_defaults: bool = False) -> dict:
+    # Flattens the template in file and writes it to output, both binary files, one resource at a time.
+    # The sections other than Resources are decoded up front, the resources are resolved in document
+    # order and spooled to a temporary file, so the memory used is bounded by the largest resources
+    # instead of a multiple of the whole template. The output is the same as that of TemplateParser.resolve()
+    # with json.dumps(..., indent=2). Returns the flattened sections other than Resources.
+    sections, index = index_template(file)
+    if uses_language_extensions(sections):
+        raise Exception("AWS::LanguageExtensions templates can not be streamed")
+    template = { k: v for k, v in sections.items() if k != "Resources" }
+    parser = TemplateParser(context, template, get_attribute=get_attribute, use_parameter_defaults=use_parameter_defaults)
+    parser.mappings = template.get("Mappings", {})
+    parser.get_parameters()
+    parser.get_conditions()
+    index = { k: (start, end, type) for k, (start, end, type, condition) in index.items() if condition is None or parser.get_condition_by_name(condition) }
+    with tempfile.TemporaryFile() as spool:
+        resources = parser.resources = StreamResources(file, index, spool)
+        for section in [k for k in sections if k not in RESOLVE_ONLY_SECTIONS]:
+            if section == "Resources":
+                for k in index:
+                    resource = resources[k]
+                    parser.json_extract(resource["json"], resource, "json")
+                    resources.flush()
+            else:
+                parser.json_extract(template[section], template, section)
+        resources.flush()
+        for k in RESOLVE_ONLY_SECTIONS:
+            template.pop(k, None)
+        write_template(output, list(sections), template, resources)
+    return template
@@ -3,7 +3,7 @@ from os.path import realpath, dirname, sep, join
 import json
 
 def pytest_generate_tests(metafunc):
-    if metafunc.function.__name__ != "test_generic":
+    if "input_expected" not in metafunc.fixturenames:
         return
     test_ids = []
     test_cases = []
@@ -0,0 +1,60 @@
+import json
+import os
+from resolve import TemplateParser, TemplateContext, derived_stack_id
+from getatt_dummy import get_attribute
+from cache import Cache, track_reads
+
+TEMPLATE = {
+    "Parameters": { "Env": { "Type": "String" }, "Unused": { "Type": "String" } },
+    "Resources": {
+        "MyTest": {
+            "Type": "AWS::Some::Type",
+            "Properties": {
+                "Name": { "Fn::Sub": "${Env}-${AWS::Region}" },
+                "Vpc": { "Fn::ImportValue": "vpc" },
+                "Secret": "{{resolve:ssm:/secret:1}}"
+            }
+        }
+    }
+}
+
+def parser(**parameters) -> TemplateParser:
+    context = TemplateContext("123456789", "eu-central-1", "MyStack", parameters={ "Env": "dev", "Unused": "a", **parameters }, ssm_parameters={ "/secret": { "1": "s" } }, exports={ "vpc": "vpc-1", "other": "x" })
+    context.stack_id = derived_stack_id(context)
+    return TemplateParser(context, TEMPLATE, get_attribute=get_attribute, in_place=False)
+
+def test_derived_stack_id():
+    assert parser().refs["AWS::StackId"] == parser().refs["AWS::StackId"]
+    assert parser().refs["AWS::StackId"].startswith("arn:aws:cloudformation:eu-central-1:123456789:stack/MyStack/")
+
+def test_track_reads():
+    p = parser()
+    reads = track_reads(p)
+    p.resolve()
+    assert reads == { ("ref", "Env"), ("ref", "AWS::Region"), ("export", "vpc"), ("ssm", "/secret", "1") }
+
+def test_cache(tmp_path):
+    cache = Cache(str(tmp_path))
+    key = cache.template_key(json.dumps(TEMPLATE).encode(), get_attribute, {})
+    p = parser()
+    p.get_parameters()
+    assert cache.lookup(key, p) is None
+    reads = track_reads(p)
+    p.resolve()
+    cache.store(key, p, reads, b"flattened")
+    hit = parser(Unused="b")
+    hit.get_parameters()
+    assert cache.lookup(key, hit) == b"flattened"
+    miss = parser(Env="prd")
+    miss.get_parameters()
+    assert cache.lookup(key, miss) is None
+
+def test_evict(tmp_path):
+    cache = Cache(str(tmp_path), max_size=10)
+    for i, key in enumerate(["aa1", "aa2", "aa3"]):
+        path = cache.entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"12345")
+        os.utime(path, (i, i))
+    cache.evict()
+    assert [p.name for p in sorted((tmp_path / "entries").glob("*/*.json"))] == ["aa2.json", "aa3.json"]
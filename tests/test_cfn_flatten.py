@@ -0,0 +1,132 @@
+import json
+from cfn_flatten import main, find_templates
+from multi import MultiContext
+
+TEMPLATE = {
+    "Parameters": {
+        "Env": {
+            "Type": "String"
+        }
+    },
+    "Resources": {
+        "MyTest": {
+            "Type": "AWS::Some::Type",
+            "Properties": {
+                "MyProp": { "Fn::Sub": "${Env}-${AWS::Region}" }
+            }
+        }
+    }
+}
+
+CONTEXTS = {
+    "dev": { "account": "111111111111", "region": "eu-west-1", "parameters": { "Env": "dev" } },
+    "prd": { "account": "222222222222", "region": "eu-central-1", "parameters": { "Env": "prd" } }
+}
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data))
+
+def test_batch_into_output_dir(tmp_path):
+    write(tmp_path / "templates" / "app.json", TEMPLATE)
+    write(tmp_path / "templates" / "nested" / "other.json", TEMPLATE)
+    write(tmp_path / "contexts.json", CONTEXTS)
+    assert main([str(tmp_path / "templates"), "-c", str(tmp_path / "contexts.json"), "-o", str(tmp_path / "out"), "-w", "2"]) == 0
+    output = json.loads((tmp_path / "out" / "prd" / "nested" / "other.json").read_text())
+    assert output["Resources"]["MyTest"]["Properties"]["MyProp"] == "prd-eu-central-1"
+    assert (tmp_path / "out" / "dev" / "app.json").exists()
+
+def test_failures_do_not_stop_batch(tmp_path, capsys):
+    write(tmp_path / "good.json", TEMPLATE)
+    write(tmp_path / "bad.json", {"Resources": {"R": {"Type": "T", "Properties": {"P": {"Ref": "Missing"}}}}})
+    write(tmp_path / "contexts.json", CONTEXTS)
+    assert main([str(tmp_path / "*.json"), "-c", str(tmp_path / "contexts.json"), "-w", "1"]) == 1
+    assert json.loads((tmp_path / "good.dev.flat.json").read_text())["Resources"]["MyTest"]["Properties"]["MyProp"] == "dev-eu-west-1"
+    err = capsys.readouterr().err
+    assert "bad.json [prd]" in err
+    assert "flattened 2 of 4 templates, 2 failed" in err
+
+def test_dotted_template_names(tmp_path):
+    template = { "Resources": { "MyTest": { "Type": "AWS::Some::Type", "Properties": { "MyProp": { "Ref": "AWS::StackName" } } } } }
+    write(tmp_path / "stack.dev.json", template)
+    write(tmp_path / "stack.prd.json", template)
+    write(tmp_path / "contexts.json", { "dev": CONTEXTS["dev"] })
+    assert main([str(tmp_path / "stack.*.json"), "-c", str(tmp_path / "contexts.json"), "-w", "1"]) == 0
+    for name in ["stack.dev", "stack.prd"]:
+        assert json.loads((tmp_path / f"{name}.dev.flat.json").read_text())["Resources"]["MyTest"]["Properties"]["MyProp"] == name
+
+def test_find_templates_skips_outputs(tmp_path):
+    write(tmp_path / "app.json", TEMPLATE)
+    write(tmp_path / "app.dev.flat.json", TEMPLATE)
+    assert [p.name for p, _ in find_templates([str(tmp_path)])] == ["app.json"]
+
+def test_output_dir_inside_templates(tmp_path, capsys):
+    write(tmp_path / "t" / "app.json", TEMPLATE)
+    write(tmp_path / "contexts.json", CONTEXTS)
+    for _ in range(2):
+        assert main([str(tmp_path / "t"), "-c", str(tmp_path / "contexts.json"), "-o", str(tmp_path / "t" / "out"), "-w", "1"]) == 0
+        assert "flattened 2 of 2 templates" in capsys.readouterr().err
+    assert [p.relative_to(tmp_path / "t").as_posix() for p, _ in find_templates([str(tmp_path / "t")], output_dir=str(tmp_path / "t" / "out"))] == ["app.json"]
+
+def test_stats_and_profile(tmp_path):
+    write(tmp_path / "app.json", TEMPLATE)
+    write(tmp_path / "contexts.json", CONTEXTS)
+    assert main([str(tmp_path / "app.json"), "-c", str(tmp_path / "contexts.json"), "--stats", str(tmp_path / "stats.json"), "--profile", str(tmp_path / "profile.out")]) == 0
+    stats = json.loads((tmp_path / "stats.json").read_text())
+    assert [s["context"] for s in stats] == ["dev", "prd"]
+    assert stats[0]["intrinsics"]["Fn::Sub"]["calls"] == 1
+    assert stats[0]["top_resources"][0]["resource"] == "MyTest"
+    assert (tmp_path / "profile.out").stat().st_size > 0
+
+def test_lookups(tmp_path):
+    write(tmp_path / "app.json", {"Resources": {"R": {"Type": "T", "Properties": {"P": {"Fn::ImportValue": {"Fn::Sub": "${AWS::Region}-vpc"}}}}}})
+    write(tmp_path / "contexts.json", CONTEXTS)
+    write(tmp_path / "lookups.json", {"exports": {"eu-west-1-vpc": "vpc-1", "eu-central-1-vpc": "vpc-2"}})
+    assert main([str(tmp_path), "-c", str(tmp_path / "contexts.json"), "--lookups", str(tmp_path / "lookups.json"), "-w", "1"]) == 0
+    assert json.loads((tmp_path / "app.prd.flat.json").read_text())["Resources"]["R"]["Properties"]["P"] == "vpc-2"
+
+def test_fleet(tmp_path, capsys):
+    write(tmp_path / "network.json", {"Resources": {"Vpc": {"Type": "T", "Properties": {}}}, "Outputs": {"Vpc": {"Value": {"Fn::Sub": "vpc-${AWS::Region}"}, "Export": {"Name": {"Fn::Sub": "${AWS::StackName}-vpc"}}}}})
+    write(tmp_path / "app.json", {"Resources": {"R": {"Type": "T", "Properties": {"Vpc": {"Fn::ImportValue": "network-vpc"}}}}, "Outputs": {"Url": {"Value": "url", "Export": {"Name": "app-url"}}}})
+    write(tmp_path / "monitoring.json", {"Resources": {"R": {"Type": "T", "Properties": {"Url": {"Fn::ImportValue": "app-url"}, "Missing": {"Fn::ImportValue": "missing"}}}}})
+    write(tmp_path / "contexts.json", CONTEXTS)
+    assert main([str(tmp_path), "-c", str(tmp_path / "contexts.json"), "--fleet", "-w", "2"]) == 1
+    assert json.loads((tmp_path / "app.prd.flat.json").read_text())["Resources"]["R"]["Properties"]["Vpc"] == "vpc-eu-central-1"
+    assert "flattened 4 of 6 templates, 2 failed" in capsys.readouterr().err
+    write(tmp_path / "monitoring.json", {"Resources": {"R": {"Type": "T", "Properties": {"Url": {"Fn::ImportValue": "app-url"}}}}})
+    write(tmp_path / "network.json", {"Resources": {"R": {"Type": "T", "Properties": {"P": {"Ref": "Missing"}}}}, "Outputs": {"Vpc": {"Value": "v", "Export": {"Name": "network-vpc"}}}})
+    assert main([str(tmp_path / "*.json"), "-c", str(tmp_path / "contexts.json"), "--fleet", "-w", "1"]) == 1
+    err = capsys.readouterr().err
+    assert "monitoring.json [dev]: Skipped: imports from" in err
+    assert "flattened 0 of 6 templates, 6 failed" in err
+
+def test_cache(tmp_path, capsys):
+    write(tmp_path / "app.json", TEMPLATE)
+    write(tmp_path / "contexts.json", CONTEXTS)
+    args = [str(tmp_path / "app.json"), "-c", str(tmp_path / "contexts.json"), "-w", "1", "--cache-dir", str(tmp_path / "cache")]
+    assert main(args) == 0
+    first = (tmp_path / "app.dev.flat.json").read_text()
+    (tmp_path / "app.dev.flat.json").unlink()
+    assert main(args) == 0
+    assert "flattened 2 of 2 templates, 0 failed, 2 from cache" in capsys.readouterr().err
+    assert (tmp_path / "app.dev.flat.json").read_text() == first
+    assert main(args + ["--no-cache"]) == 0
+    assert "from cache" not in capsys.readouterr().err
+
+def test_stream(tmp_path):
+    write(tmp_path / "app.json", TEMPLATE)
+    write(tmp_path / "contexts.json", CONTEXTS)
+    args = [str(tmp_path / "app.json"), "-c", str(tmp_path / "contexts.json"), "-w", "1", "--no-cache"]
+    assert main(args) == 0
+    expected = (tmp_path / "app.prd.flat.json").read_text()
+    (tmp_path / "app.prd.flat.json").unlink()
+    assert main(args + ["--stream"]) == 0
+    assert (tmp_path / "app.prd.flat.json").read_text() == expected
+
+def test_multi(tmp_path):
+    write(tmp_path / "app.json", TEMPLATE)
+    write(tmp_path / "contexts.json", CONTEXTS)
+    assert main([str(tmp_path / "app.json"), "-c", str(tmp_path / "contexts.json"), "-w", "1", "--multi"]) == 0
+    multi = MultiContext.load(tmp_path / "app.multi.flat.json")
+    assert multi.materialize("prd")["Resources"]["MyTest"]["Properties"]["MyProp"] == "prd-eu-central-1"
+    assert not (tmp_path / "app.prd.flat.json").exists()
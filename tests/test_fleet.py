@@ -0,0 +1,51 @@
+import pytest
+from resolve import TemplateContext
+from fleet import scan, fleet_levels
+
+def test_scan():
+    template = {
+        "Parameters": { "Env": { "Type": "String" } },
+        "Conditions": { "IsPrd": { "Fn::Equals": [ { "Ref": "Env" }, "prd" ] } },
+        "Resources": {
+            "R": { "Type": "T", "Properties": { "A": { "Fn::ImportValue": "vpc" }, "B": { "Fn::ImportValue": { "Fn::Sub": "${Env}-subnet" } } } }
+        },
+        "Outputs": {
+            "Name": { "Value": "x", "Export": { "Name": { "Fn::Sub": "${AWS::StackName}-name" } } },
+            "Prd": { "Condition": "IsPrd", "Value": "y", "Export": { "Name": "prd-only" } }
+        }
+    }
+    context = TemplateContext("123456789", "eu-central-1", "app", parameters={ "Env": "dev" })
+    assert scan(template, context) == ({ "app-name" }, { "vpc", "dev-subnet" })
+
+def test_scan_literal_exports_with_condition():
+    # only literal names, a switched off export is still left out
+    template = {
+        "Parameters": { "Env": { "Type": "String" } },
+        "Conditions": { "IsPrd": { "Fn::Equals": [ { "Ref": "Env" }, "prd" ] } },
+        "Resources": { "R": { "Type": "T", "Properties": { "A": { "Fn::ImportValue": "vpc" } } } },
+        "Outputs": {
+            "Name": { "Value": "x", "Export": { "Name": "name" } },
+            "Prd": { "Condition": "IsPrd", "Value": "y", "Export": { "Name": "prd-only" } }
+        }
+    }
+    assert scan(template, TemplateContext("123456789", "eu-central-1", "app", parameters={ "Env": "dev" })) == ({ "name" }, { "vpc" })
+    assert scan(template, TemplateContext("123456789", "eu-central-1", "app", parameters={ "Env": "prd" })) == ({ "name", "prd-only" }, { "vpc" })
+
+def test_fleet_levels():
+    stacks = {
+        "network": ({ "vpc" }, set()),
+        "dns": ({ "zone" }, set()),
+        "app": ({ "app-url" }, { "vpc", "zone", "external" }),
+        "monitoring": (set(), { "app-url" }),
+    }
+    levels, dependencies = fleet_levels(stacks)
+    assert levels == [["dns", "network"], ["app"], ["monitoring"]]
+    assert dependencies["app"] == { "network", "dns" }
+
+def test_fleet_cycle():
+    with pytest.raises(Exception, match="Circular imports between stacks a -> b -> a"):
+        fleet_levels({ "a": ({ "x" }, { "y" }), "b": ({ "y" }, { "x" }), "c": (set(), { "x" }) })
+
+def test_duplicate_export():
+    with pytest.raises(Exception, match="Export x is exported by both a and b"):
+        fleet_levels({ "a": ({ "x" }, set()), "b": ({ "x" }, set()) })
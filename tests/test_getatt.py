@@ -0,0 +1,84 @@
+from pathlib import Path
+import subprocess
+import sys
+import pytest
+from resolve import TemplateParser, TemplateContext
+from getatt import get_attribute, construct_arn, compile_template, resource_type, spec_lines
+import getatt
+
+def test_property_resolved_once():
+    p = TemplateParser(TemplateContext("123456789", "eu-central-1", "MyStack"), {
+        "Resources": {
+            "MyRole": { "Type": "AWS::IAM::Role", "Properties": { "RoleName": { "Fn::Sub": "${AWS::StackName}-role" } } },
+            "MyTest": {
+                "Type": "AWS::Some::Type",
+                "Properties": { "Roles": [ { "Ref": "MyRole" }, { "Ref": "MyRole" } ] }
+            }
+        }
+    }, get_attribute=get_attribute)
+    p.get_resources()
+    extracted = []
+    json_extract = p.json_extract
+    p.json_extract = lambda obj, root=None, key=None: extracted.append(key) or json_extract(obj, root, key)
+    assert get_attribute("MyRole", "Ref", p) == "MyStack-role"
+    assert get_attribute("MyRole", "Ref", p) == "MyStack-role"
+    assert extracted == ["RoleName"]
+
+def parser(resources, partition="aws", url_suffix="amazonaws.com"):
+    p = TemplateParser(TemplateContext("123456789012", "cn-north-1", "MyStack", partition=partition, url_suffix=url_suffix), { "Resources": resources }, get_attribute=get_attribute)
+    p.get_resources()
+    return p
+
+def test_arns_use_the_context():
+    p = parser({
+        "Role": { "Type": "AWS::IAM::Role", "Properties": { "Path": "/service/" } },
+        "Parameter": { "Type": "AWS::SSM::Parameter", "Properties": { "Name": "/app/value", "Value": "x" } },
+        "Queue": { "Type": "AWS::SQS::Queue", "Properties": { "QueueName": { "Fn::Sub": "${AWS::StackName}-queue" } } },
+        "Bucket": { "Type": "AWS::S3::Bucket" }
+    }, "aws-cn", "amazonaws.com.cn")
+    assert get_attribute("Role", "Arn", p) == "arn:aws-cn:iam::123456789012:role/service/role"
+    assert get_attribute("Parameter", "Arn", p) == "arn:aws-cn:ssm:cn-north-1:123456789012:parameter/app/value"
+    assert get_attribute("Parameter", "Value", p) == "x"
+    assert get_attribute("Queue", "Ref", p) == "https://sqs.cn-north-1.amazonaws.com.cn/123456789012/MyStack-queue"
+    assert get_attribute("Queue", "Arn", p) == "arn:aws-cn:sqs:cn-north-1:123456789012:MyStack-queue"
+    assert get_attribute("Bucket", "RegionalDomainName", p) == "bucket.s3.cn-north-1.amazonaws.com.cn"
+    assert p.data["Resources"]["Bucket"]["Metadata"] == { "aws:resolver:BucketName": "bucket" }
+    assert construct_arn("name", "sns", ctx=p) == "arn:aws-cn:sns:cn-north-1:123456789012:name"
+
+def test_generated_defaults():
+    p = parser({ "Template": { "Type": "AWS::EC2::LaunchTemplate" }, "Subnet": { "Type": "AWS::EC2::Subnet" } })
+    assert get_attribute("Template", "Ref", p) == "lt-template"
+    assert get_attribute("Template", "LatestVersionNumber", p) == "1"
+    assert get_attribute("Subnet", "AvailabilityZone", p) == "cn-north-1a"
+    assert get_attribute("Subnet", "VpcId", p) == ""
+    assert p.data["Resources"]["Template"]["Metadata"] == { "aws:resolver:TemplateId": "lt-template" }
+
+def test_unknown():
+    p = parser({ "Bucket": { "Type": "AWS::S3::Bucket" }, "Thing": { "Type": "AWS::Some::Thing" }, "Custom": { "Type": "Custom::Thing" } })
+    with pytest.raises(Exception, match="attribute not found AWS::S3::Bucket Bucket Missing"):
+        get_attribute("Bucket", "Missing", p)
+    with pytest.raises(Exception, match="attribute not found AWS::Some::Thing Thing Ref"):
+        get_attribute("Thing", "Ref", p)
+    with pytest.raises(Exception, match="attribute not found Missing Ref"):
+        get_attribute("Missing", "Ref", p)
+    assert get_attribute("Custom", "Value", p) == "CustomResourceResponseTODO"
+
+def test_getters_in_code(monkeypatch):
+    monkeypatch.setitem(getatt.attribute_getters, "AWS::S3::Bucket", lambda id, o, att, ctx: f"{id}/{att}")
+    assert get_attribute("Bucket", "Arn", parser({ "Bucket": { "Type": "AWS::S3::Bucket" } })) == "Bucket/Arn"
+
+def test_every_spec():
+    # every attribute of every type can be taken from a resource without properties
+    for type in spec_lines():
+        spec = resource_type(type)
+        p = parser({ "Resource": { "Type": type } })
+        for attribute in spec.formatters:
+            assert isinstance(get_attribute("Resource", attribute, p), str), (type, attribute)
+
+def test_specs_are_loaded_on_first_use():
+    code = "import getatt; assert getatt.spec_lines.cache_info().currsize == 0; getatt.resource_type('AWS::S3::Bucket'); assert getatt.resource_type.cache_info().currsize == 1"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=Path(getatt.__file__).parent)
+
+def test_compile_template():
+    assert compile_template("${A}")({ "A": [1] }) == [1]
+    assert compile_template("{x}-${A}-${B}")({ "A": 1, "B": "b" }) == "{x}-1-b"
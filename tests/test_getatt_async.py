@@ -0,0 +1,94 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from resolve import TemplateParser, TemplateContext
+from getatt_dummy import get_attribute
+from getatt_async import AsyncResolver, HttpProvider, find_attribute_targets, resolve
+
+TEMPLATE = {
+    "Parameters": { "Attribute": { "Type": "String", "Default": "QueueName" } },
+    "Resources": {
+        "MyRole": { "Type": "AWS::IAM::Role", "Properties": {} },
+        "MyQueue": { "Type": "AWS::SQS::Queue", "Properties": {} },
+        "MyTest": {
+            "Type": "AWS::Some::Type",
+            "Properties": {
+                "Role": { "Ref": "MyRole" },
+                "Arn": { "Fn::GetAtt": [ "MyRole", "Arn" ] },
+                "Url": { "Fn::GetAtt": "MyQueue.QueueUrl" },
+                "Sub": { "Fn::Sub": [ "${MyQueue.Arn}/${Name}", { "Name": { "Ref": "MyRole" } } ] },
+                "Dynamic": { "Fn::GetAtt": [ "MyQueue", { "Ref": "Attribute" } ] }
+            }
+        }
+    },
+    "Outputs": { "Queue": { "Value": { "Ref": "MyQueue" } } }
+}
+
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        Handler.requests.append(body)
+        attributes = [
+            { "logical_id": t["logical_id"], "attribute": t["attribute"], "value": f"<!--{t['logical_id']}.{t['attribute']}-->" }
+            for t in body["targets"]
+        ]
+        data = json.dumps({ "attributes": attributes }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+
+def context():
+    return TemplateContext("123456789", "eu-central-1", "MyStack")
+
+def test_find_attribute_targets():
+    assert find_attribute_targets(TEMPLATE["Resources"]["MyTest"], TEMPLATE["Resources"]) == {
+        ("MyRole", "Ref"), ("MyRole", "Arn"), ("MyQueue", "QueueUrl"), ("MyQueue", "Arn")
+    }
+
+def test_matches_sync_path(server):
+    p = TemplateParser(context(), TEMPLATE, get_attribute=get_attribute, use_parameter_defaults=True, in_place=False)
+    p.resolve()
+    assert resolve(HttpProvider(server), context(), TEMPLATE, use_parameter_defaults=True, batch_size=2) == p.data
+    # everything that is known up front in batches of two, the dynamic attribute when it is missed
+    assert sorted(len(request["targets"]) for request in Handler.requests[:3]) == [1, 2, 2]
+    assert Handler.requests[3]["targets"] == [{ "logical_id": "MyQueue", "type": "AWS::SQS::Queue", "attribute": "QueueName" }]
+    assert len(Handler.requests) == 4
+    assert Handler.requests[0]["context"]["stack_name"] == "MyStack"
+
+def test_unknown_attribute():
+    class Provider:
+        def get_attributes(self, context, targets):
+            return {}
+    with pytest.raises(Exception, match="attribute not found MyRole Ref"):
+        resolve(Provider(), context(), TEMPLATE, use_parameter_defaults=True)
+
+def test_attributes_are_kept_per_stack():
+    class Provider:
+        calls = []
+        def get_attributes(self, context, targets):
+            Provider.calls.append(context.region)
+            return { (logical_id, attribute): f"{context.region}-{logical_id}" for logical_id, _, attribute in targets }
+    template = { "Resources": { "MyRole": { "Type": "AWS::IAM::Role" } }, "Outputs": { "Role": { "Value": { "Fn::GetAtt": [ "MyRole", "Arn" ] } } } }
+    resolver = AsyncResolver(Provider())
+    for region in ["eu-central-1", "eu-west-1", "eu-central-1"]:
+        data = asyncio.run(resolver.resolve(TemplateContext("123456789", region, "MyStack"), template))
+        assert data["Outputs"]["Role"]["Value"] == f"{region}-MyRole"
+    assert Provider.calls == ["eu-central-1", "eu-west-1"]
@@ -0,0 +1,71 @@
+import copy
+from resolve import TemplateParser, TemplateContext
+from getatt_dummy import get_attribute
+from incremental import IncrementalParser
+
+TEMPLATE = {
+    "Parameters": {
+        "Env": { "Type": "String", "Default": "dev" },
+        "Size": { "Type": "String", "Default": "small" }
+    },
+    "Mappings": {
+        "Sizes": { "small": { "Memory": "128" }, "large": { "Memory": "1024" } }
+    },
+    "Conditions": {
+        "IsProd": { "Fn::Equals": [ { "Ref": "Env" }, "prd" ] }
+    },
+    "Resources": {
+        "Role": { "Type": "AWS::IAM::Role", "Properties": { "RoleName": { "Fn::Sub": "${Env}-role" } } },
+        "Bucket": { "Type": "AWS::S3::Bucket", "Properties": { "BucketName": "static" } },
+        "Function": {
+            "Type": "AWS::Lambda::Function",
+            "Properties": {
+                "Role": { "Fn::GetAtt": [ "Role", "Arn" ] },
+                "MemorySize": { "Fn::FindInMap": [ "Sizes", { "Ref": "Size" }, "Memory" ] }
+            }
+        },
+        "Alarm": { "Type": "AWS::CloudWatch::Alarm", "Condition": "IsProd", "Properties": {} }
+    },
+    "Outputs": {
+        "BucketName": { "Value": { "Ref": "Bucket" } },
+        "Memory": { "Value": { "Fn::FindInMap": [ "Sizes", { "Ref": "Size" }, "Memory" ] } }
+    }
+}
+
+def full(parameters):
+    p = TemplateParser(TemplateContext("123456789", "eu-central-1", "MyStack", parameters=parameters), copy.deepcopy(TEMPLATE), get_attribute=get_attribute, use_parameter_defaults=True)
+    p.resolve()
+    return p.data
+
+def make():
+    p = IncrementalParser(TemplateContext("123456789", "eu-central-1", "MyStack"), TEMPLATE, get_attribute, use_parameter_defaults=True)
+    assert p.resolve() == full({})
+    return p
+
+def test_parameter_change():
+    p = make()
+    data, changed = p.update(parameters={ "Env": "prd" })
+    assert data == full({ "Env": "prd" })
+    assert changed == [ "/Resources/Role/Properties/RoleName", "/Resources/Alarm" ]
+    assert ("Resources", "Bucket") not in p.recomputed
+    assert ("Outputs", "Memory") not in p.recomputed
+    assert p.dependencies[("Resources", "Alarm")] == { ("Conditions", "IsProd"), ("Parameters", "Env") }
+
+def test_parameter_change_through_mapping():
+    p = make()
+    data, changed = p.update(parameters={ "Size": "large" })
+    assert data == full({ "Size": "large" })
+    assert changed == [ "/Resources/Function/Properties/MemorySize", "/Outputs/Memory/Value" ]
+    assert sorted(p.recomputed) == [ ("Outputs", "Memory"), ("Resources", "Function") ]
+
+def test_resource_changes():
+    p = make()
+    data, changed = p.update(resources={
+        "Bucket": { "Type": "AWS::S3::Bucket", "Properties": { "BucketName": { "Ref": "Env" } } },
+        "Function": None,
+        "Queue": { "Type": "AWS::SQS::Queue", "Properties": { "RoleName": { "Ref": "Role" } } }
+    })
+    assert changed == [ "/Resources/Bucket/Properties/BucketName", "/Resources/Function", "/Resources/Queue" ]
+    assert sorted(p.recomputed) == [ ("Outputs", "BucketName"), ("Resources", "Bucket"), ("Resources", "Queue") ]
+    assert data["Resources"]["Bucket"]["Properties"] == { "BucketName": "dev" }
+    assert TEMPLATE["Resources"]["Bucket"]["Properties"] == { "BucketName": "static" }
@@ -0,0 +1,87 @@
+import json
+import pytest
+from resolve import TemplateParser, TemplateContext, derived_stack_id
+from getatt_dummy import get_attribute
+from multi import MultiContext, apply_patch, consensus, diff, flatten_contexts, parse_pointer, pointer
+
+TEMPLATE = {
+    "Parameters": { "Env": { "Type": "String" } },
+    "Conditions": { "IsPrd": { "Fn::Equals": [ { "Ref": "Env" }, "prd" ] } },
+    "Resources": {
+        "Bucket": {
+            "Type": "AWS::S3::Bucket",
+            "Properties": {
+                "BucketName": { "Fn::Sub": "${Env}-${AWS::Region}-bucket" },
+                "Tags": [ { "Key": "Team", "Value": "platform" }, { "Key": "Env", "Value": { "Ref": "Env" } } ],
+                "Versioning": { "Fn::If": [ "IsPrd", { "Status": "Enabled" }, { "Ref": "AWS::NoValue" } ] }
+            }
+        },
+        "Alarm": { "Type": "AWS::CloudWatch::Alarm", "Condition": "IsPrd", "Properties": { "Threshold": 1 } },
+        "Queue": { "Type": "AWS::SQS::Queue", "Properties": { "Name": "shared" } }
+    }
+}
+
+def contexts():
+    result = {}
+    for name, account, region in [("dev", "111111111111", "eu-west-1"), ("tst", "111111111111", "eu-west-1"), ("prd", "222222222222", "eu-central-1")]:
+        context = TemplateContext(account, region, "app", parameters={ "Env": name })
+        context.stack_id = derived_stack_id(context)
+        result[name] = context
+    return result
+
+def test_flatten_contexts():
+    template = json.loads(json.dumps(TEMPLATE))
+    multi = flatten_contexts(template, contexts(), get_attribute)
+    assert template == TEMPLATE
+    assert multi.contexts() == ["dev", "tst", "prd"]
+    assert "Alarm" not in multi.base["Resources"]
+    assert multi.base["Resources"]["Queue"] == { "Type": "AWS::SQS::Queue", "Properties": { "Name": "shared" } }
+    assert { "op": "add", "path": "/Resources/Alarm", "value": { "Type": "AWS::CloudWatch::Alarm", "Properties": { "Threshold": 1 } } } in multi.patches["prd"]
+    for name, context in contexts().items():
+        parser = TemplateParser(context, json.loads(json.dumps(TEMPLATE)), get_attribute=get_attribute)
+        parser.resolve()
+        assert multi.materialize(name) == parser.data
+    data = json.loads(json.dumps(multi.to_dict()))
+    assert MultiContext.from_dict(data).materialize("prd") == multi.materialize("prd")
+    with pytest.raises(Exception, match="Context acc not found"):
+        multi.materialize("acc")
+
+def test_materialize_shares_base():
+    base = { "A": { "X": 1 }, "B": { "Y": [1, 2] } }
+    document = apply_patch(base, [{ "op": "replace", "path": "/B/Y/1", "value": 3 }])
+    assert document == { "A": { "X": 1 }, "B": { "Y": [1, 3] } }
+    assert base == { "A": { "X": 1 }, "B": { "Y": [1, 2] } }
+    assert document["A"] is base["A"]
+
+@pytest.mark.parametrize("base,target", [
+    ({ "a": 1, "b": [1, 2] }, { "a": 1, "b": [1, 3], "c": { "d": None } }),
+    ({ "a/b": { "~c": 1 } }, { "a/b": { "~c": 2 } }),
+    ({ "a": [1, 2] }, { "a": [1, 2, 3] }),
+    ({ "a": 1 }, { "a": True }),
+    ({ "a": { "b": 1 } }, {}),
+    ({ "a": 1 }, [1]),
+])
+def test_diff(base, target):
+    patch = diff(base, target)
+    document = apply_patch(base, patch)
+    assert json.dumps(document, sort_keys=True) == json.dumps(target, sort_keys=True)
+
+def test_apply_patch():
+    assert apply_patch([1, 2], [{ "op": "add", "path": "/1", "value": 5 }, { "op": "add", "path": "/-", "value": 6 }]) == [1, 5, 2, 6]
+    assert apply_patch({ "a": 1 }, [{ "op": "remove", "path": "/a" }]) == {}
+    with pytest.raises(Exception, match="not found"):
+        apply_patch({ "a": 1 }, [{ "op": "replace", "path": "/b", "value": 1 }])
+    with pytest.raises(Exception, match="Unsupported"):
+        apply_patch({ "a": 1 }, [{ "op": "move", "from": "/a", "path": "/b" }])
+
+def test_pointer():
+    assert pointer(("a/b", "~c", 0)) == "/a~1b/~0c/0"
+    assert parse_pointer("/a~1b/~0c/0") == ["a/b", "~c", "0"]
+    assert parse_pointer("") == []
+
+def test_consensus():
+    assert consensus([{ "a": 1, "b": 1 }, { "a": 1, "b": 2 }, { "a": 2, "b": 2 }]) == { "a": 1, "b": 2 }
+    assert consensus([{ "a": 1 }, { "a": 1, "c": 1 }, {}]) == { "a": 1 }
+    assert consensus([[1, 2], [1, 3], [4, 3]]) == [1, 3]
+    # lists of different lengths are taken as a whole
+    assert consensus([[1], [1, 2], [1, 2]]) == [1, 2]
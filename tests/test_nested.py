@@ -0,0 +1,110 @@
+import json
+import pytest
+from resolve import TemplateContext
+from getatt_dummy import get_attribute
+from nested import NestedStacks, stack_levels, load_template
+
+CHILD = {
+    "Parameters": { "Name": { "Type": "String" } },
+    "Resources": { "Queue": { "Type": "AWS::SQS::Queue", "Properties": { "QueueName": { "Ref": "Name" } } } },
+    "Outputs": { "QueueName": { "Value": { "Fn::Sub": "${Name}-${AWS::StackName}" } } }
+}
+
+PARENT = {
+    "Resources": {
+        "First": {
+            "Type": "AWS::CloudFormation::Stack",
+            "Properties": { "TemplateURL": "https://bucket.s3.amazonaws.com/child.json", "Parameters": { "Name": "first" } }
+        },
+        "Second": {
+            "Type": "AWS::CloudFormation::Stack",
+            "Properties": { "TemplateURL": "child.json", "Parameters": { "Name": "second" } }
+        },
+        "Third": {
+            "Type": "AWS::CloudFormation::Stack",
+            "Properties": { "TemplateURL": "child.json", "Parameters": { "Name": { "Fn::GetAtt": [ "First", "Outputs.QueueName" ] } } }
+        },
+        "MyTest": {
+            "Type": "AWS::Some::Type",
+            "Properties": {
+                "Queues": [ { "Fn::GetAtt": "Second.Outputs.QueueName" }, { "Fn::GetAtt": [ "Third", "Outputs.QueueName" ] } ]
+            }
+        }
+    }
+}
+
+def context():
+    return TemplateContext("123456789", "eu-central-1", "Parent")
+
+def write(path, data):
+    path.write_text(json.dumps(data))
+    return str(path)
+
+def test_stack_levels():
+    graph = { "First": [], "Second": [], "Other": ["First"], "Third": ["Other"] }
+    assert stack_levels(graph, ["First", "Second", "Third"]) == [["First", "Second"], ["Third"]]
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_nested_stacks(tmp_path, workers):
+    write(tmp_path / "child.json", CHILD)
+    with NestedStacks({ "https://bucket.s3.amazonaws.com/": str(tmp_path) }, get_attribute, workers=workers) as nested:
+        stack = nested.flatten_file(context(), write(tmp_path / "parent.json", PARENT))
+    assert stack.children["First"].outputs == { "QueueName": "first-Parent-First" }
+    assert stack.children["Third"].data["Resources"]["Queue"]["Properties"]["QueueName"] == "first-Parent-First"
+    assert stack.data["Resources"]["MyTest"]["Properties"]["Queues"] == [ "second-Parent-Second", "first-Parent-First-Parent-Third" ]
+    assert stack.data["Resources"]["Third"]["Properties"]["Parameters"]["Name"] == "first-Parent-First"
+    assert load_template(str((tmp_path / "child.json").resolve())) == CHILD
+
+def test_edited_template_is_read_again(tmp_path):
+    path = str((tmp_path / "child.json").resolve())
+    write(tmp_path / "child.json", CHILD)
+    assert load_template(path) is load_template(path)
+    write(tmp_path / "child.json", { **CHILD, "Outputs": {} })
+    assert load_template(path)["Outputs"] == {}
+
+def test_parameters_are_strings(tmp_path):
+    write(tmp_path / "child.json", {
+        "Parameters": {
+            "Names": { "Type": "CommaDelimitedList" },
+            "Ports": { "Type": "List<Number>" },
+            "Count": { "Type": "Number" },
+            "Enabled": { "Type": "String" }
+        },
+        "Resources": {
+            "Queue": {
+                "Type": "AWS::SQS::Queue",
+                "Properties": {
+                    "First": { "Fn::Select": [ 0, { "Ref": "Names" } ] },
+                    "Ports": { "Ref": "Ports" },
+                    "Count": { "Ref": "Count" },
+                    "Enabled": { "Ref": "Enabled" }
+                }
+            }
+        }
+    })
+    parent = {
+        "Parameters": { "Names": { "Type": "CommaDelimitedList", "Default": "a,b" } },
+        "Resources": {
+            "Child": {
+                "Type": "AWS::CloudFormation::Stack",
+                "Properties": {
+                    "TemplateURL": "child.json",
+                    "Parameters": { "Names": { "Ref": "Names" }, "Ports": [ 80, 443 ], "Count": 3, "Enabled": True }
+                }
+            }
+        }
+    }
+    nested = NestedStacks(get_attribute=get_attribute, use_parameter_defaults=True, workers=1)
+    stack = nested.flatten_file(context(), write(tmp_path / "parent.json", parent))
+    child = stack.children["Child"]
+    assert child.data["Resources"]["Queue"]["Properties"] == { "First": "a", "Ports": [ "80", "443" ], "Count": "3", "Enabled": "true" }
+
+def test_nested_stack_cycle(tmp_path):
+    path = write(tmp_path / "loop.json", { "Resources": { "Loop": { "Type": "AWS::CloudFormation::Stack", "Properties": { "TemplateURL": "loop.json" } } } })
+    with pytest.raises(Exception, match="Nested stacks include themselves"):
+        NestedStacks(get_attribute=get_attribute, workers=1).flatten_file(context(), path)
+
+def test_unmapped_template_url():
+    template = { "Resources": { "S": { "Type": "AWS::CloudFormation::Stack", "Properties": { "TemplateURL": "https://elsewhere/child.json" } } } }
+    with pytest.raises(Exception, match="No local path for TemplateURL"):
+        NestedStacks(get_attribute=get_attribute, workers=1).flatten(context(), template)
@@ -0,0 +1,67 @@
+import json
+import os
+import sys
+from resolve import TemplateParser, TemplateContext, derived_stack_id
+import getatt
+import getatt_dummy
+from parallel import components, pack, resolve_parallel
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+from generator import generate_template
+
+def context():
+    context = TemplateContext("123456789", "eu-central-1", "MyStack")
+    context.stack_id = derived_stack_id(context)
+    return context
+
+def serial(template, get_attribute):
+    p = TemplateParser(context(), template, get_attribute=get_attribute, use_parameter_defaults=True, in_place=False)
+    p.resolve()
+    return p.data
+
+def test_components_and_pack():
+    names = ["a", "b", "c", "d", "e"]
+    graph = { "a": [], "b": ["a"], "c": [], "d": ["e"], "e": [] }
+    assert components(graph, names) == [["a", "b"], ["c"], ["d", "e"]]
+    assert pack(components(graph, names), 2, names) == [["a", "b", "c"], ["d", "e"]]
+
+def test_same_as_serial():
+    template = generate_template(60, seed=1, cluster=4)
+    original = json.dumps(template)
+    assert json.dumps(resolve_parallel(context(), template, getatt_dummy.get_attribute, True, workers=3)) == json.dumps(serial(template, getatt_dummy.get_attribute))
+    assert json.dumps(template) == original
+
+def test_same_as_serial_with_metadata():
+    # getatt adds generated names to the metadata of the resources it reads
+    template = {
+        "Resources": {
+            "Table": { "Type": "AWS::EC2::RouteTable", "Properties": {} },
+            "Route": { "Type": "AWS::EC2::Route", "Properties": { "RouteTableId": { "Ref": "Table" } } },
+            "Role": { "Type": "AWS::IAM::Role", "DependsOn": "Table", "Properties": { "RoleName": { "Fn::Sub": "${AWS::StackName}-role" } } },
+            "Other": { "Type": "AWS::EC2::RouteTable", "Properties": {} },
+            "Uses": { "Type": "T", "Properties": { "Role": { "Ref": "Role" } } }
+        },
+        "Outputs": { "Other": { "Value": { "Ref": "Other" } } }
+    }
+    assert json.dumps(resolve_parallel(context(), template, getatt.get_attribute, workers=2)) == json.dumps(serial(template, getatt.get_attribute))
+
+def test_same_as_serial_with_for_each():
+    template = {
+        "Transform": "AWS::LanguageExtensions",
+        "Conditions": {
+            "Fn::ForEach::Conditions": [ "Name", [ "A", "B", "C" ], { "Is${Name}": { "Fn::Equals": [ { "Ref": "Name" }, "B" ] } } ]
+        },
+        "Resources": {
+            "Table": { "Type": "AWS::EC2::RouteTable", "Properties": {} },
+            "Fn::ForEach::Routes": [ "Name", [ "A", "B", "C" ], {
+                "Route${Name}": { "Type": "AWS::EC2::Route", "Properties": { "RouteTableId": { "Ref": "Table" } } },
+                "Topic${Name}": {
+                    "Type": "AWS::SNS::Topic",
+                    "Properties": { "TopicName": { "Fn::Sub": "${AWS::StackName}-${Name}" }, "Fifo": { "Fn::If": [ "IsB", True, False ] } }
+                }
+            } ]
+        }
+    }
+    original = json.dumps(template)
+    assert json.dumps(resolve_parallel(context(), template, getatt_dummy.get_attribute, True, workers=3)) == json.dumps(serial(template, getatt_dummy.get_attribute))
+    assert json.dumps(template) == original
@@ -0,0 +1,81 @@
+import copy
+import pickle
+import pytest
+from resolve import TemplateParser, TemplateContext
+from getatt_dummy import get_attribute
+from plan import compile
+
+def make_context(input_expected):
+    return TemplateContext(
+        "123456789",
+        "eu-central-1",
+        "MyStack",
+        parameters=input_expected.get("parameters", {}),
+        ssm_parameters=input_expected.get("ssm_parameters", {}),
+        exports=input_expected.get("exports", {}),
+    )
+
+def test_generic_plan(input_expected):
+    original = copy.deepcopy(input_expected["input"])
+    plan = compile(input_expected["input"])
+    use_parameter_defaults = input_expected.get("use_parameter_defaults", True)
+    if "error" in input_expected["expected"]:
+        with pytest.raises(Exception, match=input_expected["expected"]["error"]):
+            plan.evaluate(make_context(input_expected), get_attribute, use_parameter_defaults)
+    elif "data" in input_expected["expected"]:
+        assert plan.evaluate(make_context(input_expected), get_attribute, use_parameter_defaults) == input_expected["expected"]["data"]
+    assert input_expected["input"] == original
+
+TEMPLATE = {
+    "Parameters": { "Env": { "Type": "String" } },
+    "Resources": {
+        "Role": {
+            "Type": "AWS::IAM::Role",
+            "Properties": {
+                "RoleName": { "Fn::Sub": "${Env}-${AWS::Region}" },
+                "Policies": [ { "PolicyName": "static", "PolicyDocument": { "Statement": [ { "Effect": "Allow", "Action": "*" } ] } } ]
+            }
+        },
+        "Function": { "Type": "AWS::Lambda::Function", "Properties": { "Role": { "Fn::GetAtt": "Role.Arn" }, "Runtime": "python3.11" } }
+    },
+    "Outputs": { "Role": { "Value": { "Ref": "Role" } } }
+}
+
+def test_plan_is_reusable_and_picklable():
+    plan = pickle.loads(pickle.dumps(compile(TEMPLATE)))
+    assert plan.index == {
+        "Resources": { "Role": { "Properties": { "RoleName": None } }, "Function": { "Properties": { "Role": None } } },
+        "Outputs": { "Role": { "Value": None } }
+    }
+    assert plan.dependencies == { "Role": [], "Function": [ "Role" ] }
+    assert plan.subs == { "${Env}-${AWS::Region}": ((1, "Env", None), (0, "-", None), (1, "AWS::Region", None)) }
+    for env, region in [ ("dev", "eu-west-1"), ("prd", "eu-central-1") ]:
+        context = TemplateContext("123456789", region, "MyStack", parameters={ "Env": env })
+        parser = TemplateParser(context, copy.deepcopy(TEMPLATE), get_attribute=get_attribute)
+        parser.resolve()
+        data = plan.evaluate(context, get_attribute)
+        assert data == parser.data
+        assert data["Resources"]["Role"]["Properties"]["Policies"] is plan.template["Resources"]["Role"]["Properties"]["Policies"]
+
+def test_index_skips_constant_subtrees():
+    from plan import dynamic_index
+    from stats import Stats
+    template = {
+        "Conditions": { "Never": { "Fn::Equals": [ "a", "b" ] } },
+        "Resources": {
+            "Skipped": { "Type": "T", "Condition": "Never", "Properties": { "A": { "Ref": "AWS::Region" } } },
+            "MyTest": {
+                "Type": "T",
+                "Properties": {
+                    "Policy": { "Statement": [ { "Effect": "Allow", "Action": [ "s3:*" ], "Resource": [ "*" ] } for _ in range(20) ] },
+                    "List": [ "a", { "Ref": "AWS::Region" }, { "Ref": "AWS::NoValue" }, { "b": "c" } ]
+                }
+            }
+        }
+    }
+    index, constant = dynamic_index(template)
+    assert index == { "Resources": { "Skipped": { "Properties": { "A": None } }, "MyTest": { "Properties": { "List": { 1: None, 2: None } } } } }
+    stats = Stats()
+    data = compile(template).evaluate(TemplateContext("123456789", "eu-central-1", "MyStack"), get_attribute, stats=stats)
+    assert data["Resources"] == { "MyTest": { "Type": "T", "Properties": { "Policy": template["Resources"]["MyTest"]["Properties"]["Policy"], "List": [ "a", "eu-central-1", { "b": "c" } ] } } }
+    assert stats.nodes < 15
@@ -0,0 +1,64 @@
+import asyncio
+import json
+from resolve import TemplateParser, TemplateContext
+from getatt_dummy import get_attribute
+from providers import DictProvider, FileProvider, Prefetcher, find_lookups, prefetch, LATEST
+
+SSM_PARAMETERS = {
+    "/app/image": { "1": "ami-1", "2": "ami-2" },
+    "/app/name": { "1": "name-1" },
+    "/unused": { "1": "unused" },
+}
+EXPORTS = { "vpc": "vpc-123", "dev-subnet": "subnet-123", "unused": "x" }
+
+TEMPLATE = {
+    "Parameters": {
+        "Image": { "Type": "AWS::SSM::Parameter::Value<String>", "Default": "/app/image" },
+        "Env": { "Type": "String" }
+    },
+    "Resources": {
+        "MyTest": {
+            "Type": "AWS::Some::Type",
+            "Properties": {
+                "Image": { "Ref": "Image" },
+                "Name": "{{resolve:ssm:/app/name:1}}",
+                "Vpc": { "Fn::ImportValue": "vpc" },
+                "Subnet": { "Fn::ImportValue": { "Fn::Sub": "${Env}-subnet" } }
+            }
+        }
+    }
+}
+
+def context():
+    return TemplateContext("123456789", "eu-central-1", "MyStack", parameters={ "Env": "dev" })
+
+def test_find_lookups():
+    lookups, dynamic = find_lookups(TEMPLATE, context(), use_parameter_defaults=True)
+    assert lookups.ssm_parameters == {("/app/image", LATEST), ("/app/name", "1")}
+    assert lookups.exports == {"vpc"}
+    assert dynamic == [{ "Fn::Sub": "${Env}-subnet" }]
+
+def test_prefetch():
+    provider = DictProvider(SSM_PARAMETERS, EXPORTS)
+    ctx = prefetch(provider, TEMPLATE, context(), use_parameter_defaults=True)
+    assert ctx.ssm_parameters == { "/app/image": { "2": "ami-2" }, "/app/name": { "1": "name-1" } }
+    assert ctx.exports == { "vpc": "vpc-123", "dev-subnet": "subnet-123" }
+    p = TemplateParser(ctx, TEMPLATE, get_attribute=get_attribute, use_parameter_defaults=True, in_place=False)
+    p.resolve()
+    assert p.data["Resources"]["MyTest"]["Properties"] == { "Image": "ami-2", "Name": "name-1", "Vpc": "vpc-123", "Subnet": "subnet-123" }
+
+def test_prefetch_batches_and_caches():
+    provider = DictProvider(SSM_PARAMETERS, EXPORTS)
+    prefetcher = Prefetcher(provider, batch_size=1)
+    template = { "Resources": { "R": { "Type": "T", "Properties": { "A": { "Fn::ImportValue": "vpc" }, "B": { "Fn::ImportValue": "missing" } } } } }
+    contexts = asyncio.run(prefetcher.prepare([(template, context()), (template, context())]))
+    assert contexts[0].exports == contexts[1].exports == { "vpc": "vpc-123" }
+    assert sorted(provider.calls) == [("exports", ["missing"]), ("exports", ["vpc"])]
+    asyncio.run(prefetcher.prepare([(template, context())]))
+    assert len(provider.calls) == 2
+
+def test_context_values_take_precedence(tmp_path):
+    (tmp_path / "lookups.json").write_text(json.dumps({ "exports": EXPORTS }))
+    template = { "Resources": { "R": { "Type": "T", "Properties": { "A": { "Fn::ImportValue": "vpc" } } } } }
+    ctx = TemplateContext("123456789", "eu-central-1", "MyStack", exports={ "vpc": "mine" })
+    assert prefetch(FileProvider(str(tmp_path / "lookups.json")), template, ctx).exports == { "vpc": "mine" }
@@ -1,5 +1,8 @@
+from pathlib import Path
+import subprocess
+import sys
 import pytest
-from resolve import TemplateParser, TemplateContext
+from resolve import TemplateParser, TemplateContext, Intrinsic, intrinsics, register_intrinsic, is_intrinsic, cidr, uses_identifier, replace_identifier
 from getatt_dummy import get_attribute
 
 '''
@@ -46,3 +49,291 @@ def test_generic(input_expected):
         assert p.parameters == input_expected["expected"]["parameters"]
     if "conditions" in input_expected["expected"]:
         assert p.conditions == input_expected["expected"]["conditions"]
+
+def make_parser(template, **kwargs):
+    context = TemplateContext("123456789", "eu-central-1", "MyStack", **kwargs)
+    return TemplateParser(context, template, get_attribute=get_attribute, use_parameter_defaults=True)
+
+def test_register_intrinsic(monkeypatch):
+    monkeypatch.setitem(intrinsics, "Fn::Upper", Intrinsic(lambda parser, value, contents: parser.evaluate(value).upper()))
+    monkeypatch.setitem(intrinsics, "Macro::Region", Intrinsic(lambda parser, value, contents: parser.refs["AWS::Region"]))
+    p = make_parser({
+        "Resources": {
+            "MyTest": {
+                "Type": "AWS::Some::Type",
+                "Properties": {
+                    "Upper": { "Fn::Upper": { "Fn::Sub": "${AWS::StackName}" } },
+                    "Region": { "Macro::Region": None }
+                }
+            }
+        }
+    })
+    p.resolve()
+    assert p.data["Resources"]["MyTest"]["Properties"] == { "Upper": "MYSTACK", "Region": "eu-central-1" }
+
+def test_register_intrinsic_decorator():
+    try:
+        @register_intrinsic("Fn::Twice")
+        def fn_twice(parser, value, contents):
+            return [value, value]
+        assert intrinsics["Fn::Twice"].handler is fn_twice
+        assert is_intrinsic({ "Fn::Twice": "x" })
+    finally:
+        intrinsics.pop("Fn::Twice", None)
+
+def test_deeply_nested_intrinsics():
+    depth = 5000
+    value = "leaf"
+    for _ in range(depth):
+        value = { "Fn::If": [ "MyCondition", { "Fn::Join": [ "", [ value ] ] }, "other" ] }
+    p = make_parser({
+        "Conditions": { "MyCondition": True },
+        "Resources": { "MyTest": { "Type": "AWS::Some::Type", "Properties": { "MyProp": [[[value]]] } } }
+    })
+    p.resolve()
+    assert p.data["Resources"]["MyTest"]["Properties"]["MyProp"] == [[["leaf"]]]
+
+def test_attributes_are_cached():
+    calls = []
+    def counting_get_attribute(logical_id, attribute_name, ctx):
+        calls.append((logical_id, attribute_name))
+        return get_attribute(logical_id, attribute_name, ctx)
+    p = TemplateParser(TemplateContext("123456789", "eu-central-1", "MyStack"), {
+        "Resources": {
+            "MyRole": { "Type": "AWS::IAM::Role", "Properties": {} },
+            "MyTest": {
+                "Type": "AWS::Some::Type",
+                "Properties": {
+                    "Refs": [ { "Ref": "MyRole" }, { "Ref": "MyRole" }, { "Fn::Sub": "${MyRole}/${MyRole.Arn}" } ],
+                    "Arn": { "Fn::GetAtt": [ "MyRole", "Arn" ] }
+                }
+            }
+        }
+    }, get_attribute=counting_get_attribute)
+    p.resolve()
+    assert calls == [("MyRole", "Ref"), ("MyRole", "Arn")]
+    p.invalidate_attributes("MyRole")
+    assert p.get_att("MyRole", "Arn") == "<!--MyRole.Arn-->"
+    assert calls[-1] == ("MyRole", "Arn")
+
+def test_lazy_conditions():
+    p = TemplateParser(TemplateContext("123456789", "eu-central-1", "MyStack"), {
+        "Conditions": {
+            "Broken": { "Fn::Equals": "not a list" },
+            "Used": { "Fn::Not": [ { "Condition": "UsedByCondition" } ] },
+            "UsedByCondition": False,
+            "Unused": True
+        },
+        "Resources": {
+            "MyResource": { "Type": "SomeType", "Condition": "Used", "Properties": {} }
+        }
+    }, get_attribute=get_attribute, lazy_conditions=True)
+    p.resolve()
+    assert p.conditions == { "Used": True, "UsedByCondition": False }
+    assert p.data == { "Resources": { "MyResource": { "Type": "SomeType", "Properties": {} } } }
+
+SELECTIVE = {
+    "Parameters": { "Env": { "Type": "String", "Default": "dev" } },
+    "Resources": {
+        "Topic": { "Type": "AWS::SNS::Topic", "Properties": { "TopicName": { "Ref": "DoesNotExist" } } },
+        "Role": { "Type": "AWS::IAM::Role", "Properties": { "RoleName": { "Fn::Sub": "${Env}-role" } } },
+        "Bucket": { "Type": "AWS::S3::Bucket", "Properties": { "BucketName": { "Ref": "Env" } } },
+        "Function": {
+            "Type": "AWS::Lambda::Function",
+            "DependsOn": "Bucket",
+            "Properties": { "Role": { "Fn::GetAtt": [ "Role", "Arn" ] } }
+        }
+    },
+    "Outputs": { "Topic": { "Value": { "Ref": "Topic" } } }
+}
+
+def test_resolve_only():
+    import copy
+    p = make_parser(copy.deepcopy(SELECTIVE))
+    p.resolve(only=["AWS::Lambda::*"])
+    assert p.data == {
+        "Resources": {
+            "Role": { "Type": "AWS::IAM::Role", "Properties": { "RoleName": "dev-role" } },
+            "Bucket": { "Type": "AWS::S3::Bucket", "Properties": { "BucketName": "dev" } },
+            "Function": { "Type": "AWS::Lambda::Function", "Properties": { "Role": "<!--Role.Arn-->" } }
+        }
+    }
+    p = make_parser(copy.deepcopy(SELECTIVE))
+    p.resolve(only=["Bucket"])
+    assert list(p.data["Resources"]) == ["Bucket"]
+
+def test_resolve_only_circular():
+    p = make_parser({
+        "Resources": {
+            "A": { "Type": "T", "Properties": { "P": { "Ref": "B" } } },
+            "B": { "Type": "T", "Properties": { "P": { "Fn::GetAtt": "A.Arn" } } }
+        }
+    })
+    with pytest.raises(Exception, match="Circular dependency between resources A -> B -> A"):
+        p.resolve(only=["A"])
+
+def test_generic_not_in_place(input_expected):
+    import copy
+    original = copy.deepcopy(input_expected["input"])
+    context = TemplateContext(
+        "123456789",
+        "eu-central-1",
+        "MyStack",
+        parameters=input_expected.get("parameters", {}),
+        ssm_parameters=input_expected.get("ssm_parameters", {}),
+        exports=input_expected.get("exports", {}),
+    )
+    p = TemplateParser(
+        context,
+        input_expected["input"],
+        use_parameter_defaults=input_expected.get("use_parameter_defaults", True),
+        get_attribute=get_attribute,
+        in_place=False
+    )
+    if "error" in input_expected["expected"]:
+        with pytest.raises(Exception, match=input_expected["expected"]["error"]):
+            p.resolve()
+    else:
+        p.resolve()
+        if "data" in input_expected["expected"]:
+            assert p.data == input_expected["expected"]["data"]
+        if "conditions" in input_expected["expected"]:
+            assert p.conditions == input_expected["expected"]["conditions"]
+    assert input_expected["input"] == original
+
+def test_not_in_place_shares_literal_subtrees():
+    policy = { "Statement": [ { "Effect": "Allow", "Action": [ "s3:GetObject" ], "Resource": "*" } ] }
+    tags = [ { "Key": "Env", "Value": { "Ref": "AWS::Region" } }, { "Key": "Team", "Value": "core" } ]
+    template = {
+        "Resources": {
+            "MyRole": {
+                "Type": "AWS::IAM::Role",
+                "Properties": { "Policy": policy, "Tags": tags }
+            }
+        }
+    }
+    p = TemplateParser(TemplateContext("123456789", "eu-central-1", "MyStack"), template, get_attribute=get_attribute, in_place=False)
+    p.resolve()
+    properties = p.data["Resources"]["MyRole"]["Properties"]
+    assert properties["Policy"] is policy
+    assert properties["Tags"] is not tags and properties["Tags"][1] is tags[1]
+    assert properties["Tags"][0] == { "Key": "Env", "Value": "eu-central-1" }
+    assert tags[0]["Value"] == { "Ref": "AWS::Region" }
+    assert "Resources" in template and template["Resources"]["MyRole"]["Properties"]["Tags"] is tags
+
+def test_cidr():
+    p = make_parser({
+        "Resources": {
+            "MyTest": {
+                "Type": "AWS::Some::Type",
+                "Properties": {
+                    "V4": { "Fn::Cidr": [ "10.0.0.5/16", 3, "8" ] },
+                    "V6": { "Fn::Cidr": [ "2001:db8::/56", "2", 64 ] },
+                    "Last": { "Fn::Select": [ 255, { "Fn::Cidr": [ "10.0.0.0/16", 256, 8 ] } ] }
+                }
+            }
+        }
+    })
+    p.resolve()
+    assert p.data["Resources"]["MyTest"]["Properties"] == {
+        "V4": [ "10.0.0.0/24", "10.0.1.0/24", "10.0.2.0/24" ],
+        "V6": [ "2001:db8::/64", "2001:db8:0:1::/64" ],
+        "Last": "10.0.255.0/24"
+    }
+    # no more subnets than fit in the block
+    assert cidr("192.168.0.0/24", 10, 6) == ("192.168.0.0/26", "192.168.0.64/26", "192.168.0.128/26", "192.168.0.192/26")
+    assert cidr("10.0.0.0/16", 3, 8) is cidr("10.0.0.0/16", 3, 8)
+    with pytest.raises(Exception, match="can not split"):
+        cidr("10.0.0.0/24", 1, 9)
+
+@pytest.mark.parametrize("in_place", [True, False])
+def test_novalue_is_removed_before_intrinsics_see_the_list(in_place):
+    template = {
+        "Conditions": { "Yes": { "Fn::Equals": [ "a", "a" ] } },
+        "Resources": {
+            "MyTest": {
+                "Type": "AWS::Some::Type",
+                "Properties": {
+                    "Join": { "Fn::Join": [ ",", [ "a", { "Ref": "AWS::NoValue" } ] ] },
+                    "Select": { "Fn::Select": [ 1, [ "a", { "Ref": "AWS::NoValue" }, "b" ] ] },
+                    "Length": { "Fn::Length": [ "a", { "Ref": "AWS::NoValue" } ] },
+                    "If": { "Fn::Join": [ "-", [ "a", { "Fn::If": [ "Yes", { "Ref": "AWS::NoValue" }, "x" ] }, "b" ] ] },
+                    "Nested": [ "a", { "Ref": "AWS::NoValue" }, [ { "Ref": "AWS::NoValue" }, "b" ] ],
+                    "Later": [ { "Ref": "AWS::NoValue" }, { "Fn::Join": [ "-", [ "a", { "Ref": "AWS::NoValue" }, "b" ] ] }, "c" ]
+                }
+            }
+        }
+    }
+    p = TemplateParser(TemplateContext("123456789", "eu-central-1", "MyStack"), template, get_attribute=get_attribute, in_place=in_place)
+    p.resolve()
+    assert p.data["Resources"]["MyTest"]["Properties"] == { "Join": "a", "Select": "b", "Length": 1, "If": "a-b", "Nested": [ "a", [ "b" ] ], "Later": [ "a-b", "c" ] }
+
+def test_replace_identifier_shares_unchanged_parts():
+    template = {
+        "Bucket${Name}": {
+            "Type": "AWS::S3::Bucket",
+            "Properties": { "BucketName": { "Ref": "Name" }, "Tags": [ { "Key": "Static", "Value": "x" } ] },
+            "Metadata": { "Static": [ "x" ] }
+        }
+    }
+    found = set()
+    uses_identifier(template, "Name", found)
+    instance = replace_identifier(template, "Name", "a", found)
+    assert instance == {
+        "Bucketa": {
+            "Type": "AWS::S3::Bucket",
+            "Properties": { "BucketName": "a", "Tags": [ { "Key": "Static", "Value": "x" } ] },
+            "Metadata": { "Static": [ "x" ] }
+        }
+    }
+    bucket = template["Bucket${Name}"]
+    assert instance["Bucketa"]["Properties"] is not bucket["Properties"]
+    assert instance["Bucketa"]["Properties"]["Tags"] is bucket["Properties"]["Tags"]
+    assert instance["Bucketa"]["Metadata"] is bucket["Metadata"]
+    # escaped and shadowed placeholders are left alone
+    value = { "A": { "Fn::Sub": "${Name}-${!Name}" }, "B": { "Fn::Sub": [ "${Name}", { "Name": { "Ref": "Name" } } ] } }
+    found = set()
+    uses_identifier(value, "Name", found)
+    assert replace_identifier(value, "Name", "a", found) == { "A": { "Fn::Sub": "a-${!Name}" }, "B": { "Fn::Sub": [ "${Name}", { "Name": "a" } ] } }
+
+@pytest.mark.parametrize("in_place", [True, False])
+def test_for_each_resources_are_separate(in_place):
+    # attribute getters add metadata to the resources they look at
+    def get_attribute(logical_id, attribute_name, ctx):
+        metadata = ctx.resources[logical_id]["json"].setdefault("Metadata", {})
+        metadata["Seen"] = logical_id
+        return logical_id
+    template = {
+        "Transform": "AWS::LanguageExtensions",
+        "Resources": {
+            "Fn::ForEach::Topics": [ "Name", [ "A", "B" ], {
+                "Topic${Name}": { "Type": "AWS::SNS::Topic", "Metadata": { "Owner": "team" } }
+            } ],
+            "Dashboard": {
+                "Type": "AWS::CloudWatch::Dashboard",
+                "Properties": { "Topics": [ { "Fn::GetAtt": [ "TopicA", "TopicName" ] }, { "Fn::GetAtt": [ "TopicB", "TopicName" ] } ] }
+            }
+        }
+    }
+    p = TemplateParser(TemplateContext("123456789", "eu-central-1", "MyStack"), template, get_attribute=get_attribute, in_place=in_place)
+    p.resolve()
+    assert "Transform" not in p.data
+    assert p.data["Resources"]["TopicA"]["Metadata"] == { "Owner": "team", "Seen": "TopicA" }
+    assert p.data["Resources"]["TopicB"]["Metadata"] == { "Owner": "team", "Seen": "TopicB" }
+    assert p.data["Resources"]["Dashboard"]["Properties"]["Topics"] == [ "TopicA", "TopicB" ]
+
+def test_for_each_errors():
+    p = make_parser({ "Transform": "AWS::LanguageExtensions", "Resources": { "Fn::ForEach::X": [ "Name", "A", {} ] } })
+    with pytest.raises(Exception, match="is not a list"):
+        p.resolve()
+    p = make_parser({ "Transform": "AWS::LanguageExtensions", "Resources": { "Fn::ForEach::X": [ "Name", [ "A" ] ] } })
+    with pytest.raises(Exception, match="expects"):
+        p.resolve()
+    # without the transform a loop is not expanded
+    p = make_parser({ "Resources": { "Fn::ForEach::X": [ "Name", [ "A" ], { "Topic${Name}": { "Type": "AWS::SNS::Topic" } } ] } })
+    with pytest.raises(Exception):
+        p.resolve()
+
+def test_import_is_light():
+    code = "import sys, resolve; assert not { 'netaddr', 'ipaddress', 'uuid', 'base64' } & set(sys.modules), set(sys.modules)"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=Path(__file__).parent.parent)
@@ -0,0 +1,146 @@
+import http.client
+import json
+import socket
+import threading
+import time
+import pytest
+from providers import DictProvider
+from serve import Flattener, LRU, make_server, percentiles
+
+TEMPLATE = {
+    "Parameters": { "Env": { "Type": "String", "Default": "dev" } },
+    "Resources": {
+        "Bucket": { "Type": "AWS::S3::Bucket", "Properties": { "BucketName": { "Fn::Sub": "${AWS::StackName}-${Env}" } } },
+        "Queue": { "Type": "AWS::SQS::Queue", "Properties": { "Name": { "Fn::ImportValue": "vpc-id" } } }
+    },
+    "Outputs": { "Arn": { "Value": { "Fn::GetAtt": [ "Bucket", "Arn" ] } } }
+}
+CONTEXT = { "account": "123456789012", "region": "eu-west-1", "stack_name": "app" }
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+def call(connection, method, path, body=None):
+    connection.request(method, path, body=json.dumps(body) if body is not None else None, headers={ "Content-Type": "application/json" })
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+@pytest.fixture
+def server():
+    server = make_server(Flattener(lookups=DictProvider(exports={ "vpc-id": "vpc-1234" })), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_flatten_warm(server):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    status, first = call(connection, "POST", "/flatten", { "template": TEMPLATE, "context": CONTEXT })
+    assert status == 200
+    assert first["Resources"]["Bucket"]["Properties"]["BucketName"] == "app-dev"
+    assert first["Resources"]["Queue"]["Properties"]["Name"] == "vpc-1234"
+    status, other = call(connection, "POST", "/flatten", { "template": TEMPLATE, "context": { **CONTEXT, "stack_name": "other" } })
+    assert other["Resources"]["Bucket"]["Properties"]["BucketName"] == "other-dev"
+    status, again = call(connection, "POST", "/flatten", { "template": TEMPLATE, "context": CONTEXT })
+    assert again == first
+    status, stats = call(connection, "GET", "/stats")
+    assert status == 200
+    assert stats["requests"] == 3
+    assert stats["plans"] == { "size": 1, "hits": 2, "misses": 1, "hit_rate": 2 / 3 }
+    assert stats["results"]["hits"] == 1
+    assert stats["lookups"]["exports"] == 1
+    assert server.flattener.prefetcher.provider.calls == [("exports", ["vpc-id"])]
+    assert set(stats["latency_ms"]) == { "p50", "p90", "p99", "max" }
+
+def test_template_path(server, tmp_path):
+    path = tmp_path / "template.json"
+    path.write_text(json.dumps(TEMPLATE))
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    status, data = call(connection, "POST", "/flatten", { "template_path": str(path), "context": CONTEXT, "use_parameter_defaults": True })
+    assert status == 200
+    assert data["Outputs"]["Arn"]["Value"] == "<!--Bucket.Arn-->"
+
+def test_errors(server):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    assert call(connection, "POST", "/flatten", { "context": CONTEXT })[0] == 400
+    status, body = call(connection, "POST", "/flatten", { "template": { "Resources": { "A": { "Type": "T", "Properties": { "X": { "Ref": "Missing" } } } } }, "context": CONTEXT })
+    assert status == 422
+    assert "Missing" in body["error"]
+    assert call(connection, "GET", "/unknown")[0] == 404
+    assert call(connection, "GET", "/stats")[1]["errors"] == 1
+
+def test_get_attribute_allowlist():
+    server = make_server(Flattener(["getatt_dummy", "getatt"]), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+        template = { "Resources": { "B": { "Type": "AWS::S3::Bucket" } }, "Outputs": { "Arn": { "Value": { "Fn::GetAtt": [ "B", "Arn" ] } } } }
+        status, data = call(connection, "POST", "/flatten", { "template": template, "context": CONTEXT, "get_attribute": "getatt" })
+        assert status == 200
+        assert data["Outputs"]["Arn"]["Value"] == "arn:aws:s3:::b"
+        status, body = call(connection, "POST", "/flatten", { "template": template, "context": CONTEXT, "get_attribute": "shutil:rmtree" })
+        assert status == 400
+        assert "not allowed" in body["error"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_unix_socket(tmp_path):
+    path = str(tmp_path / "flatten.sock")
+    server = make_server(Flattener(), socket=path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        status, data = call(UnixConnection(path), "POST", "/flatten", { "template": TEMPLATE, "context": { **CONTEXT, "exports": { "vpc-id": "vpc-1" } } })
+        assert status == 200
+        assert data["Resources"]["Queue"]["Properties"]["Name"] == "vpc-1"
+        assert call(UnixConnection(path), "GET", "/health") == (200, "ok")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_concurrent_requests_share_attributes():
+    class SlowProvider:
+        def get_attributes(self, context, targets):
+            time.sleep(0.2)
+            return { (logical_id, attribute): f"v-{logical_id}-{attribute}" for logical_id, _, attribute in targets }
+    template = {
+        "Resources": { "B": { "Type": "AWS::S3::Bucket" }, "User": { "Type": "T", "Properties": { "Bucket": { "Ref": "B" } } } }
+    }
+    flattener = Flattener(attribute_provider=SlowProvider())
+    results = [None, None]
+    def flatten(i):
+        try:
+            results[i] = flattener.flatten({ "template": template, "context": CONTEXT })["Resources"]["User"]["Properties"]["Bucket"]
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=flatten, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+    assert results == [ "v-B-Ref", "v-B-Ref" ]
+
+def test_lru():
+    cache = LRU(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert list(cache.items) == ["a", "c"]
+    assert cache.stats() == { "size": 2, "hits": 1, "misses": 1, "hit_rate": 0.5 }
+
+def test_percentiles():
+    assert percentiles([]) == {}
+    assert percentiles(list(range(1, 101))) == { "p50": 50, "p90": 90, "p99": 99, "max": 100 }
+    assert percentiles([5]) == { "p50": 5, "p90": 5, "p99": 5, "max": 5 }
@@ -0,0 +1,42 @@
+from resolve import TemplateParser, TemplateContext
+from getatt_dummy import get_attribute
+from stats import Stats
+
+TEMPLATE = {
+    "Parameters": { "Env": { "Type": "String", "Default": "dev" } },
+    "Conditions": { "IsDev": { "Fn::Equals": [ { "Ref": "Env" }, "dev" ] } },
+    "Resources": {
+        "MyRole": { "Type": "AWS::IAM::Role", "Properties": { "RoleName": { "Fn::Sub": "${Env}-role" } } },
+        "MyTest": {
+            "Type": "AWS::Some::Type",
+            "Properties": {
+                "Arn": { "Fn::GetAtt": [ "MyRole", "Arn" ] },
+                "Name": { "Fn::If": [ "IsDev", { "Fn::Join": [ "-", [ "a", "b" ] ] }, "c" ] }
+            }
+        }
+    }
+}
+
+def flatten(stats=None) -> dict:
+    p = TemplateParser(TemplateContext("123456789", "eu-central-1", "MyStack"), TEMPLATE, get_attribute=get_attribute, use_parameter_defaults=True, in_place=False, stats=stats)
+    p.resolve()
+    return p.data
+
+def test_stats():
+    stats = Stats()
+    assert flatten(stats) == flatten()
+    assert stats.intrinsics["Fn::Sub"].calls == 1
+    assert stats.intrinsics["Fn::Join"].calls == 1
+    assert stats.intrinsics["Fn::Equals"].calls == 1
+    assert stats.get_attribute["AWS::IAM::Role"].calls == 1
+    assert set(stats.resources) == {"MyRole", "MyTest"}
+    assert stats.nodes > 0
+    assert [k for k, _ in stats.top_resources(1)] == [max(stats.resources, key=lambda k: stats.resources[k].seconds)]
+    result = stats.to_dict()
+    assert result["intrinsics"]["Fn::Sub"]["calls"] == 1
+    assert len(result["top_resources"]) == 2
+
+def test_parser_without_stats_is_not_instrumented():
+    p = TemplateParser(TemplateContext("123456789", "eu-central-1", "MyStack"), TEMPLATE, get_attribute=get_attribute, in_place=False)
+    assert "walk" not in vars(p)
+    assert p.get_attribute is get_attribute
@@ -0,0 +1,114 @@
+import io
+import json
+import pytest
+import stream
+from resolve import TemplateParser, TemplateContext, derived_stack_id
+from getatt import get_attribute
+from stream import Reader, flatten_stream, index_template
+
+TEMPLATE = {
+    "AWSTemplateFormatVersion": "2010-09-09",
+    "Parameters": { "Env": { "Type": "String", "Default": "dev" } },
+    "Conditions": { "IsPrd": { "Fn::Equals": [ { "Ref": "Env" }, "prd" ] } },
+    "Resources": {
+        "Queue": {
+            "Type": "AWS::SSM::Document",
+            "Properties": { "Tags": [ { "Key": "Env", "Value": { "Ref": "Env" } } ] }
+        },
+        "Alarm": {
+            "Type": "AWS::SNS::Topic",
+            "Condition": "IsPrd",
+            "Properties": { "TopicName": "alarm" }
+        },
+        "Subscription": {
+            "Type": "AWS::SNS::Subscription",
+            "DependsOn": "Queue",
+            "Properties": {
+                "Endpoint": { "Ref": "Queue" },
+                "TopicArn": { "Fn::GetAtt": [ "Later", "Ref" ] },
+                "Name": { "Fn::If": [ "IsPrd", "prd", { "Ref": "AWS::NoValue" } ] }
+            }
+        },
+        "Later": { "Type": "AWS::SSM::Document", "Properties": { "Name": { "Fn::Sub": "${Env}-later-ü" } } }
+    },
+    "Outputs": { "Url": { "Value": { "Ref": "Queue" }, "Export": { "Name": { "Fn::Sub": "${AWS::StackName}-url" } } } }
+}
+
+@pytest.fixture
+def context():
+    context = TemplateContext("123456789012", "eu-west-1", "app")
+    context.stack_id = derived_stack_id(context)
+    return context
+
+def expected(context, template):
+    parser = TemplateParser(context, json.loads(json.dumps(template)), get_attribute=get_attribute, use_parameter_defaults=True)
+    parser.resolve()
+    return json.dumps(parser.data, indent=2).encode()
+
+@pytest.mark.parametrize("template", [TEMPLATE, { "Parameters": {} }, { "Resources": {} }, {}])
+def test_same_as_resolve(context, template, monkeypatch):
+    monkeypatch.setattr(stream, "orjson", None)
+    output = io.BytesIO()
+    data = flatten_stream(context, io.BytesIO(json.dumps(template, indent=4).encode()), output, get_attribute, True)
+    assert output.getvalue() == expected(context, template)
+    assert "Resources" not in data
+
+def test_getters_update_resources(context, monkeypatch):
+    # the attribute getter adds metadata to a document without a name after it was written to the spool
+    # and resolves the name of a document before it is resolved itself
+    monkeypatch.setattr(stream, "orjson", None)
+    output = io.BytesIO()
+    data = flatten_stream(context, io.BytesIO(json.dumps(TEMPLATE, ensure_ascii=False).encode()), output, get_attribute, True)
+    result = json.loads(output.getvalue())
+    assert result["Resources"]["Queue"]["Metadata"] == { "aws:resolver:Name": "queue" }
+    assert result["Resources"]["Subscription"]["Properties"]["TopicArn"] == "dev-later-ü"
+    assert result["Resources"]["Later"]["Properties"]["Name"] == "dev-later-ü"
+    assert "Alarm" not in result["Resources"]
+    assert data["Outputs"]["Url"]["Export"]["Name"] == "app-url"
+
+def test_orjson(context):
+    pytest.importorskip("orjson")
+    # values orjson reads or writes differently from json
+    numbers = { "Big": 10 ** 20, "Negative": -2 ** 63 - 1, "Max": 2 ** 64 - 1, "Float": 1e20, "Small": 1.5e-7, "Plain": 0.25 }
+    for value in [numbers, "dev-later-ü", [numbers]]:
+        assert stream.dumps(value) == json.dumps(value, indent=2).encode()
+        assert stream.loads(json.dumps(value, ensure_ascii=False).encode()) == value
+    assert type(stream.loads(b"100000000000000000000")) is int
+    template = { **TEMPLATE, "Resources": { **TEMPLATE["Resources"], "Numbers": { "Type": "AWS::SSM::Document", "Properties": numbers } } }
+    output = io.BytesIO()
+    flatten_stream(context, io.BytesIO(json.dumps(template, ensure_ascii=False).encode()), output, get_attribute, True)
+    assert output.getvalue() == expected(context, template)
+
+def test_index_template():
+    text = json.dumps(TEMPLATE, ensure_ascii=False).encode()
+    sections, index = index_template(io.BytesIO(text))
+    assert list(sections) == list(TEMPLATE)
+    assert sections["Resources"] is None
+    assert sections["Parameters"] == TEMPLATE["Parameters"]
+    start, end, type, condition = index["Alarm"]
+    assert json.loads(text[start:end]) == TEMPLATE["Resources"]["Alarm"]
+    assert (type, condition) == ("AWS::SNS::Topic", "IsPrd")
+
+def test_reader_chunks():
+    # values and keys that are split over chunks, in the middle of a multi-byte character too
+    text = json.dumps({ "Description": "ü" * 10, "Version": 12345, "Resources": { "Ü" * 5: { "Type": "T", "Properties": { "P": "ü" * 7 } } } }, ensure_ascii=False).encode()
+    for chunk_size in range(1, 12):
+        reader = Reader(io.BytesIO(text), chunk_size)
+        keys = []
+        for key in reader.members():
+            keys.append(key)
+            start = reader.offset
+            value = reader.value()
+            assert json.loads(text[start:reader.offset]) == value
+        assert keys == ["Description", "Version", "Resources"]
+        assert value["Ü" * 5]["Properties"]["P"] == "ü" * 7
+
+@pytest.mark.parametrize("text", ['{"Resources": {"A": {}}}', '{"Resources": {"A": {"Type": "T"}', '{} {}', '[]', '{"A": 1', ''])
+def test_invalid(text):
+    with pytest.raises(Exception):
+        index_template(io.BytesIO(text.encode()))
+
+def test_language_extensions(context):
+    template = { "Transform": "AWS::LanguageExtensions", "Resources": { "Fn::ForEach::X": [ "Name", [ "A" ], { "Topic${Name}": { "Type": "AWS::SNS::Topic" } } ] } }
+    with pytest.raises(Exception, match="can not be streamed"):
+        flatten_stream(context, io.BytesIO(json.dumps(template).encode()), io.BytesIO(), get_attribute)